@@ -0,0 +1,340 @@
+import os
+import re
+import sys
+import gzip
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス内ロックのみで動作
+    fcntl = None
+
+# ---------------------------------------------------------
+# 1. 監査ログのアーカイブ（runs/ の生応答・reviews/ のレビューを小さなファイルの山にしない）
+#    <RUN_ARCHIVE_DIR>/seg-<番号>.gz : 1レコード = 1つの独立した gzip メンバー（`zcat` でそのまま全件読める）
+#    <RUN_ARCHIVE_DIR>/index.db      : run / ステージ / ステップ / ロール / 判定 / 時刻 → (セグメント, 位置, 長さ)
+#    検索は索引だけで絞り込み、本文は一致したレコードの分だけ展開する。
+# ---------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ARCHIVE_DIR = os.getenv("RUN_ARCHIVE_DIR") or os.path.join(BASE_DIR, "archive")
+ENABLED = os.getenv("RUN_ARCHIVE", "1") != "0"
+SEGMENT_BYTES = int(os.getenv("RUN_ARCHIVE_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL,        -- graph の run ID / ファクトリのターゲット名
+    name TEXT NOT NULL,       -- 元のファイル名（step3_02_refine.txt_raw.txt, target_v2_rev.txt など）
+    kind TEXT NOT NULL,       -- raw / review / stress / calls / summary / file
+    stage TEXT,
+    step INTEGER,
+    role TEXT,
+    status TEXT,              -- raw: ok / cached / repaired、review: DONE / CONTINUE / ABORT / CONVERGED
+    ts REAL NOT NULL,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL,    -- 展開後のバイト数
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_run ON records(run, name);
+CREATE INDEX IF NOT EXISTS records_ts ON records(ts);
+CREATE INDEX IF NOT EXISTS records_kind ON records(kind, status, ts);
+"""
+
+_STEP_RE = re.compile(r"^step(\d+)_(.+)_raw\.txt$")
+_REVIEW_RE = re.compile(r"^(.+)_v(\d+)_(rev|stress)\.txt$")
+_STATUS_RE = re.compile(r"\[STATUS:\s*([A-Z]+)\s*\]")
+
+_local_lock = threading.Lock()
+_init_lock = threading.Lock()
+_initialized = set()
+_thread = threading.local()
+
+def _db_path():
+    return os.path.join(ARCHIVE_DIR, "index.db")
+
+def _connect():
+    """
+    スレッドごとに1本の接続を使い回す（sqlite3 の接続はスレッド間で共有しない）。
+    呼び出しのたびに開閉すると、最後の接続を閉じるたびに WAL の書き戻しが走って書き込み量が膨らむ
+    """
+    path = _db_path()
+    conn = getattr(_thread, "conns", {}).get(path)
+    if conn is not None: return conn
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout = 30000")
+    conn.execute("PRAGMA synchronous = NORMAL")  # WAL では落ちても索引は壊れない（直前の数件が消えるだけ）
+    with _init_lock:
+        if path not in _initialized:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(_SCHEMA)
+            _initialized.add(path)
+    _thread.__dict__.setdefault("conns", {})[path] = conn
+    return conn
+
+@contextmanager
+def _locked():
+    """セグメントへの追記と索引の登録を、プロセスをまたいで直列化する"""
+    with _local_lock:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        with open(os.path.join(ARCHIVE_DIR, "archive.lock"), "a+") as lock_fd:
+            if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+def _active_segment():
+    """書き込み中のセグメント（上限を超えていれば次の番号へ進む）"""
+    names = sorted(n for n in os.listdir(ARCHIVE_DIR) if n.startswith("seg-") and n.endswith(".gz"))
+    if names and os.path.getsize(os.path.join(ARCHIVE_DIR, names[-1])) < SEGMENT_BYTES: return names[-1]
+    number = int(names[-1][4:-3]) + 1 if names else 1
+    return f"seg-{number:06d}.gz"
+
+# ---------------------------------------------------------
+# 2. 書き込み
+# ---------------------------------------------------------
+def describe(name):
+    """ファイル名の規約から索引の項目を推定する（生応答・レビュー・計測ファイル）"""
+    m = _STEP_RE.match(name)
+    if m: return {"kind": "raw", "step": int(m.group(1)), "stage": m.group(2), "role": m.group(2)}
+    if name.endswith("_raw.txt"): return {"kind": "raw", "stage": name[:-len("_raw.txt")], "role": name[:-len("_raw.txt")]}
+    m = _REVIEW_RE.match(name)
+    if m: return {"kind": "review" if m.group(3) == "rev" else "stress", "stage": f"v{m.group(2)}"}
+    if name == "calls.jsonl": return {"kind": "calls"}
+    if name == "summary.json": return {"kind": "summary"}
+    return {"kind": "file"}
+
+def put(run, name, text, ts=None, **fields):
+    """
+    1レコードを書き込んで索引の ID を返す。kind / stage / step / role / status は省略するとファイル名から推定する。
+    同じ run・名前・内容のレコードが既にあれば書かずにその ID を返す（移行のやり直しで重複しない）
+    """
+    data = text.encode("utf-8") if isinstance(text, str) else text
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    meta = dict(describe(name), **{k: v for k, v in fields.items() if v is not None})
+    if meta.get("status") is None and meta["kind"] in ("review", "stress"):
+        m = _STATUS_RE.search(data[:200].decode("utf-8", "replace"))
+        if m: meta["status"] = m.group(1)
+    blob = gzip.compress(data, mtime=0)
+    conn = _connect()
+    with _locked():
+        row = conn.execute("SELECT id FROM records WHERE run = ? AND name = ? AND hash = ?", (run, name, digest)).fetchone()
+        if row: return row["id"]
+        segment = _active_segment()
+        with open(os.path.join(ARCHIVE_DIR, segment), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(blob)
+        # 本文を書き終えてから索引に載せる（途中で落ちても、索引に無い末尾のバイトは読まれないだけ）
+        cur = conn.execute(
+            "INSERT INTO records (run, name, kind, stage, step, role, status, ts, segment, offset, length, size, hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run, name, meta["kind"], meta.get("stage"), meta.get("step"), meta.get("role"), meta.get("status"),
+             ts or time.time(), segment, offset, len(blob), len(data), digest))
+        return cur.lastrowid
+
+# ---------------------------------------------------------
+# 3. 検索と読み出し
+# ---------------------------------------------------------
+def query(run=None, stage=None, kind=None, status=None, role=None, since=None, until=None, limit=None):
+    """索引だけで絞り込む（run / stage / role は fnmatch 形式のパターン可）。新しい順"""
+    where, args = [], []
+    for column, value in (("run", run), ("stage", stage), ("role", role)):
+        if value: where.append(f"{column} GLOB ?"); args.append(value)
+    for column, value in (("kind", kind), ("status", status)):
+        if value: where.append(f"{column} = ?"); args.append(value)
+    if since is not None: where.append("ts >= ?"); args.append(since)
+    if until is not None: where.append("ts < ?"); args.append(until)
+    sql = "SELECT * FROM records" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY ts DESC, id DESC"
+    if limit: sql += f" LIMIT {int(limit)}"
+    return [dict(r) for r in _connect().execute(sql, args)]
+
+def get(record_id):
+    row = _connect().execute("SELECT * FROM records WHERE id = ?", (record_id,)).fetchone()
+    return dict(row) if row else None
+
+def read(record):
+    """1レコードの本文（そのレコードの gzip メンバーだけを読んで展開する）"""
+    with open(os.path.join(ARCHIVE_DIR, record["segment"]), "rb") as f:
+        f.seek(record["offset"])
+        return gzip.decompress(f.read(record["length"])).decode("utf-8", "replace")
+
+def keep(run, name, text, fallback_dir):
+    """
+    再開時に読み直す記録（レビュー・耐衝撃テスト）を保存し、fetch で読める参照を返す。
+    有効ならアーカイブにだけ入れ、無効なら従来通り fallback_dir/name のファイルに書いてそのパスを返す
+    """
+    if ENABLED: return f"archive:{put(run, name, text)}"
+    path = os.path.join(fallback_dir, name)
+    with open(path, "w", encoding="utf-8") as f: f.write(text)
+    return path
+
+def fetch(ref, default=""):
+    """keep の参照（アーカイブの記録かファイルのパス）から本文を読む。見つからなければ default"""
+    if not ref: return default
+    if ref.startswith("archive:"):
+        record = get(int(ref[len("archive:"):]))
+        return read(record) if record else default
+    try:
+        with open(ref, "r", encoding="utf-8") as f: return f.read()
+    except OSError:
+        return default
+
+def export(run, dest_dir):
+    """run のレコードを元のファイル名で dest_dir へ書き戻す（同名が複数あれば最新のもの）。書いたファイル数を返す"""
+    os.makedirs(dest_dir, exist_ok=True)
+    written = set()
+    for record in query(run=run):
+        if record["name"] in written: continue
+        with open(os.path.join(dest_dir, record["name"]), "w", encoding="utf-8") as f: f.write(read(record))
+        written.add(record["name"])
+    return len(written)
+
+def stats():
+    conn = _connect()
+    row = conn.execute("SELECT COUNT(*) AS records, COUNT(DISTINCT run) AS runs, COALESCE(SUM(size), 0) AS raw_bytes, "
+                       "COALESCE(SUM(length), 0) AS stored_bytes, MIN(ts) AS first_ts, MAX(ts) AS last_ts FROM records").fetchone()
+    kinds = {r["kind"]: r["n"] for r in conn.execute("SELECT kind, COUNT(*) AS n FROM records GROUP BY kind")}
+    result = dict(row)
+    result["kinds"] = kinds
+    result["segments"] = sum(1 for n in os.listdir(ARCHIVE_DIR) if n.startswith("seg-"))
+    result["ratio"] = round(result["raw_bytes"] / result["stored_bytes"], 2) if result["stored_bytes"] else None
+    return result
+
+# ---------------------------------------------------------
+# 4. 既存の runs/ と reviews/ の移行
+# ---------------------------------------------------------
+def pack_run(run_dir, remove=True):
+    """runs/<id>/ の全ファイルをアーカイブへ入れ、remove なら元のディレクトリを消す。入れたファイル数を返す"""
+    run = os.path.basename(os.path.normpath(run_dir))
+    packed = 0
+    for name in sorted(os.listdir(run_dir)):
+        path = os.path.join(run_dir, name)
+        if not os.path.isfile(path): continue
+        with open(path, "rb") as f: put(run, name, f.read(), ts=os.path.getmtime(path))
+        packed += 1
+    if remove:
+        for name in os.listdir(run_dir):
+            path = os.path.join(run_dir, name)
+            if os.path.isfile(path): os.remove(path)
+        try: os.rmdir(run_dir)
+        except OSError: pass  # 想定外のサブディレクトリは残す
+    return packed
+
+def pack_reviews(reviews_dir, min_age_sec=0, remove=True):
+    """reviews/ のレビュー・耐衝撃テストをターゲット名を run としてアーカイブへ入れる（min_age_sec より新しいものは残す）"""
+    packed, cutoff = 0, time.time() - min_age_sec
+    for name in sorted(os.listdir(reviews_dir)):
+        path = os.path.join(reviews_dir, name)
+        m = _REVIEW_RE.match(name)
+        if not m or not os.path.isfile(path) or os.path.getmtime(path) > cutoff: continue
+        with open(path, "rb") as f: put(m.group(1), name, f.read(), ts=os.path.getmtime(path))
+        if remove: os.remove(path)
+        packed += 1
+    return packed
+
+def migrate(runs_dir=None, reviews_dir=None, min_age_sec=24 * 3600, remove=True):
+    """
+    最後の書き込みから min_age_sec 以上経った run とレビューを移行する。
+    実行中の run・チェックポイントから再開しうる直近のレビューを消さないための猶予
+    """
+    totals = {"runs": 0, "files": 0, "reviews": 0}
+    cutoff = time.time() - min_age_sec
+    if runs_dir and os.path.isdir(runs_dir):
+        for name in sorted(os.listdir(runs_dir)):
+            run_dir = os.path.join(runs_dir, name)
+            if not os.path.isdir(run_dir): continue
+            files = [os.path.join(run_dir, n) for n in os.listdir(run_dir)]
+            if max([os.path.getmtime(run_dir)] + [os.path.getmtime(p) for p in files]) > cutoff: continue
+            totals["files"] += pack_run(run_dir, remove)
+            totals["runs"] += 1
+            print(f"  📦 {name}: {len(files)}ファイル")
+    if reviews_dir and os.path.isdir(reviews_dir):
+        totals["reviews"] = pack_reviews(reviews_dir, min_age_sec, remove)
+    return totals
+
+# ---------------------------------------------------------
+# 5. CLI
+# ---------------------------------------------------------
+def _parse_time(text):
+    """"7d" / "12h" / "30m"（現在からの相対）または ISO 形式の日時を UNIX 時刻にする"""
+    m = re.fullmatch(r"(\d+(?:\.\d+)?)([dhm])", text.strip())
+    if m: return time.time() - float(m.group(1)) * {"d": 86400, "h": 3600, "m": 60}[m.group(2)]
+    return datetime.fromisoformat(text.strip()).timestamp()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="監査ログのアーカイブを検索・移行する")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("query", help="索引で絞り込んで一覧（--grep / --show のときだけ本文を展開する）")
+    p.add_argument("--run")
+    p.add_argument("--stage")
+    p.add_argument("--kind")
+    p.add_argument("--status")
+    p.add_argument("--role")
+    p.add_argument("--since", help="7d / 12h / 30m または 2025-01-31T09:00")
+    p.add_argument("--until")
+    p.add_argument("--grep", help="本文に含まれる正規表現")
+    p.add_argument("--show", action="store_true", help="本文も表示する")
+    p.add_argument("-n", type=int, default=50)
+    p = sub.add_parser("cat", help="1レコードの本文")
+    p.add_argument("id", type=int)
+    sub.add_parser("stats", help="件数・圧縮率・セグメント数")
+    p = sub.add_parser("export", help="run を元のファイル群としてディレクトリへ書き戻す")
+    p.add_argument("run")
+    p.add_argument("dest")
+    p = sub.add_parser("pack", help="既存の runs/ と reviews/ をアーカイブへ移行する")
+    p.add_argument("--runs", default=os.getenv("TELEMETRY_DIR") or os.path.join(BASE_DIR, "runs"))
+    p.add_argument("--reviews", default=os.path.join(BASE_DIR, "reviews"))
+    p.add_argument("--min-age-hours", type=float, default=24, help="これより新しい run・レビューは残す")
+    p.add_argument("--keep", action="store_true", help="移行後も元のファイルを消さない")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "query":
+        since = _parse_time(args.since) if args.since else None
+        until = _parse_time(args.until) if args.until else None
+        # 本文の検索は索引で絞った候補だけを展開する（件数の上限は一致したものに掛ける）
+        rows = query(args.run, args.stage, args.kind, args.status, args.role, since, until, None if args.grep else args.n)
+        pattern = re.compile(args.grep) if args.grep else None
+        shown = 0
+        for record in rows:
+            if shown >= args.n: break
+            text = read(record) if pattern or args.show else None
+            if pattern and not pattern.search(text): continue
+            shown += 1
+            when = datetime.fromtimestamp(record["ts"]).strftime("%Y-%m-%d %H:%M:%S")
+            step = f"#{record['step']}" if record["step"] is not None else ""
+            print(f"{record['id']:>7} {when} {record['run'][:24]:<24} {record['kind']:<7} {(record['stage'] or '') + step:<28} "
+                  f"{record['status'] or '-':<9} {record['size']:>8}B")
+            if args.show: print(text.rstrip() + "\n" + "-" * 40)
+    elif args.cmd == "cat":
+        record = get(args.id)
+        if record is None: sys.exit(f"レコード {args.id} はありません。")
+        print(read(record))
+    elif args.cmd == "export":
+        count = export(args.run, args.dest)
+        if not count: sys.exit(f"run {args.run} のレコードはありません。")
+        print(f"{count}ファイルを {args.dest} へ書き出しました。")
+    elif args.cmd == "stats":
+        result = stats()
+        for key in ("records", "runs", "segments", "raw_bytes", "stored_bytes", "ratio"): print(f"{key:<13} {result[key]}")
+        print(f"{'kinds':<13} {result['kinds']}")
+        if result["first_ts"]:
+            span = " 〜 ".join(datetime.fromtimestamp(result[k]).strftime("%Y-%m-%d %H:%M") for k in ("first_ts", "last_ts"))
+            print(f"{'span':<13} {span}")
+    elif args.cmd == "pack":
+        started = time.time()
+        totals = migrate(args.runs, args.reviews, args.min_age_hours * 3600, remove=not args.keep)
+        print(f"📦 run {totals['runs']}件（{totals['files']}ファイル）/ レビュー {totals['reviews']}件を移行しました "
+              f"({time.time() - started:.1f}s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+import ledger
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス内ロックのみで動作
+    fcntl = None
+
+# ---------------------------------------------------------
+# 1. 世代付き成果物の台帳（系列ごとのマニフェストで最新版を O(1) で引く）
+#    <manifest_dir>/<系列名>.json = {"latest": N, "versions": {"N": {path, hash, size, ts, compressed}}}
+#    ディレクトリ走査は、マニフェストが無い系列の初回だけ（既存の workspace からの移行）。
+# ---------------------------------------------------------
+RETENTION = os.getenv("ARTIFACT_RETENTION", "keep").lower()  # keep=全世代を残す / compress=古い世代をgzip / prune=古い世代を削除
+KEEP_VERSIONS = max(2, int(os.getenv("ARTIFACT_KEEP_VERSIONS", "10")))  # そのまま残す最新世代の数（前世代参照のため最低2）
+
+_local_lock = threading.Lock()
+
+def manifest_path(manifest_dir, family):
+    return os.path.join(manifest_dir, f"{family}.json")
+
+@contextmanager
+def _locked(manifest_dir):
+    with _local_lock:
+        os.makedirs(manifest_dir, exist_ok=True)
+        with open(os.path.join(manifest_dir, ".lock"), "a+") as lock_fd:
+            if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+def load(manifest_dir, family):
+    try:
+        with open(manifest_path(manifest_dir, family), "r", encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save(manifest_dir, family, manifest):
+    path = manifest_path(manifest_dir, family)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f: json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""): digest.update(block)
+    return digest.hexdigest()[:16]
+
+def _entry(path):
+    return {"path": path, "hash": _file_hash(path), "size": os.path.getsize(path),
+            "ts": os.path.getmtime(path), "compressed": path.endswith(".gz")}
+
+# ---------------------------------------------------------
+# 2. 参照
+# ---------------------------------------------------------
+def rebuild(manifest_dir, family, scan_dir, prefix):
+    """scan_dir の <prefix>_vN* を一度だけ走査してマニフェストを作る"""
+    pattern = re.compile(rf"^{re.escape(prefix)}_v(\d+)(?:\.|$)")
+    manifest = {"latest": 0, "versions": {}}
+    for name in os.listdir(scan_dir):
+        m = pattern.match(name)
+        path = os.path.join(scan_dir, name)
+        if not m or not os.path.isfile(path): continue
+        manifest["versions"][m.group(1)] = _entry(path)
+        manifest["latest"] = max(manifest["latest"], int(m.group(1)))
+    with _locked(manifest_dir):
+        current = load(manifest_dir, family)
+        if current is not None: return current
+        _save(manifest_dir, family, manifest)
+    return manifest
+
+def latest(manifest_dir, family, scan_dir=None, prefix=None):
+    """系列の最新世代番号（無ければ 0）。マニフェストが無ければ scan_dir から作る"""
+    manifest = load(manifest_dir, family)
+    if manifest is None and scan_dir: manifest = rebuild(manifest_dir, family, scan_dir, prefix or family)
+    return manifest["latest"] if manifest else 0
+
+def latest_path(manifest_dir, family, scan_dir=None, prefix=None):
+    """最新世代のパス（無ければ None）"""
+    version = latest(manifest_dir, family, scan_dir, prefix)
+    entry = load(manifest_dir, family)["versions"].get(str(version)) if version else None
+    return entry["path"] if entry else None
+
+def read(path):
+    """gzip 済みの古い世代もそのまま読む"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f: return f.read()
+
+# ---------------------------------------------------------
+# 3. 登録と世代の整理
+# ---------------------------------------------------------
+def record(manifest_dir, family, version, path):
+    """書き終えた世代をマニフェストに載せ、保持方針に従って古い世代を整理する"""
+    entry = _entry(path)
+    with _locked(manifest_dir):
+        manifest = load(manifest_dir, family) or {"latest": 0, "versions": {}}
+        manifest["versions"][str(version)] = entry
+        manifest["latest"] = max(manifest["latest"], int(version))
+        if RETENTION in ("compress", "prune"): _apply_retention(manifest)
+        manifest["updated"] = time.time()
+        _save(manifest_dir, family, manifest)
+    ledger.append("artifact", family, wait=False, version=int(version), path=path, hash=entry["hash"])
+    return entry
+
+def _apply_retention(manifest):
+    old = sorted((int(v) for v in manifest["versions"]), reverse=True)[KEEP_VERSIONS:]
+    for v in old:
+        entry = manifest["versions"][str(v)]
+        if RETENTION == "prune":
+            try: os.remove(entry["path"])
+            except OSError: pass
+            del manifest["versions"][str(v)]
+        elif not entry["compressed"] and os.path.exists(entry["path"]):
+            gz_path = entry["path"] + ".gz"
+            with open(entry["path"], "rb") as src, gzip.open(gz_path, "wb") as dst: shutil.copyfileobj(src, dst)
+            os.remove(entry["path"])
+            entry.update(path=gz_path, size=os.path.getsize(gz_path), compressed=True)
@@ -0,0 +1,413 @@
+import os
+import re
+import sys
+import json
+import glob
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import types
+import subprocess
+from contextlib import redirect_stdout
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# ---------------------------------------------------------
+# オフライン再生ベンチマーク
+#   genai.Client をローカルの代役に差し替え、記録済み応答（runs/<id>/*_raw.txt）の再生か
+#   合成応答（遅延・429注入・壊れたJSON注入つき）で各エンジンを端から端まで回し、
+#   壁時計時間・呼び出し数・リトライ/待機時間・ファイルI/O量・ピークRSSを計測する。
+#
+#   python bench_replay.py                       # 全シナリオ
+#   python bench_replay.py pipeline graph --latency 0.2 --p429 0.1 --json bench.json
+#   python bench_replay.py graph --replay runs/20250101-120000 --compare bench.json
+#   python bench_replay.py graph --replay 20250101-120000          # アーカイブ済みの run ID でも可
+# ---------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ["pipeline", "graph", "evolution", "ideation", "batch"]
+CHILD_MARKER = "@@BENCH_RESULT@@"
+
+_real_time = time.time
+_real_sleep = time.sleep
+
+# ---------------------------------------------------------
+# 1. 仮想時計（バックオフ/レート制限の待機を実際には寝ずに数える）
+# ---------------------------------------------------------
+class VirtualClock:
+    def __init__(self):
+        self.offset = 0.0
+        self.slept = 0.0
+        self.lock = threading.Lock()
+
+    def time(self):
+        return _real_time() + self.offset
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.offset += max(0.0, seconds)
+            self.slept += max(0.0, seconds)
+
+    def install(self):
+        time.time = self.time
+        time.sleep = self.sleep
+
+# ---------------------------------------------------------
+# 2. genai.Client の代役
+# ---------------------------------------------------------
+class FakeAPIError(Exception):
+    pass
+
+class _FakeUsage:
+    def __init__(self, prompt_tokens, response_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+        self.total_token_count = prompt_tokens + response_tokens
+
+class _FakeResponse:
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage_metadata = usage
+
+class FakeBackend:
+    """応答の生成方針と計測値を持つ。全 FakeClient インスタンスで共有される"""
+    def __init__(self, opts, replay=()):
+        self.opts = opts
+        self.replay = list(replay)
+        self.lock = threading.Lock()
+        self.rng = random.Random(opts.get("seed", 0))
+        self.counts = {"calls": 0, "replayed": 0, "injected_429": 0, "injected_bad_json": 0, "injected_bad_status": 0, "tokens_in": 0, "tokens_out": 0}
+        self.roles = {}
+        self.models = {}
+        self.seq = {"json": 0, "review": 0, "architect": 0}
+
+    def _role(self, prompt):
+        m = re.search(r"Role:\s*([^\n.(（]+)", prompt)
+        if '"artifact_edits"' in prompt: return "graph_patch"
+        if '"next_stage"' in prompt: return "graph_node"
+        if '"new_l2_markdown"' in prompt: return "librarian"
+        return m.group(1).strip() if m else "stage"
+
+    def _synthesize(self, prompt, role):
+        o = self.opts
+        if role in ("graph_node", "graph_patch"):
+            self.seq["json"] += 1
+            next_stage = "END" if self.seq["json"] >= o["graph_steps"] else "02_refine.txt"
+            # 成果物はステップごとに response_bytes ずつ育つ（patch では追記分だけを返す）
+            addition = f"成果物 step {self.seq['json']}\n" + "x" * o["response_bytes"] + "\n"
+            body = {"thought_process": "bench", "l1_memory": f"L1 step {self.seq['json']}", "next_stage": next_stage}
+            if role == "graph_patch":
+                body["artifact_edits"] = [{"find": "", "replace": addition}]
+            else:
+                m = re.search(r"\[Current Artifact\]: (.*?)\n-{20,}", prompt, re.DOTALL)
+                body["artifact"] = (m.group(1) if m else "") + addition
+            text = json.dumps(body, ensure_ascii=False)
+            if self.rng.random() < o["p_bad_json"]:
+                self.counts["injected_bad_json"] += 1
+                text = text[:-1] + ",\n"  # 末尾の閉じ括弧欠落 + 余計なカンマ
+            return text
+        if role == "librarian":
+            return json.dumps({"deleted_rules": "なし", "added_rules": "bench", "new_l2_markdown": "- bench rule"}, ensure_ascii=False)
+        if "[STATUS: DONE / CONTINUE / ABORT]" in prompt:
+            self.seq["review"] += 1
+            status = "CONTINUE" if self.seq["review"] <= o["review_continue"] else "DONE"
+            if self.rng.random() < o.get("p_bad_status", 0.0):
+                self.counts["injected_bad_status"] += 1
+                return f"判定: {status}\nbench baton {self.seq['review']}"  # 判定行の書式崩れ
+            baton = re.search(r"【🐾 [^】]+】", prompt)
+            return f"[STATUS: {status}]\n{baton.group(0) if baton else ''}bench baton {self.seq['review']}"
+        if "Architect" in role:
+            self.seq["architect"] += 1
+            n = self.seq["architect"]
+            if "Concept" in role:
+                return f"概念 第{n}版\n" + "\n".join(f"- 論点{i}: 世代{n}の主張" for i in range(o["response_bytes"] // 40 + 1))
+            chunk = re.search(r"【書き換え対象: (\w+)", prompt)
+            if chunk:  # 分割進化: 指名された関数だけを返す
+                return f"def {chunk.group(1)}():\n    return {n}\n"
+            return "\n".join(f"def f{i}():\n    return {n} + {i}\n" for i in range(o["response_bytes"] // 40 + 1))
+        return f"{role} bench output\n" + "y" * o["response_bytes"]
+
+    def respond(self, prompt, model=None):
+        prompt = str(prompt)
+        with self.lock:
+            self.counts["calls"] += 1
+            role = self._role(prompt)
+            self.roles[role] = self.roles.get(role, 0) + 1
+            self.models[str(model)] = self.models.get(str(model), 0) + 1
+            fail_429 = self.rng.random() < self.opts["p429"]
+            delay = max(0.0, self.opts["latency"] + self.rng.uniform(-self.opts["jitter"], self.opts["jitter"]))
+        _real_sleep(delay)  # ネットワーク遅延の模擬（仮想時計ではなく実際に待つ）
+        with self.lock:
+            if fail_429:
+                self.counts["injected_429"] += 1
+                raise FakeAPIError("429 RESOURCE_EXHAUSTED. {'retryDelay': '1s'}")
+            if self.replay:
+                self.counts["replayed"] += 1
+                text = self.replay.pop(0)
+            else:
+                text = self._synthesize(prompt, role)
+        from rate_limiter import estimate_tokens
+        usage = _FakeUsage(estimate_tokens(prompt), estimate_tokens(text))
+        with self.lock:
+            self.counts["tokens_in"] += usage.prompt_token_count
+            self.counts["tokens_out"] += usage.candidates_token_count
+        return _FakeResponse(text, usage)
+
+BACKEND = None
+
+class _FakeModels:
+    def generate_content(self, model, contents, config=None, **kwargs):
+        return BACKEND.respond(contents, model)
+
+    def generate_content_stream(self, model, contents, config=None, **kwargs):
+        res = BACKEND.respond(contents, model)
+        step = max(1, len(res.text) // 8)
+        for i in range(0, len(res.text), step):
+            yield _FakeResponse(res.text[i:i + step])
+        yield _FakeResponse("", res.usage_metadata)
+
+class FakeClient:
+    def __init__(self, *args, **kwargs):
+        self.models = _FakeModels()
+
+def load_replay(run_dir):
+    """runs/<id>/ の *_raw.txt を step 番号順に読み込む（librarian は最後）"""
+    def order(path):
+        m = re.match(r"step(\d+)_", os.path.basename(path))
+        return (0, int(m.group(1))) if m else (1, os.path.basename(path))
+    return [open(p, "r", encoding="utf-8").read() for p in sorted(glob.glob(os.path.join(run_dir, "*_raw.txt")), key=order)]
+
+# ---------------------------------------------------------
+# 3. シナリオ（一時ディレクトリに作業ツリーを複製して実行）
+# ---------------------------------------------------------
+def prepare_root(root, scenario, opts):
+    for path in glob.glob(os.path.join(BASE_DIR, "*.py")):
+        shutil.copy(path, root)
+    for d in ["order", "stages", "original", "workspace", "reviews", "runs", "external"]:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    def write(rel, text):
+        with open(os.path.join(root, rel), "w", encoding="utf-8") as f: f.write(text)
+    write("order/order.txt", "ベンチマーク用の指令: 構造を保ったまま改善せよ。")
+    write("order/purpose.txt", "事実と推測を分離し、論理的破綻を排除せよ。")
+    if scenario in ("pipeline", "batch"):
+        for i in range(1, opts["stages"] + 1):
+            write(f"stages/{i:02d}_stage.txt", f"Role: Stage{i}.\nステージ{i}の分析を行え。")
+    if scenario == "batch":
+        os.makedirs(os.path.join(root, "orders"), exist_ok=True)
+        for k in range(opts["orders"]):
+            write(f"orders/{k:04d}.txt", f"ベンチマーク用の指令 {k}: 構造を保ったまま改善せよ。")
+    elif scenario == "graph":
+        write("stages/01_init.txt", "Role: Initializer.\n初期成果物を作れ。")
+        write("stages/02_refine.txt", "Role: Refiner.\n成果物を磨け。")
+    elif scenario == "evolution":
+        write("order/order.txt", "ベンチマーク用の指令: f1 と f2 の構造を保ったまま改善せよ。")
+        write("original/target.py", "\n".join(f"def f{i}():\n    return {i}\n" for i in range(opts["response_bytes"] // 40 + 1)))
+    elif scenario == "ideation":
+        write("original/concept.md", "初期概念: 観測と記録を分離する。\n")
+
+def run_scenario(root, scenario):
+    if scenario == "pipeline":
+        import engine
+        engine.run_pipeline()
+    elif scenario == "graph":
+        import universal_agent_engine
+        universal_agent_engine.run_agentic_graph()
+    elif scenario == "evolution":
+        import debate_factory
+        debate_factory.run_evolution(os.path.join(root, "original", "target.py"), True, 1)
+    elif scenario == "ideation":
+        import philosophy_factory
+        philosophy_factory.run_ideation(os.path.join(root, "original", "concept.md"), True, 1)
+    elif scenario == "batch":
+        import engine
+        engine.run_batch(os.path.join(root, "orders"))
+
+def _proc_io():
+    """/proc/self/io の読み書きバイト数（Linux 以外では None）"""
+    try:
+        with open("/proc/self/io", "r") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _peak_rss_mb():
+    if resource is None: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+class _FakeOptions:
+    """google.genai.types の設定クラスの代役（キーワード引数を属性として持ち、model_copy で複製できる）"""
+    def __init__(self, **fields): self.__dict__.update(fields)
+    def model_copy(self, update=None): return type(self)(**{**self.__dict__, **(update or {})})
+
+def _import_genai():
+    """google-genai が入っていない環境では、エンジンを import する前に代役のモジュールを登録する"""
+    try:
+        from google import genai
+        return genai
+    except ImportError:
+        pass
+    google = sys.modules.get("google") or types.ModuleType("google")
+    google.__path__ = getattr(google, "__path__", [])
+    genai = types.ModuleType("google.genai")
+    genai.types = types.ModuleType("google.genai.types")
+    genai.types.HttpOptions = type("HttpOptions", (_FakeOptions,), {})
+    genai.types.GenerateContentConfig = type("GenerateContentConfig", (_FakeOptions,), {})
+    genai.errors = types.ModuleType("google.genai.errors")
+    genai.errors.APIError = FakeAPIError
+    google.genai = genai
+    sys.modules.update({"google": google, "google.genai": genai,
+                        "google.genai.types": genai.types, "google.genai.errors": genai.errors})
+    return genai
+
+def child_main(scenario, root, opts):
+    global BACKEND
+    sys.path.insert(0, root)
+    # llm_client が最初の呼び出しで genai.Client を生成する前に差し替える
+    genai = _import_genai()
+    genai.Client = FakeClient
+    BACKEND = FakeBackend(opts, load_replay(opts["replay"]) if opts.get("replay") else ())
+
+    clock = VirtualClock()
+    if not opts["real_sleep"]: clock.install()
+
+    io_before = _proc_io()
+    start = time.perf_counter()
+    error = None
+    sink = sys.stdout if opts["verbose"] else open(os.devnull, "w", encoding="utf-8")
+    try:
+        with redirect_stdout(sink):
+            run_scenario(root, scenario)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - start
+    io_after = _proc_io()
+
+    result = {
+        "scenario": scenario,
+        "wall_s": round(wall, 3),
+        "calls": BACKEND.counts["calls"],
+        # 注入した障害の数ではなく、ラッパーが実際に送り直した回数（壊れたJSONの手元修復は数えない）
+        "retries": sys.modules["telemetry"].retries() if "telemetry" in sys.modules else None,
+        "sleep_s": round(clock.slept, 3),
+        "tokens_in": BACKEND.counts["tokens_in"],
+        "tokens_out": BACKEND.counts["tokens_out"],
+        "io_read_bytes": io_after[0] - io_before[0] if io_before and io_after else None,
+        "io_write_bytes": io_after[1] - io_before[1] if io_before and io_after else None,
+        "peak_rss_mb": round(_peak_rss_mb(), 1) if resource else None,
+        "counts": BACKEND.counts,
+        "roles": BACKEND.roles,
+        "models": BACKEND.models,
+        "keys": sys.modules["llm_client"].stats() if "llm_client" in sys.modules else None,
+        "latency": sys.modules["llm_client"].latency_stats() if "llm_client" in sys.modules else None,
+        "error": error,
+    }
+    print(CHILD_MARKER + json.dumps(result, ensure_ascii=False))
+
+# ---------------------------------------------------------
+# 4. 親プロセス（シナリオごとに子プロセスを起動して集計）
+# ---------------------------------------------------------
+COLUMNS = ["wall_s", "calls", "retries", "sleep_s", "tokens_in", "tokens_out", "io_read_bytes", "io_write_bytes", "peak_rss_mb"]
+
+def print_table(results, baseline=None):
+    print(f"{'scenario':<10} " + " ".join(f"{c:>15}" for c in COLUMNS))
+    for r in results:
+        cells = []
+        for c in COLUMNS:
+            value = r.get(c)
+            cell = "-" if value is None else str(value)
+            base = (baseline or {}).get(r["scenario"], {}).get(c)
+            if isinstance(value, (int, float)) and isinstance(base, (int, float)) and base:
+                cell += f" ({(value - base) / base * 100:+.0f}%)"
+            cells.append(f"{cell:>15}")
+        print(f"{r['scenario']:<10} " + " ".join(cells))
+        if len(r.get("models") or {}) > 1: print(f"  🧭 models: {r['models']}")
+        if r.get("error"): print(f"  ❌ {r['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="オフライン再生ベンチマーク（genai.Client を代役に差し替えて実行）")
+    parser.add_argument("scenarios", nargs="*", help=f"実行するシナリオ（省略時は全部）: {', '.join(SCENARIOS)}")
+    parser.add_argument("--replay", help="記録済み応答を再生する runs/<id> ディレクトリ（またはアーカイブ済みの run ID）")
+    parser.add_argument("--latency", type=float, default=0.05, help="1呼び出しあたりの模擬遅延（秒）")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--p429", type=float, default=0.0, help="429 を注入する確率")
+    parser.add_argument("--p-bad-json", type=float, default=0.0, help="graph ノードの応答JSONを壊す確率")
+    parser.add_argument("--p-bad-status", type=float, default=0.0, help="Reviewer の判定行を崩す確率（モデル昇格の確認用）")
+    parser.add_argument("--response-bytes", type=int, default=2000)
+    parser.add_argument("--stages", type=int, default=5, help="pipeline シナリオのステージ数")
+    parser.add_argument("--orders", type=int, default=20, help="batch シナリオの指令数")
+    parser.add_argument("--graph-steps", type=int, default=4, help="graph シナリオで END までのステップ数")
+    parser.add_argument("--review-continue", type=int, default=2, help="Reviewer が DONE を出すまでの CONTINUE 回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--artifact-mode", choices=["full", "patch"], default="full", help="graph シナリオの成果物受け渡し方式")
+    parser.add_argument("--architect-chunking", choices=["off", "auto", "on"], default="auto", help="evolution シナリオの分割進化")
+    parser.add_argument("--keys", type=int, default=1, help="llm_client に渡す擬似APIキーの数（429 時のフェイルオーバー確認用）")
+    parser.add_argument("--real-sleep", action="store_true", help="待機を仮想時計で数えず実際に眠る")
+    parser.add_argument("--cache", action="store_true", help="LLM応答キャッシュを有効にする（シナリオごとに空の状態から）")
+    parser.add_argument("--verbose", action="store_true", help="各エンジンの標準出力を表示する")
+    parser.add_argument("--json", help="結果をJSONで保存するパス（コミット間比較用）")
+    parser.add_argument("--compare", help="以前に --json で保存した結果との差分を表示する")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(args.child, args.root, json.loads(os.environ["BENCH_OPTS"]))
+        return
+
+    scenarios = args.scenarios or SCENARIOS
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown: parser.error(f"未知のシナリオ: {unknown}（選択肢: {SCENARIOS}）")
+
+    replay_dir = os.path.abspath(args.replay) if args.replay else None
+    if args.replay and not os.path.isdir(replay_dir):
+        # runs/ から移行済みの run はアーカイブから一時ディレクトリへ書き戻して再生する
+        import archive
+        replay_dir = tempfile.mkdtemp(prefix="bench_replay_")
+        if not archive.export(os.path.basename(os.path.normpath(args.replay)), replay_dir):
+            parser.error(f"再生する run が見つかりません: {args.replay}")
+    opts = {"replay": replay_dir, "latency": args.latency, "jitter": args.jitter,
+            "p429": args.p429, "p_bad_json": args.p_bad_json, "p_bad_status": args.p_bad_status,
+            "response_bytes": args.response_bytes,
+            "stages": args.stages, "orders": args.orders, "graph_steps": args.graph_steps, "review_continue": args.review_continue,
+            "seed": args.seed, "real_sleep": args.real_sleep, "verbose": args.verbose}
+
+    results = []
+    for scenario in scenarios:
+        root = tempfile.mkdtemp(prefix=f"bench_{scenario}_")
+        try:
+            prepare_root(root, scenario, opts)
+            # レート制限・キャッシュ・台帳・ジョブキュー・計測・アーカイブの状態は一時ディレクトリに閉じ込め、本番の状態を汚さない
+            env = dict(os.environ, BENCH_OPTS=json.dumps(opts), LLM_CACHE="1" if args.cache else "0",
+                       RATE_LIMIT_DIR=os.path.join(root, ".rate_limit"), LLM_CACHE_DIR=os.path.join(root, ".llm_cache"),
+                       RUN_ARCHIVE_DIR=os.path.join(root, "archive"), LEDGER_DIR=os.path.join(root, "ledger"),
+                       JOB_QUEUE_DB=os.path.join(root, ".jobqueue", "jobs.db"), TELEMETRY_DIR=os.path.join(root, "runs"),
+                       GEMINI_API_KEYS=",".join(f"bench-key-{i}" for i in range(args.keys)),
+                       GRAPH_ARTIFACT_MODE=args.artifact_mode, ARCHITECT_CHUNKING=args.architect_chunking)
+            cmd = [sys.executable, os.path.abspath(__file__), "--child", scenario, "--root", root]
+            proc = subprocess.run(cmd, capture_output=True, text=True, cwd=root, env=env)
+            if args.verbose: print(proc.stdout.replace(CHILD_MARKER, "\n") + proc.stderr)
+            lines = [l for l in (proc.stdout or "").splitlines() if l.startswith(CHILD_MARKER)]
+            if lines:
+                results.append(json.loads(lines[-1][len(CHILD_MARKER):]))
+            else:
+                results.append({"scenario": scenario, "error": (proc.stderr or "").strip()[-500:] or f"exit {proc.returncode}"})
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = {r["scenario"]: r for r in json.load(f)}
+    print_table(results, baseline)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
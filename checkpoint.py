@@ -0,0 +1,44 @@
+import os
+import json
+import hashlib
+
+# ---------------------------------------------------------
+# 再開可能なチェックポイント（フェーズ名・世代・L1・成果物ハッシュ）
+# ---------------------------------------------------------
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+def file_hash(path):
+    """ファイル内容のハッシュ（存在しなければ None）"""
+    if not path or not os.path.exists(path): return None
+    with open(path, "r", encoding="utf-8") as f: return content_hash(f.read())
+
+def path_for(checkpoint_dir, name):
+    return os.path.join(checkpoint_dir, f"{name}.json")
+
+def save(checkpoint_dir, name, state):
+    """フェーズ完了ごとに一時ファイル経由で上書きする（途中で落ちても壊れたJSONを残さない）"""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = path_for(checkpoint_dir, name)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f: json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def load(checkpoint_dir, name):
+    try:
+        with open(path_for(checkpoint_dir, name), "r", encoding="utf-8") as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def clear(checkpoint_dir, name):
+    try: os.remove(path_for(checkpoint_dir, name))
+    except OSError: pass
+
+def intact(state, key, path_key, read=None):
+    """
+    チェックポイントに記録した成果物が、同じ内容のまま残っているか。
+    read: 参照から本文を読む関数（無ければ None を返す）。省略時は path_key をファイルのパスとして読む
+    """
+    if read is None: return file_hash(state.get(path_key)) == state.get("hashes", {}).get(key)
+    text = read(state.get(path_key), None)
+    return text is not None and content_hash(text) == state.get("hashes", {}).get(key)
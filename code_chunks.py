@@ -0,0 +1,146 @@
+import os
+import re
+import ast
+import keyword
+
+# ---------------------------------------------------------
+# 大きな Python ターゲットの分割進化（トップレベルの関数・クラス単位で書き換え、元の位置へ戻す）
+#   ARCHITECT_CHUNKING: off=常に全文 / auto=MIN_LINES 行以上の .py だけ分割 / on=.py は常に分割
+#   指令・直近の反省から関係する部分だけを選び、残りはシグネチャの概要として渡す。
+# ---------------------------------------------------------
+MODE = os.getenv("ARCHITECT_CHUNKING", "auto").lower()
+MIN_LINES = int(os.getenv("ARCHITECT_CHUNK_MIN_LINES", "400"))
+TOP_K = int(os.getenv("ARCHITECT_CHUNK_TOP_K", "4"))        # 1ループで書き換える部分の上限
+GLUE_PREVIEW_LINES = 30                                      # 概要に全文を載せるモジュール直下の文の行数
+
+_IDENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_LINE_REF_RE = re.compile(r"\bline (\d+)", re.IGNORECASE)
+_FENCE_RE = re.compile(r"^\s*```[\w+-]*\s*\n(.*?)\n\s*```\s*$", re.DOTALL)
+_COMMON = set(keyword.kwlist) | {"self", "cls", "None", "True", "False", "print", "len", "str", "int", "dict", "list"}
+
+def enabled(source, ext):
+    if MODE == "off" or ext != ".py": return False
+    return MODE == "on" or source.count("\n") + 1 >= MIN_LINES
+
+# ---------------------------------------------------------
+# 1. 分割（ファイル全体を漏れなく覆う、行番号付きの部分の列）
+# ---------------------------------------------------------
+def split(source):
+    """
+    [{"name", "kind" (def/class/module), "start", "end" (1始まり・両端含む), "text", "node"}] を返す。
+    関数・クラスには直前のデコレータと、空行を挟まないコメントを含める。構文エラーなら None
+    """
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return None
+    lines = source.splitlines(keepends=True)
+    defs = []
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)): continue
+        start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+        while start > 1 and lines[start - 2].lstrip().startswith("#"): start -= 1
+        if defs and start <= defs[-1][1]: start = defs[-1][1] + 1
+        defs.append((start, node.end_lineno, node))
+
+    chunks, line, seen = [], 1, {}
+    def glue(start, end):
+        if start > end: return
+        name = "<module header>" if start == 1 else f"<module L{start}-{end}>"
+        chunks.append({"name": name, "kind": "module", "start": start, "end": end,
+                       "text": "".join(lines[start - 1:end]), "node": None})
+    for start, end, node in defs:
+        glue(line, start - 1)
+        kind = "class" if isinstance(node, ast.ClassDef) else "def"
+        # 同名の再定義があっても差し替え先を取り違えないよう、2つ目以降は #N を付ける
+        seen[node.name] = seen.get(node.name, 0) + 1
+        name = node.name if seen[node.name] == 1 else f"{node.name}#{seen[node.name]}"
+        chunks.append({"name": name, "kind": kind, "start": start, "end": end,
+                       "text": "".join(lines[start - 1:end]), "node": node})
+        line = end + 1
+    glue(line, len(lines))
+    return chunks
+
+def _signature(chunk, lines):
+    """デコレータと def/class 行（複数行のシグネチャも含む）と、docstring の1行目"""
+    node = chunk["node"]
+    body_start = node.body[0].lineno
+    head = [l.rstrip() for l in lines[chunk["start"] - 1:max(node.lineno, body_start - 1)]]
+    doc = ast.get_docstring(node)
+    indent = " " * (node.col_offset + 4)
+    if doc: head.append(f'{indent}"""{doc.strip().splitlines()[0]}"""')
+    return head, indent
+
+def outline(chunks, selected, source):
+    """書き換え対象以外をシグネチャだけにしたファイル全体の見取り図"""
+    lines = source.splitlines()
+    out = []
+    for c in chunks:
+        if c["name"] in selected:
+            out.append(f"# <<< 書き換え対象: {c['name']} (L{c['start']}-{c['end']}) >>>")
+        elif c["kind"] == "module":
+            body = c["text"].rstrip("\n").splitlines()
+            if len(body) > GLUE_PREVIEW_LINES:
+                body = body[:GLUE_PREVIEW_LINES] + [f"# ... ({len(body) - GLUE_PREVIEW_LINES}行省略)"]
+            out.extend(body)
+        else:
+            head, indent = _signature(c, lines)
+            out.extend(head)
+            if c["kind"] == "class":
+                for child in c["node"].body:
+                    if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                        method, _ = _signature({"node": child, "start": min([child.lineno] + [d.lineno for d in child.decorator_list])}, lines)
+                        out.extend(method + [f"{indent}    ..."])
+            else:
+                out.append(f"{indent}...")
+            out.append("")
+    return "\n".join(out)
+
+# ---------------------------------------------------------
+# 2. 関係する部分の選択
+# ---------------------------------------------------------
+def _names_in(chunk):
+    """部分が定義する名前（クラスならメソッド名も）"""
+    if chunk["node"] is None: return set()
+    names = {chunk["node"].name}
+    if chunk["kind"] == "class":
+        names |= {n.name for n in chunk["node"].body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    return names
+
+def select(chunks, order, l1, top_k=TOP_K):
+    """
+    指令・直近の反省で名指しされた部分（名前・エラーの行番号）を優先し、残りは識別子の重なりで上位 top_k まで。
+    関係する部分が1つも見つからなければ空（呼び出し側は全文モードへ戻す）
+    """
+    text = f"{order}\n{l1}"
+    words = set(_IDENT_RE.findall(text)) - _COMMON
+    line_refs = {int(n) for n in _LINE_REF_RE.findall(text)}
+    scored = []
+    for c in chunks:
+        score = 10 * len(_names_in(c) & words)
+        score += 10 * sum(1 for n in line_refs if c["start"] <= n <= c["end"])
+        score += len(set(_IDENT_RE.findall(c["text"])) & words - _COMMON)
+        if score: scored.append((score, c["start"], c["name"]))
+    scored.sort(key=lambda s: (-s[0], s[1]))
+    return [name for _, _, name in scored[:top_k]]
+
+# ---------------------------------------------------------
+# 3. 書き換え結果の取り込み
+# ---------------------------------------------------------
+def strip_fence(text):
+    """応答全体が ```python フェンスで囲まれていれば中身だけを取り出す"""
+    m = _FENCE_RE.match(text.strip("\n"))
+    return m.group(1) if m else text
+
+def splice(chunks, replacements):
+    """部分の列を元の順に連結し、書き換えた部分だけ差し替える"""
+    out = []
+    for c in chunks:
+        text = replacements.get(c["name"], c["text"])
+        if text and not text.endswith("\n"): text += "\n"
+        # 書き換えで末尾の空行が消えても、次の定義との間隔は元のまま保つ
+        if c["name"] in replacements:
+            trailing = len(c["text"]) - len(c["text"].rstrip("\n"))
+            text = text.rstrip("\n") + "\n" * max(1, trailing)
+        out.append(text)
+    return "".join(out)
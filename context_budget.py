@@ -0,0 +1,60 @@
+import os
+import rate_limiter
+
+# ---------------------------------------------------------
+# プロンプトのコンテキスト予算（セクションごとにトークンを見積もり、上限を超えたら古い部分から省く）
+# ---------------------------------------------------------
+PROMPT_BUDGET = int(os.getenv("GRAPH_CONTEXT_BUDGET", "16000"))  # 1ステップのプロンプト全体の上限（概算トークン）
+
+def _elision(count):
+    return f"... ({count}行省略)"
+
+def clip(text, budget, keep="tail"):
+    """
+    text を概算 budget トークン以内に収める。行単位で省き、省いた位置に印を残す。
+    keep: "head"=先頭を残す / "tail"=末尾（新しい側）を残す / "ends"=先頭と末尾を残す
+    """
+    if rate_limiter.estimate_tokens(text) <= budget: return text
+    lines = text.splitlines()
+    heads, tails, used = [], [], rate_limiter.estimate_tokens(_elision(len(lines)))
+    i, j = 0, len(lines) - 1
+    take_head = keep != "tail"
+    while i <= j:
+        line = lines[i] if take_head else lines[j]
+        cost = rate_limiter.estimate_tokens(line)
+        if used + cost > budget: break
+        used += cost
+        if take_head:
+            heads.append(line)
+            i += 1
+        else:
+            tails.insert(0, line)
+            j -= 1
+        if keep == "ends": take_head = not take_head
+    if not heads and not tails:
+        # 1行が予算を超える（改行の無い長文）: 文字数で比例して切る
+        keep_chars = max(0, int(len(text) * budget / rate_limiter.estimate_tokens(text)))
+        return text[:keep_chars] + "..." if keep == "head" else "..." + text[len(text) - keep_chars:]
+    return "\n".join(heads + [_elision(j - i + 1)] + tails)
+
+def fit(sections, budget):
+    """
+    sections: [(名前, テキスト, 最低限残すトークン数, 残し方)] を「先に削ってよい順」に並べたもの。
+    合計が budget を超えたら先頭のセクションから順に、最低限の量まで削る。
+    (名前 → テキスト, 削った記録 [(名前, 元トークン, 削減後トークン)]) を返す。
+    """
+    costs = {name: rate_limiter.estimate_tokens(text) for name, text, _, _ in sections}
+    over = sum(costs.values()) - budget
+    fitted, report = {}, []
+    for name, text, floor, keep in sections:
+        if over > 0 and costs[name] > floor:
+            target = max(floor, costs[name] - over)
+            text = clip(text, target, keep)
+            after = rate_limiter.estimate_tokens(text)
+            over -= costs[name] - after
+            report.append((name, costs[name], after))
+        fitted[name] = text
+    return fitted, report
+
+def describe(report):
+    return ", ".join(f"{name} {before}→{after}" for name, before, after in report)
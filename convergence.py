@@ -0,0 +1,71 @@
+import io
+import os
+import re
+import difflib
+import hashlib
+import tokenize
+
+# ---------------------------------------------------------
+# 収束検知（正規化ハッシュ + 散文の類似度と変更文字数の上限）
+# ---------------------------------------------------------
+PROSE_THRESHOLD = float(os.getenv("CONVERGENCE_SIMILARITY", "0.97"))
+# 類似度が高くても、これを超える文字が変わっていれば収束とみなさない（長文への1文の追記は立派な修正）
+MAX_CHANGED_CHARS = int(os.getenv("CONVERGENCE_MAX_CHANGED_CHARS", "16"))
+
+CODE_EXTS = {".py", ".js", ".ts", ".jsx", ".tsx", ".c", ".h", ".cpp", ".hpp", ".cs", ".java",
+             ".go", ".rs", ".kt", ".swift", ".php", ".rb", ".sh", ".json", ".yaml", ".yml", ".toml"}
+_FENCE_RE = re.compile(r"^\s*```[\w+-]*\s*$", re.MULTILINE)
+_C_COMMENT_RE = re.compile(r"/\*.*?\*/|(?<!:)//[^\n]*", re.DOTALL)
+_HASH_COMMENT_RE = re.compile(r"(?m)^\s*#[^\n]*$")
+
+def _normalize_python(text):
+    """コメント・空行・空白差を捨て、インデント構造を含むトークン列だけを残す"""
+    out = []
+    for tok in tokenize.generate_tokens(io.StringIO(text).readline):
+        if tok.type in (tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER): continue
+        out.append("\n" if tok.type == tokenize.NEWLINE else tok.string)
+    return " ".join(out)
+
+def normalize(text, ext):
+    """比較用の正規形。Markdownのコードフェンスは生成のたびに揺れるので先に剥がす"""
+    text = _FENCE_RE.sub("", text)
+    if ext == ".py":
+        try:
+            return _normalize_python(text)
+        except (tokenize.TokenError, IndentationError, SyntaxError):
+            pass
+    if ext in (".js", ".ts", ".jsx", ".tsx", ".c", ".h", ".cpp", ".hpp", ".cs", ".java", ".go", ".rs", ".kt", ".swift", ".php"):
+        text = _C_COMMENT_RE.sub("", text)
+    elif ext in (".py", ".sh", ".rb", ".yaml", ".yml", ".toml"):
+        text = _HASH_COMMENT_RE.sub("", text)
+    return " ".join(text.split())
+
+def fingerprint(text, ext):
+    return hashlib.sha256(normalize(text, ext).encode("utf-8")).hexdigest()
+
+def _matcher(a, b):
+    # 日本語の散文では頻出文字が多く、autojunk だと一致が取りこぼされる
+    return difflib.SequenceMatcher(None, " ".join(a.split()), " ".join(b.split()), autojunk=False)
+
+def similarity(a, b):
+    """文字列の並びとしての類似度（0〜1。分かち書きのない日本語の散文でもそのまま使える）"""
+    return _matcher(a, b).ratio()
+
+def changed_chars(matcher):
+    """一致しなかった区間の文字数（置換・挿入・削除の長い側を数える）"""
+    return sum(max(i2 - i1, j2 - j1) for op, i1, i2, j1, j2 in matcher.get_opcodes() if op != "equal")
+
+def check(prev_text, new_text, ext, threshold=PROSE_THRESHOLD):
+    """前世代と今回の生成が実質同一なら理由を返す（収束していなければ None）"""
+    if not prev_text.strip(): return None
+    if prev_text == new_text: return "前世代とバイト単位で同一"
+    if fingerprint(prev_text, ext) == fingerprint(new_text, ext):
+        return "差分は空白・コメントのみ（正規化ハッシュ一致）"
+    if ext not in CODE_EXTS:
+        matcher = _matcher(_FENCE_RE.sub("", prev_text), _FENCE_RE.sub("", new_text))
+        # 上限だけで足切りできる組は、一致区間の計算まで進めない
+        if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold: return None
+        score, changed = matcher.ratio(), changed_chars(matcher)
+        if score >= threshold and changed <= MAX_CHANGED_CHARS:
+            return f"散文の類似度 {score:.3f} ≥ {threshold}、変更 {changed}文字 ≤ {MAX_CHANGED_CHARS}"
+    return None
@@ -0,0 +1,97 @@
+import os
+import time
+import random
+import fnmatch
+import contextvars
+from contextlib import contextmanager
+
+# ---------------------------------------------------------
+# 呼び出しの期限と実行全体の予算（止まった呼び出しがループを塞がないように）
+#   LLM_DEADLINES="Architect=300,Reviewer=60,*=180"  ロール名（fnmatch）→ 1回の呼び出しの期限秒。先に書いたものが優先
+#   RUN_BUDGET_SEC   1回の実行（graph の実行 / pipeline の実行 / ファクトリの1ジョブ）の予算秒。0 なら無制限
+#   LLM_HEDGE_ROLES  ヘッジ送信（遅い応答に保険の2本目を出す）を使うロール（fnmatch、カンマ区切り）
+# ---------------------------------------------------------
+RUN_BUDGET_SEC = float(os.getenv("RUN_BUDGET_SEC", "0"))
+
+def _parse_deadlines(spec):
+    rules = []
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        pattern, _, value = item.partition("=")
+        rules.append((pattern.strip(), float(value)))
+    return rules
+
+DEFAULT_DEADLINES = "*=300"
+_DEADLINE_SPEC = os.getenv("LLM_DEADLINES", DEFAULT_DEADLINES)
+ROLE_DEADLINES = _parse_deadlines(_DEADLINE_SPEC)
+HEDGE_ROLES = [p.strip() for p in os.getenv("LLM_HEDGE_ROLES", "").split(",") if p.strip()]
+RETRY_PAUSE_BASE_SEC = 1.0   # 期限切れの再送前の待機の基準（試行ごとに倍、ジッター付き）
+RETRY_PAUSE_CAP_SEC = 30.0
+
+class DeadlineExceeded(TimeoutError):
+    """1回の呼び出しが期限内に終わらなかった"""
+
+class BudgetExceeded(DeadlineExceeded):
+    """実行全体の予算を使い切った（これ以上は呼び出さない）"""
+
+# スレッドごと（ファクトリのジョブごと）に別の予算を持てるよう ContextVar に置く
+_run_deadline = contextvars.ContextVar("run_deadline", default=None)
+
+@contextmanager
+def run_budget(seconds=RUN_BUDGET_SEC):
+    """この中での呼び出しを、合計 seconds 秒以内に収める"""
+    token = _run_deadline.set((time.monotonic() + seconds, seconds) if seconds and seconds > 0 else None)
+    try:
+        yield
+    finally:
+        _run_deadline.reset(token)
+
+def remaining():
+    """予算の残り秒（予算なしなら None）"""
+    budget = _run_deadline.get()
+    return None if budget is None else budget[0] - time.monotonic()
+
+def exhausted():
+    left = remaining()
+    return left is not None and left <= 0
+
+def timeout_for(role):
+    """このロールの1回の呼び出しに使ってよい秒数（ロールの期限と予算の残りの小さい方。無制限なら None）"""
+    limit = next((sec for pattern, sec in ROLE_DEADLINES if fnmatch.fnmatchcase(role, pattern)), None)
+    left = remaining()
+    if left is not None:
+        if left <= 0: raise BudgetExceeded(f"run budget of {_run_deadline.get()[1]:g}s exhausted before {role}")
+        limit = left if limit is None else min(limit, left)
+    return limit
+
+def watched():
+    """
+    期限を別スレッドで見張る必要があるか。既定の期限だけで予算も無ければ HTTP のタイムアウトで打ち切れば足り、
+    呼び出しごとにスレッドを作らない
+    """
+    return _DEADLINE_SPEC.replace(" ", "") != DEFAULT_DEADLINES or _run_deadline.get() is not None
+
+def hedged(role):
+    return any(fnmatch.fnmatchcase(role, p) for p in HEDGE_ROLES)
+
+def bind(fn):
+    """スレッドプールへ渡す関数に、呼び出し元の予算を引き継ぐ（submit のたびに呼ぶこと）"""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+def is_timeout(error):
+    """呼び出し単位の期限切れ（再送してよい）。予算切れは再送しない"""
+    return isinstance(error, DeadlineExceeded) and not isinstance(error, BudgetExceeded)
+
+def retry_pause(attempt):
+    """
+    期限切れの再送前に、このスレッドだけが待つ（ジッター付きで試行ごとに倍）。待った秒数を返す。
+    429 ではないので rate_limiter の共有バケットは止めない（1本の遅い応答で他プロセス・他キーまで待たせない）
+    """
+    delay = random.uniform(0, min(RETRY_PAUSE_CAP_SEC, RETRY_PAUSE_BASE_SEC * 2 ** attempt))
+    time.sleep(delay)
+    return delay
+
+def retries_exhausted(role, attempts):
+    """全ての試行が期限切れに終わったときに上げる例外（その間に予算を使い切っていれば BudgetExceeded）"""
+    if exhausted(): return BudgetExceeded(f"run budget of {_run_deadline.get()[1]:g}s exhausted during {role}")
+    return DeadlineExceeded(f"{role}: no response within the deadline in {attempts} attempts")
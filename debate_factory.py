@@ -1,122 +1,186 @@
 import time
 import os
-import re
-import subprocess
 import sys
-import hashlib
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from google import genai
-from dotenv import load_dotenv
+import re
+import llm_client
+import rate_limiter
+import llm_cache
+import telemetry
+import model_router
+import deadline
+import checkpoint
+import artifact_store
+import ledger
+import archive
+import jobqueue
+import convergence
+import lesson_store
+import reality_check
+import review_diff
+import code_chunks
+from concurrent.futures import ThreadPoolExecutor
+from watcher import OrderWatcher
 
 # ---------------------------------------------------------
 # 1. 物理的基盤（DEGRADATION PREVENTION & MEMORY SYSTEM）
 # ---------------------------------------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-load_dotenv(os.path.join(BASE_DIR, ".env"))
 
 DIRS = {k: os.path.join(BASE_DIR, k) for k in ["order", "original", "workspace", "reviews"]}
 for d in DIRS.values(): os.makedirs(d, exist_ok=True)
 
 # 記憶の階層
-L1_MEMORY_FILE = os.path.join(DIRS["workspace"], "memory.txt")       # 短期記憶（次ターンへのバトン）
-L2_MEMORY_FILE = os.path.join(DIRS["workspace"], "core_lessons.md")  # 長期記憶（絶対不変の黄金律）
+L1_MEMORY_TEMPLATE = os.path.join(DIRS["workspace"], "memory_{}.txt")  # 短期記憶（ターゲットごとの次ターンへのバトン）
+L2_MEMORY_FILE = os.path.join(DIRS["workspace"], "core_lessons.md")    # 長期記憶の閲覧用（全教訓を新しい順に書き出す）
+L2_STORE = os.path.join(DIRS["workspace"], "lessons_debate.json")       # 長期記憶の本体（教訓ごとに索引付けして保存）
+MANIFEST_DIR = os.path.join(DIRS["workspace"], "manifests")  # ターゲットごとの世代台帳（最新版を O(1) で引く）
+TESTS_DIR = os.path.join(BASE_DIR, "tests")  # ターゲット自身のテスト（任意）
+
+MAX_WORKERS = int(os.getenv("FACTORY_WORKERS", "4"))  # このプロセスで同時に進化させるoriginalの数（全体の上限は JOB_MAX_RUNNING）
+QUEUE_NAME = "debate"
+
+def l1_memory_path(raw_name):
+    return L1_MEMORY_TEMPLATE.format(raw_name)
+
+def save_l1(raw_name, text):
+    """短期記憶はファイルを丸ごと書き換えず、台帳へ追記する（台帳を切っている場合のみ従来のファイル）"""
+    jobqueue.ensure_lease()
+    if ledger.ENABLED: ledger.append("l1", f"debate/{raw_name}", text=text)
+    else:
+        with open(l1_memory_path(raw_name), "w", encoding="utf-8") as f: f.write(text)
+
+def save_review(raw_name, name, text):
+    """レビューはアーカイブにだけ入れ、再開用の参照を返す（アーカイブが無効なときだけ reviews/ のファイルに書く）"""
+    jobqueue.ensure_lease()
+    return archive.keep(raw_name, name, text, DIRS["reviews"])
+
+def load_l1(raw_name, default=""):
+    text = ledger.latest("l1", f"debate/{raw_name}", {}).get("text")
+    # 台帳に無ければ、台帳導入前の短期記憶ファイルから引き継ぐ
+    return text if text is not None else read_text(l1_memory_path(raw_name), default)
 
 # ---------------------------------------------------------
 # 2. ユーティリティ（API・検証・世代管理）
 # ---------------------------------------------------------
-GEMINI_MODEL = os.getenv("GEMINI_MODEL")
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
-def call_ai(prompt, role):
-    for attempt in range(3):
-        try:
-            res = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
-            if res.text: return res.text
-            raise ValueError("API returned empty response.")
-        except Exception as e:
-            if "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e):
-                print(f"  ⚠️ 制限到達({attempt+1}/3): 30秒待機...")
-                time.sleep(30)
-            else: raise e
-    raise RuntimeError(f"{role} failed.")
+def call_ai(prompt, role, use_cache=True):
+    """ロールの段のモデルで生成し、方針に合わない出力（判定行の不正・要確認の判定）は強い段でやり直す"""
+    model = start = model_router.model_for(role)
+    while True:
+        text = _generate(prompt, role, model, use_cache)
+        # 要確認の判定は開始段の答えだけを確かめ直し、昇格先の判定はそのまま受け入れる
+        reason = model_router.check(role, text, double_check=model == start)
+        stronger = model_router.escalate(role, model, reason) if reason else None
+        if stronger is None: return text
+        model = stronger
+
+def _generate(prompt, role, model, use_cache=True):
+    est_tokens = rate_limiter.estimate_tokens(prompt)
+    meter = telemetry.CallMeter(role, model, est_tokens)
+    cache_key = llm_cache.make_key(model, prompt)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            meter.done(response_text=cached, cached=True)
+            return cached
+    else: llm_cache.note_bypass()
+
+    def send(model, timeout, hedge):
+        meter.sleep_s += rate_limiter.acquire(model, est_tokens)
+        res = llm_client.generate(model, prompt, timeout=timeout, hedge=hedge)
+        rate_limiter.settle(model, est_tokens, rate_limiter.usage_tokens(res))
+        if not res.text: raise ValueError("API returned empty response.")
+        return res
+    res = llm_client.with_retries(role, meter, send)
+    if use_cache: llm_cache.put(cache_key, res.text)
+    meter.done(res, res.text)
+    return res.text
 
 def get_latest_v(raw_name):
-    files = [f for f in os.listdir(DIRS["workspace"]) if f.startswith(raw_name)]
-    versions = [int(m.group(1)) for f in files if (m := re.search(r"_v(\d+)\.", f))]
-    return max(versions) if versions else 0
+    # workspace 全体を走査せず、ターゲットごとのマニフェストから引く（初回のみ既存ファイルから作る）
+    return artifact_store.latest(MANIFEST_DIR, raw_name, DIRS["workspace"], raw_name)
 
-def run_reality_check(file_path):
-    ext = os.path.splitext(file_path)[1]
-    if ext == ".py":
-        res = subprocess.run([sys.executable, "-m", "py_compile", file_path], capture_output=True, text=True)
-        return "PASS (Syntax OK)" if res.returncode == 0 else f"FAIL (Syntax Error):\n{res.stderr}"
-    return f"UNKNOWN_EXT ({ext})"
+def run_reality_check(file_path, raw_name):
+    # 構文・JSON/YAML/TOML・(任意で)ターゲット自身のpytest をプロセス内/常駐ワーカーで検証する
+    # tests/test_<名前>.py があれば、生成物を <名前>.py として import させて実行する
+    module_name = os.path.splitext(raw_name)[0]
+    return reality_check.run(file_path, module_name=module_name, test_dirs=[TESTS_DIR])
 
 # ---------------------------------------------------------
 # 3. 記憶整理官（Librarian） - 睡眠時の教訓抽出
 # ---------------------------------------------------------
 def run_librarian(raw_name, final_review):
-    print(f"\n🧠 [LIBRARIAN ACTIVE] 狩りが完了しました。記憶の整理（L2キャッシュ更新）を開始します。")
+    # 読み込み→統合→書き戻しの間に他の狩り（別のワーカープロセスも含む）が割り込まないよう、L2全体をロックする
+    with lesson_store.locked(L2_STORE):
+        _run_librarian_locked(raw_name, final_review)
+
+def _run_librarian_locked(raw_name, final_review):
+    print(f"\n🧠 [LIBRARIAN ACTIVE] 狩りが完了しました({raw_name})。記憶の整理（L2キャッシュ更新）を開始します。")
     
-    # 現在の長期記憶を取得
-    current_l2 = open(L2_MEMORY_FILE, "r", encoding="utf-8").read() if os.path.exists(L2_MEMORY_FILE) else "まだ教訓はない。"
+    # 長期記憶の全体ではなく、今回の結果に関係する教訓だけを見せる
+    related = lesson_store.search(L2_STORE, f"{raw_name}\n{final_review}")
 
     lib_prompt = f"""Role: Librarian (記憶整理官).
 あなたは過去の失敗から普遍的な教訓を抽出し、AIが二度と愚かなミスを繰り返さないための「黄金律」を管理する存在だ。
 
-【現在の長期記憶 (L2 Cache)】
-{current_l2}
+【関連する既存の教訓 (L2 Cache より抜粋)】
+{lesson_store.render(related)}
 
 【今回の狩りの最終結果 (Review)】
 {final_review}
 
 【指令】
-上記を統合し、「このプロジェクトにおいて、絶対に犯してはならないルールや、得られた新しい設計指針」を【最大5箇条のマークダウンリスト】で出力せよ。
-古くて不要になったルールは捨て、本質的な教訓だけを残すこと。出力は5箇条のリストのみとし、挨拶や解説は一切不要。"""
+今回の結果から得られた「このプロジェクトにおいて、絶対に犯してはならないルールや、新しい設計指針」を【最大5箇条のマークダウンリスト】で出力せよ。
+既存の教訓と同じ内容は繰り返さないこと。上の既存の教訓のうち、今回の結果により古くなった・誤りと分かったものがあれば、
+最終行に `RETIRE: L番号, L番号` の形式で挙げよ。リストと RETIRE 行以外（挨拶や解説）は一切不要。"""
     
     new_l2 = call_ai(lib_prompt, "Librarian")
-    
-    with open(L2_MEMORY_FILE, "w", encoding="utf-8") as f:
-        f.write(new_l2)
-    print("  ✔️ 長期記憶 (core_lessons.md) を最適化・更新しました。")
+
+    retire = re.search(r"^RETIRE:\s*(.+)$", new_l2, re.MULTILINE)
+    retired = re.findall(r"L(\d+)", retire.group(1)) if retire else []
+    jobqueue.ensure_lease()
+    added, dup, removed = lesson_store.update(L2_STORE, lesson_store.parse_items(new_l2), retired, source=raw_name)
+    lesson_store.export_markdown(L2_STORE, L2_MEMORY_FILE)
+    print(f"  ✔️ 長期記憶を更新しました: 追加 {added} / 重複 {dup} / 退役 {removed}")
 
 # ---------------------------------------------------------
 # 4. 実行エンジン（Agentic Workflow with Memory）
+#    Architect → Reality Check → Reviewer → 判定 を明示的な状態機械として回し、
+#    フェーズ完了ごとにチェックポイントを書く。落ちたプロセスは同じフェーズから再開する。
 # ---------------------------------------------------------
-def run_evolution(target_file, is_new_order=False, loop_count=1):
-    MAX_LOOP = 5
-    base = os.path.basename(target_file)
-    raw = base.split('_v')[0]
-    ext = os.path.splitext(base)[1]
+MAX_LOOP = 5
+CHECKPOINT_DIR = os.path.join(DIRS["workspace"], "checkpoints")
 
-    # 指令の取得
-    order_path = os.path.join(DIRS["order"], "order.txt")
-    order = open(order_path, "r", encoding="utf-8").read().strip() if os.path.exists(order_path) else "現状維持"
-    
-    # 記憶のロード
-    if is_new_order and loop_count == 1:
-        # 新規指令時は短期記憶のみリセット
-        l1_memory = "INITIAL_STATE"
-        with open(L1_MEMORY_FILE, "w", encoding="utf-8") as f: f.write(l1_memory)
-    else:
-        l1_memory = open(L1_MEMORY_FILE, "r", encoding="utf-8").read() if os.path.exists(L1_MEMORY_FILE) else "NO_L1_MEMORY"
+def read_text(path, default=""):
+    return open(path, "r", encoding="utf-8").read() if path and os.path.exists(path) else default
 
-    l2_memory = open(L2_MEMORY_FILE, "r", encoding="utf-8").read() if os.path.exists(L2_MEMORY_FILE) else "NO_L2_MEMORY"
+def _mark_converged(ctx, reason):
+    """収束した世代はレビューの代わりに理由を記録し、判定フェーズへ直行する"""
+    review = f"[STATUS: CONVERGED]\n{reason}"
+    ctx["review_ref"] = save_review(ctx["raw"], f"{ctx['raw']}_v{ctx['version']}_rev.txt", review)
+    ctx["hashes"]["review"] = checkpoint.content_hash(review)
+    print(f"  🧊 収束を検知: {reason}")
+    return "DECIDE"
+
+def _phase_architect(ctx, order):
+    raw, ext = ctx["raw"], ctx["ext"]
 
     # 前世代の確保
-    prev_code = open(target_file, "r", encoding="utf-8").read() if os.path.exists(target_file) else ""
+    prev_code = read_text(ctx["target_file"])
+    # 長期記憶は全件ではなく、指令・直近の反省・前世代に関係する上位の教訓だけを渡す
+    l2_memory = lesson_store.render(lesson_store.search(L2_STORE, f"{order}\n{ctx['l1']}\n{prev_code}"), "NO_L2_MEMORY")
 
-    next_v = get_latest_v(raw) + (1 if is_new_order else 0)
+    next_v = get_latest_v(raw) + (1 if ctx["is_new_order"] else 0)
     if next_v == 0: next_v = 1
     save_path = os.path.join(DIRS["workspace"], f"{raw}_v{next_v}{ext}")
 
-    print(f"\n[🐺 EVOLVING v{next_v}] (Loop: {loop_count}/{MAX_LOOP})")
+    print(f"\n[🐺 EVOLVING {raw} v{next_v}] (Loop: {ctx['loop']}/{MAX_LOOP})")
 
     # --- PHASE 1: Architect (記憶を参照した生成) ---
-    arch_prompt = f"""Role: Architect.
+    new_code = _architect_chunked(ctx, order, prev_code, l2_memory) if code_chunks.enabled(prev_code, ext) else None
+    if new_code is None:
+        arch_prompt = f"""Role: Architect.
 【指令】: {order}
-【短期記憶 (直近の反省)】: {l1_memory}
+【短期記憶 (直近の反省)】: {ctx['l1']}
 【長期記憶 (絶対の黄金律)】:
 {l2_memory}
 
@@ -124,22 +188,80 @@ def run_evolution(target_file, is_new_order=False, loop_count=1):
 {prev_code}
 
 記憶と指令に従い、修正したコードのみを全文出力せよ。説明不要。"""
-    
-    new_code = call_ai(arch_prompt, "Architect")
+
+        new_code = call_ai(arch_prompt, "Architect")
+    jobqueue.ensure_lease()  # 生成中に貸出を失っていたら、回収した側と同じ世代を書かない
     with open(save_path, "w", encoding="utf-8") as f: f.write(new_code)
-    
+    artifact_store.record(MANIFEST_DIR, raw, next_v, save_path)
+
+    ctx.update(version=next_v, save_path=save_path)
+    ctx["hashes"] = {"prev": checkpoint.content_hash(prev_code), "new": checkpoint.content_hash(new_code)}
+
+    # 前世代と実質同一（空白・コメントのみの差）なら、監査もスリープも不要
+    reason = convergence.check(prev_code, new_code, ext)
+    # 連続して収束した回数（1回なら監査だけを省いて続け、2回続いたら終える）
+    ctx["converged"] = ctx.get("converged", 0) + 1 if reason else 0
+    if reason: return _mark_converged(ctx, reason)
+    return "REALITY_CHECK"
+
+def _architect_chunk(ctx, order, l2_memory, overview, chunk):
+    arch_prompt = f"""Role: Architect.
+【指令】: {order}
+【短期記憶 (直近の反省)】: {ctx['l1']}
+【長期記憶 (絶対の黄金律)】:
+{l2_memory}
+
+【ファイル全体の概要 (書き換え対象以外はシグネチャのみ)】:
+{overview}
+
+【書き換え対象: {chunk['name']} (前世代。これをデグレさせるな)】:
+{chunk['text']}
+
+記憶と指令に従い、この書き換え対象を修正したコードのみを全文出力せよ。ファイルの他の部分は出力しない。
+新しい関数・クラスが必要なら、この部分の続きに書いてよい。説明不要。"""
+    return code_chunks.strip_fence(call_ai(arch_prompt, "Architect"))
+
+def _architect_chunked(ctx, order, prev_code, l2_memory):
+    """
+    大きな .py はトップレベルの関数・クラス単位に分け、指令に関係する部分だけを並列に書き換えて元の位置へ戻す。
+    分割できない・関係する部分を特定できない場合は None（全文モードで生成する）
+    """
+    chunks = code_chunks.split(prev_code)
+    selected = code_chunks.select(chunks, order, ctx["l1"]) if chunks else []
+    if not selected:
+        print("  🧩 分割進化: 関係する部分を特定できないため全文モードで生成します")
+        return None
+    overview = code_chunks.outline(chunks, selected, prev_code)
+    targets = [c for c in chunks if c["name"] in selected]
+    print(f"  🧩 分割進化: {sum(c['kind'] != 'module' for c in chunks)}定義中 {len(targets)}部分を並列に書き換え ({', '.join(selected)})")
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="architect") as pool:
+        futures = [(c["name"], pool.submit(deadline.bind(_architect_chunk), ctx, order, l2_memory, overview, c)) for c in targets]
+        replacements = {name: future.result() for name, future in futures}
+    new_code = code_chunks.splice(chunks, replacements)
+    print(f"  🧩 分割進化: 組み立て完了 {prev_code.count(chr(10)) + 1}行 → {new_code.count(chr(10)) + 1}行 ({time.time() - started:.1f}s)")
+    return new_code
+
+def _phase_reality_check(ctx, order):
     # --- PHASE 2: Reality Check ---
-    test_res = run_reality_check(save_path)
-    print(f"  🔬 Test: {test_res.splitlines()[0]}")
+    ctx["test_res"] = run_reality_check(ctx["save_path"], ctx["raw"])
+    print(f"  🔬 Test: {ctx['test_res'].splitlines()[0]}")
+    return "REVIEW"
+
+def _phase_review(ctx, order):
+    raw, next_v = ctx["raw"], ctx["version"]
+    prev_code, new_code = read_text(ctx["target_file"]), read_text(ctx["save_path"])
 
     # --- PHASE 3: Reviewer (破壊的監査とバトン作成) ---
+    # 先頭2000文字の切り抜きではなく、ローカルで計算した差分を予算内で渡す
+    change = review_diff.build(prev_code, new_code, ctx["ext"])
     rev_prompt = f"""Role: Destructive Auditor.
 前世代と比較し、指令の達成度とデグレの有無を監査せよ。
 
-【比較対象】
-前世代: {prev_code[:2000]}...
-今回生成: {new_code[:2000]}...
-物理テスト: {test_res}
+【比較対象 (前世代 → 今回生成 の差分)】
+{change}
+
+物理テスト: {ctx['test_res']}
 指令: {order}
 
 【出力形式厳守】
@@ -149,30 +271,114 @@ def run_evolution(target_file, is_new_order=False, loop_count=1):
     review = call_ai(rev_prompt, "Reviewer")
     
     # レビューの保存と短期記憶(L1)の更新
-    with open(os.path.join(DIRS["reviews"], f"{raw}_v{next_v}_rev.txt"), "w", encoding="utf-8") as f: f.write(review)
+    ctx["review_ref"] = save_review(raw, f"{raw}_v{next_v}_rev.txt", review)
     
     l1_match = re.search(r"【🐾 短期記憶のバトン】(.*)", review, re.DOTALL)
-    new_l1 = l1_match.group(1).strip() if l1_match else f"STATUS: {review.splitlines()[0]}"
-    with open(L1_MEMORY_FILE, "w", encoding="utf-8") as f: f.write(new_l1)
+    ctx["l1"] = l1_match.group(1).strip() if l1_match else f"STATUS: {review.splitlines()[0]}"
+    save_l1(raw, ctx["l1"])
+
+    ctx["hashes"]["review"] = checkpoint.content_hash(review)
+    return "DECIDE"
 
+def _phase_decide(ctx, order):
     # --- PHASE 4: 自律判定とLibrarianの起動 ---
-    status_line = review.splitlines()[0]
-    if "[STATUS: CONTINUE]" in status_line and loop_count < MAX_LOOP:
+    status_line = archive.fetch(ctx["review_ref"]).splitlines()[0]
+    if "[STATUS: CONTINUE]" in status_line and ctx["loop"] < MAX_LOOP:
         print(f"  🐺 追跡継続。エラーまたは未達あり。")
         time.sleep(20)
-        run_evolution_safe(save_path, is_new_order=True, loop_count=loop_count + 1)
+        # 今回の生成物を次ループの前世代とする
+        ctx.update(target_file=ctx["save_path"], is_new_order=True, loop=ctx["loop"] + 1)
+        return "ARCHITECT"
+    elif "[STATUS: CONVERGED]" in status_line:
+        if ctx.get("converged", 0) >= 2 or ctx["loop"] >= MAX_LOOP:
+            print(f"🧊 収束により早期終了: v{ctx['version']} (二世代連続で実質同一のため、これ以上の監査は不要)")
+            return "END"
+        # 1回だけなら偶然の足踏みかもしれないので、監査を省いて同じ反省のままもう1世代回す
+        print(f"  🧊 収束1回目: 監査を省いて次の世代へ進みます。")
+        ctx.update(target_file=ctx["save_path"], is_new_order=True, loop=ctx["loop"] + 1)
+        return "ARCHITECT"
     elif "[STATUS: DONE]" in status_line:
-        print(f"🏁 MISSION COMPLETE: v{next_v}")
+        print(f"🏁 MISSION COMPLETE: v{ctx['version']}")
         # 狩り完了時のみ、Librarianを起動して長期記憶(L2)を整理する
-        run_librarian(raw, review)
+        return "LIBRARIAN"
+    print(f"🛑 EXIT: {status_line}")
+    return "END"
+
+def _phase_librarian(ctx, order):
+    run_librarian(ctx["raw"], archive.fetch(ctx["review_ref"]))
+    return "END"
+
+PHASES = {
+    "ARCHITECT": _phase_architect,
+    "REALITY_CHECK": _phase_reality_check,
+    "REVIEW": _phase_review,
+    "DECIDE": _phase_decide,
+    "LIBRARIAN": _phase_librarian,
+}
+
+def _resume(raw, order_hash):
+    """同じ指令のチェックポイントがあれば、成果物が無傷な最も進んだフェーズから再開する"""
+    ctx = checkpoint.load(CHECKPOINT_DIR, raw)
+    if not ctx: return None
+    if ctx.get("order_hash") != order_hash:
+        checkpoint.clear(CHECKPOINT_DIR, raw)
+        return None
+    if ctx["phase"] in ("DECIDE", "LIBRARIAN") and not checkpoint.intact(ctx, "review", "review_ref", archive.fetch):
+        ctx["phase"] = "REVIEW"
+    if ctx["phase"] in ("REALITY_CHECK", "REVIEW") and not checkpoint.intact(ctx, "new", "save_path"):
+        ctx["phase"] = "ARCHITECT"
+    return ctx
+
+def run_evolution(target_file, is_new_order=False, loop_count=1):
+    base = os.path.basename(target_file)
+    raw = base.split('_v')[0]
+
+    # 指令の取得
+    order_path = os.path.join(DIRS["order"], "order.txt")
+    order = open(order_path, "r", encoding="utf-8").read().strip() if os.path.exists(order_path) else "現状維持"
+    order_hash = checkpoint.content_hash(order)
+
+    ctx = _resume(raw, order_hash)
+    if ctx:
+        print(f"\n♻️ [RESUME] {raw}: Loop {ctx['loop']} の {ctx['phase']} から再開します。")
     else:
-        print(f"🛑 EXIT: {status_line}")
+        # 記憶のロード（L1はターゲットごとに分離）
+        if is_new_order and loop_count == 1:
+            # 新規指令時は短期記憶のみリセット
+            l1_memory = "INITIAL_STATE"
+            save_l1(raw, l1_memory)
+        else:
+            l1_memory = load_l1(raw, "NO_L1_MEMORY")
+        ctx = {"phase": "ARCHITECT", "raw": raw, "ext": os.path.splitext(base)[1], "order_hash": order_hash,
+               "target_file": target_file, "is_new_order": is_new_order, "loop": loop_count, "l1": l1_memory}
 
-def run_evolution_safe(path, is_new_order, loop_count):
+    while ctx["phase"] != "END":
+        # 貸出を失ったワーカーは次のフェーズにも、チェックポイントの書き込みにも進まない
+        jobqueue.ensure_lease()
+        ctx["phase"] = PHASES[ctx["phase"]](ctx, order)
+        jobqueue.ensure_lease()
+        ledger.append("phase", f"debate/{raw}", wait=False, phase=ctx["phase"], loop=ctx["loop"],
+                      version=ctx.get("version"), hashes=ctx.get("hashes"))
+        if ctx["phase"] == "END": checkpoint.clear(CHECKPOINT_DIR, raw)
+        else: checkpoint.save(CHECKPOINT_DIR, raw, ctx)
+
+def _run_job(payload, lease=None):
+    """
+    ジョブキューから借りた1件を実行する（例外はキュー側で再試行・failed として記録される）。
+    lease を失うと、フェーズの合間と各書き込みの直前で LeaseLost が送出されて打ち切られる
+    """
     try:
-        run_evolution(path, is_new_order, loop_count)
-    except Exception as e:
-        print(f"❌ 致命的エラー: {e}")
+        with jobqueue.holding(lease), deadline.run_budget():
+            run_evolution(payload["path"], payload["is_new_order"], payload["loop"])
+    except deadline.BudgetExceeded as e:
+        # 予算切れは再試行しない（チェックポイントは残るので、次の指令で同じフェーズから再開できる）
+        print(f"🛑 [BUDGET REACHED] {os.path.basename(payload['path'])}: {e}")
+
+def _report():
+    """このプロセスの仕事が一段落したら、ここまでの集計を出して次の集計を始める"""
+    print(f"🗃️ キャッシュ: {llm_cache.STATS}")
+    print(telemetry.describe(telemetry.finish_run()))
+    telemetry.start_run("debate_factory")
 
 # ---------------------------------------------------------
 # 5. 起動と監視
@@ -182,23 +388,25 @@ def boot_sequence():
     print(f"🐺 MECH-WOLF v6.0 [SELF-EVOLUTION MEMORY SYSTEM]")
     print("="*60)
     originals = [f for f in os.listdir(DIRS["original"]) if os.path.isfile(os.path.join(DIRS["original"], f))]
+    # 各originalを独立した狩りとして並行に進化させる: originalごとに1件ずつ永続キューへ積み、ワーカーが貸出制で取り出す
+    # （同じoriginalの待機ジョブは1件にまとまり、実行中のものは終わってから次の1回が走る）
     for f in originals:
-        run_evolution_safe(os.path.join(DIRS["original"], f), is_new_order=True, loop_count=1)
-
-class Handler(FileSystemEventHandler):
-    def on_modified(self, event):
-        if event.is_directory: return
-        if "order.txt" in event.src_path:
-            print("\n📡 指令更新を検知。群れを解き放ちます。")
-            boot_sequence()
+        jobqueue.enqueue(QUEUE_NAME, f, {"path": os.path.join(DIRS["original"], f), "is_new_order": True, "loop": 1})
+    print(f"📥 {len(originals)}件をキューへ積みました: {jobqueue.stats().get(QUEUE_NAME, {}).get('counts', {})}")
 
 if __name__ == "__main__":
-    boot_sequence()
-    obs = Observer()
-    obs.schedule(Handler(), BASE_DIR, recursive=True)
-    obs.start()
+    # --worker: 監視せず、キューのジョブだけを処理するワーカーとして起動する（同じマシンで複数起動できる）
+    worker_only = "--worker" in sys.argv[1:]
+    telemetry.start_run("debate_factory")
+    # 旧形式の L2 マークダウンしか無ければ、起動時に1回だけストアへ移す（import しただけでは書き込まない）
+    lesson_store.migrate(L2_STORE, L2_MEMORY_FILE)
+    # 起動時の1回も監視と同じ作業キューに積み、実行中の指令更新は次の1回にまとめる
+    obs = None if worker_only else OrderWatcher(BASE_DIR, boot_sequence, ignore_dirs=[DIRS["workspace"], DIRS["reviews"]],
+                                                message="\n📡 指令更新を検知。群れを解き放ちます。").start()
+    if obs: obs.trigger()
     try:
-        while True: time.sleep(1)
-    except KeyboardInterrupt:
-        obs.stop()
-    obs.join()
\ No newline at end of file
+        jobqueue.serve(QUEUE_NAME, _run_job, slots=MAX_WORKERS, on_idle=_report)
+    finally:
+        if obs:
+            obs.stop()
+            obs.join()
@@ -1,72 +1,408 @@
 import os
+import re
 import glob
+import json
 import time
-from google import genai
-from dotenv import load_dotenv
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import llm_client
+import rate_limiter
+import llm_cache
+import telemetry
+import model_router
+import deadline
+import ledger
+import checkpoint
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-load_dotenv(os.path.join(BASE_DIR, ".env"))
 
 DIRS = {k: os.path.join(BASE_DIR, k) for k in ["order", "workspace", "stages"]}
 for d in DIRS.values(): os.makedirs(d, exist_ok=True)
 
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-GEMINI_MODEL = os.getenv("GEMINI_MODEL")
+STREAM_DEFAULT = os.getenv("ENGINE_STREAM", "0") == "1"  # 全ステージをストリーミングで実行するか
+MAX_CONCURRENCY = int(os.getenv("ENGINE_CONCURRENCY", "4"))  # 同時に実行する独立ステージの上限
+# バッチモードで全指令合計の同時実行数（実際の送信速度は rate_limiter のクォータで決まる）
+BATCH_CONCURRENCY = int(os.getenv("ENGINE_BATCH_CONCURRENCY", "8"))
+BATCH_DIR = os.path.join(DIRS["workspace"], "batch")  # バッチごとの作業領域 <batch>/<指令ID>/output_<stage> と manifest.jsonl
 
-def call_llm(prompt):
-    for attempt in range(3):
-        try:
-            res = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
-            if res.text: return res.text
-            raise ValueError("Empty response")
-        except Exception as e:
-            if "429" in str(e): time.sleep(30)
-            else: raise e
-    raise RuntimeError("LLM API failed.")
+def call_llm(prompt, use_cache=True, role="stage"):
+    model = model_router.model_for(role)
+    est_tokens = rate_limiter.estimate_tokens(prompt)
+    meter = telemetry.CallMeter(role, model, est_tokens)
+    cache_key = llm_cache.make_key(model, prompt)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            meter.done(response_text=cached, cached=True)
+            return cached
+    else: llm_cache.note_bypass()
+
+    def send(model, timeout, hedge):
+        meter.sleep_s += rate_limiter.acquire(model, est_tokens)
+        res = llm_client.generate(model, prompt, timeout=timeout, hedge=hedge)
+        rate_limiter.settle(model, est_tokens, rate_limiter.usage_tokens(res))
+        if not res.text: raise ValueError("Empty response")
+        return res
+    res = llm_client.with_retries(role, meter, send)
+    if use_cache: llm_cache.put(cache_key, res.text)
+    meter.done(res, res.text)
+    return res.text
+
+def call_llm_stream(prompt, out_path, use_cache=True, role="stage"):
+    """ストリーミングで受信し、チャンクが届くたびに out_path へ追記する（応答全体を文字列として保持しない）"""
+    model = model_router.model_for(role)
+    est_tokens = rate_limiter.estimate_tokens(prompt)
+    meter = telemetry.CallMeter(role, model, est_tokens)
+    cache_key = llm_cache.make_key(model, prompt)
+    if use_cache:
+        if llm_cache.copy_to(cache_key, out_path):
+            meter.done(cached=True, stream=True)
+            return {"cached": True, "ttft": 0.0, "tokens": 0, "tps": 0.0}
+    else: llm_cache.note_bypass()
+
+    def send(model, timeout, hedge):
+        # ストリームはヘッジしない（期限は最初のチャンクまで）
+        meter.sleep_s += rate_limiter.acquire(model, est_tokens)
+        start, ttft, est_out, last_chunk = time.time(), None, 0, None
+        with open(out_path, "w", encoding="utf-8") as f:
+            for chunk in llm_client.generate_stream(model, prompt, timeout=timeout):
+                if getattr(chunk, "usage_metadata", None): last_chunk = chunk
+                if not chunk.text: continue
+                if ttft is None: ttft = time.time() - start
+                f.write(chunk.text)
+                f.flush()
+                est_out += rate_limiter.estimate_tokens(chunk.text)
+        if ttft is None: raise ValueError("Empty response")
+        rate_limiter.settle(model, est_tokens, rate_limiter.usage_tokens(last_chunk))
+        return last_chunk, ttft, est_out, time.time() - start
+    last_chunk, ttft, est_out, elapsed = llm_client.with_retries(role, meter, send)
+
+    usage = getattr(last_chunk, "usage_metadata", None)
+    tokens = getattr(usage, "candidates_token_count", None) or est_out
+    if use_cache: llm_cache.put_file(cache_key, out_path)
+    tps = tokens / max(elapsed - ttft, 1e-6)
+    meter.done(last_chunk, response_tokens=tokens, stream=True, ttft_s=round(ttft, 3), tokens_per_s=round(tps, 1))
+    return {"cached": False, "ttft": ttft, "tokens": tokens, "tps": tps}
+
+def _flag(value, default):
+    if value is None: return default
+    return value.lower() not in ("off", "false", "0", "no")
+
+def parse_stage(stage_file):
+    """ステージファイル先頭の `@key: value` 行をヘッダとして分離する"""
+    headers, lines = {}, open(stage_file, "r", encoding="utf-8").read().strip().splitlines()
+    while lines and lines[0].startswith("@") and ":" in lines[0]:
+        key, _, value = lines.pop(0)[1:].partition(":")
+        headers[key.strip().lower()] = value.strip()
+    return headers, "\n".join(lines).strip()
+
+def build_stage_graph(stage_files):
+    """
+    ステージ群を依存グラフにする。
+    `@depends: 01_a.txt, 01_b.txt` を持つステージはそれらの出力を待ち（空なら order のみを入力とする）、
+    ヘッダの無いステージは従来通り直前のステージ（ソート順）に依存する。
+    """
+    graph, prev_name = {}, None
+    for stage_file in stage_files:
+        name = os.path.basename(stage_file)
+        headers, instruction = parse_stage(stage_file)
+        if "depends" in headers:
+            deps = [d.strip() for d in headers["depends"].split(",") if d.strip()]
+        else:
+            deps = [prev_name] if prev_name else []
+        graph[name] = {"headers": headers, "instruction": instruction, "deps": deps}
+        prev_name = name
+
+    for name, node in graph.items():
+        unknown = [d for d in node["deps"] if d not in graph]
+        if unknown: raise ValueError(f"{name} が存在しないステージに依存しています: {unknown}")
+    # 循環の検出（トポロジカルソートが全ノードを消化できるか）
+    indegree = {name: len(node["deps"]) for name, node in graph.items()}
+    queue = [name for name, n in indegree.items() if n == 0]
+    for name in queue:
+        for other, node in graph.items():
+            if name in node["deps"]:
+                indegree[other] -= 1
+                if indegree[other] == 0: queue.append(other)
+    if len(queue) != len(graph):
+        raise ValueError(f"ステージの依存関係が循環しています: {sorted(set(graph) - set(queue))}")
+    return graph
+
+def _stage_input(node, outputs, order_text, out_dir=None):
+    """依存先の出力を1つの文脈にまとめる（依存なしなら order、1つならその出力そのもの）"""
+    def read_output(dep):
+        # ストリーミングしたステージ（とバッチで前回までに終えたステージ）の出力はファイルにしか無い
+        if outputs[dep] is not None: return outputs[dep]
+        return open(os.path.join(out_dir or DIRS["workspace"], f"output_{dep}"), "r", encoding="utf-8").read()
+    deps = node["deps"]
+    if not deps: return order_text
+    if len(deps) == 1: return read_output(deps[0])
+    return "\n\n".join(f"【{dep} の出力】\n{read_output(dep)}" for dep in deps)
+
+def run_stage(stage_name, node, context, out_dir=None, key=None):
+    """1ステージを実行して workspace（バッチでは指令ごとの out_dir）に書き出す。戻り値は出力文字列（ストリーミング時は None）"""
+    key = key or stage_name
+    print(f"\n⚙️ [STAGE EXECUTING]: {key}")
+
+    # `@cache: off` ヘッダを持つステージは毎回生成し直す
+    # `@stream: on` ヘッダを持つステージは受信しながらworkspaceへ書き出す
+    headers = node["headers"]
+    use_cache = _flag(headers.get("cache"), True)
+    stream = _flag(headers.get("stream"), STREAM_DEFAULT)
+
+    # プロンプトの合成：【ステージの指示】＋【前段までの文脈/結果】
+    combined_prompt = f"""
+{node['instruction']}
+
+【現在の文脈 / 前ステージからの入力】:
+{context}
+"""
+    out_path = os.path.join(out_dir or DIRS["workspace"], f"output_{stage_name}")
+    result = None
+
+    if stream:
+        # AI実行（ストリーミング）: 受信したチャンクをそのままworkspaceへ追記し、
+        # 次ステージへは文字列ではなく出力ファイルでバトンを渡す
+        stats = call_llm_stream(combined_prompt, out_path, use_cache=use_cache, role=stage_name)
+        if stats["cached"]: print(f"  🗃️ {stage_name}: キャッシュから出力しました。")
+        else: print(f"  📡 {stage_name}: TTFT {stats['ttft']:.2f}s / {stats['tokens']} tokens / {stats['tps']:.1f} tok/s")
+    else:
+        # AI実行
+        result = call_llm(combined_prompt, use_cache=use_cache, role=stage_name)
+
+        # 結果の保存
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(result)
+
+    ledger.append("stage", key, wait=False, path=out_path, size=os.path.getsize(out_path))
+    print(f"✔️ {key} 完了。結果をworkspaceに出力しました。")
+    return result
+
+def load_stage_graph():
+    """stages/ のプロンプト群を依存グラフにする（無い・壊れている場合は理由を表示して None）"""
+    stage_files = sorted(glob.glob(os.path.join(DIRS["stages"], "*.txt")))
+    if not stage_files:
+        print("🛑 停止: stages/ にプロンプトファイルがありません。")
+        return None
+    try:
+        return build_stage_graph(stage_files)
+    except ValueError as e:
+        print(f"🛑 停止: {e}")
+        return None
 
 def run_pipeline():
     print("🚀 [ENGINE START] Universal Pipeline Processing...")
+    telemetry.start_run("engine")
     
     # 1. 目的（Order）の読み込み
     order_path = os.path.join(DIRS["order"], "order.txt")
     if not os.path.exists(order_path):
         print("🛑 停止: order.txt がありません。")
         return
-    current_context = open(order_path, "r", encoding="utf-8").read().strip()
-    print(f"📄 ORDER LOADED: {current_context[:50]}...")
+    order_text = open(order_path, "r", encoding="utf-8").read().strip()
+    print(f"📄 ORDER LOADED: {order_text[:50]}...")
 
-    # 2. Stages（外部プロンプト群）の取得と順次実行
-    stage_files = sorted(glob.glob(os.path.join(DIRS["stages"], "*.txt")))
-    if not stage_files:
-        print("🛑 停止: stages/ にプロンプトファイルがありません。")
+    # 2. Stages（外部プロンプト群）の取得と依存グラフの構築
+    graph = load_stage_graph()
+    if graph is None: return
+
+    # 3. 依存が満たされたステージから並列に実行（出力を次の入力とするパイプライン）
+    #    実行全体の予算（RUN_BUDGET_SEC）は各ステージのスレッドにも引き継ぐ
+    outputs, running = {}, {}
+    with deadline.run_budget(), ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="stage") as pool:
+        try:
+            while len(outputs) < len(graph):
+                for name, node in graph.items():
+                    if name in outputs or name in running: continue
+                    if all(d in outputs for d in node["deps"]):
+                        running[name] = pool.submit(deadline.bind(run_stage), name, node, _stage_input(node, outputs, order_text))
+                finished, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                for name in [n for n, fut in running.items() if fut in finished]:
+                    outputs[name] = running.pop(name).result()  # 失敗したステージの例外はここで送出される
+        except deadline.BudgetExceeded as e:
+            print(f"\n🛑 [BUDGET REACHED] 実行予算を使い切りました。未完了: {sorted(set(graph) - set(outputs))} ({e})")
+            print(telemetry.describe(telemetry.finish_run()))
+            return
+
+    print("\n🏁 [ENGINE FINISHED] 全ステージのパイプライン処理が完了しました。")
+    print(f"🗃️ キャッシュ: {llm_cache.STATS}")
+    print(telemetry.describe(telemetry.finish_run()))
+
+# ---------------------------------------------------------
+# バッチモード（多数の指令を同じステージ列に流す）
+#   指令 k がステージ3にいる間に、指令 k+1 はステージ1を進める。同時実行は全指令合計で BATCH_CONCURRENCY まで。
+#   (指令, ステージ) の完了は manifest.jsonl へ1行ずつ追記し、中断しても完了済みの組から先を再開できる。
+# ---------------------------------------------------------
+def load_orders(source):
+    """指令ディレクトリ（*.txt を1ファイル1指令）か JSONL（文字列 or {"id", "order"}）を [(id, 指令文)] にする"""
+    orders = []
+    if os.path.isdir(source):
+        for path in sorted(glob.glob(os.path.join(source, "*.txt"))):
+            orders.append((os.path.splitext(os.path.basename(path))[0], open(path, "r", encoding="utf-8").read().strip()))
+    else:
+        with open(source, "r", encoding="utf-8") as f:
+            for lineno, line in enumerate(f, 1):
+                if not line.strip(): continue
+                item = json.loads(line)
+                if isinstance(item, str): item = {"order": item}
+                orders.append((str(item.get("id") or f"{lineno:05d}"), str(item.get("order") or item.get("text") or "").strip()))
+    # ID はそのままディレクトリ名になるので、パス区切りなどは置き換える
+    orders = [(re.sub(r"[^\w.-]", "_", oid), text) for oid, text in orders if text]
+    seen, duplicated = set(), set()
+    for oid, _ in orders:
+        if oid in seen: duplicated.add(oid)
+        seen.add(oid)
+    if duplicated: raise ValueError(f"指令IDが重複しています: {sorted(duplicated)[:10]}")
+    return orders
+
+def batch_root(name):
+    return os.path.join(BATCH_DIR, name)
+
+def load_manifest(root):
+    """manifest.jsonl を読み、(指令ID, ステージ) ごとの最後の記録を返す（書きかけの末尾行は無視する）"""
+    records = {}
+    try:
+        with open(os.path.join(root, "manifest.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                try: record = json.loads(line)
+                except ValueError: continue
+                records[(record["order"], record["stage"])] = record
+    except OSError:
+        pass
+    return records
+
+def _append_manifest(root, record):
+    with open(os.path.join(root, "manifest.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def _stage_hash(node):
+    return checkpoint.content_hash(json.dumps([node["headers"], node["instruction"], node["deps"]], ensure_ascii=False, sort_keys=True))
+
+def _completed(graph, records, oid, order_hash, root):
+    """前回までに完了済みとみなせるステージ（指令・ステージ定義が同じで出力が残り、依存先もすべて完了済み）"""
+    done = set()
+    def valid(name):
+        if name in done: return True
+        record = records.get((oid, name))
+        ok = (record is not None and record["status"] == "done" and record["order_hash"] == order_hash
+              and record["stage_hash"] == _stage_hash(graph[name])
+              and os.path.exists(os.path.join(root, oid, f"output_{name}"))
+              and all(valid(d) for d in graph[name]["deps"]))
+        if ok: done.add(name)
+        return ok
+    for name in graph: valid(name)
+    return done
+
+def run_batch(source, name=None, concurrency=BATCH_CONCURRENCY, retry_failed=False):
+    print(f"🚀 [ENGINE BATCH START] {source}")
+    telemetry.start_run("engine-batch")
+    try:
+        orders = load_orders(source)
+    except (OSError, ValueError) as e:
+        print(f"🛑 停止: 指令を読み込めません: {e}")
         return
+    if not orders:
+        print("🛑 停止: 指令がありません。")
+        return
+    graph = load_stage_graph()
+    if graph is None: return
 
-    for stage_file in stage_files:
-        stage_name = os.path.basename(stage_file)
-        print(f"\n⚙️ [STAGE EXECUTING]: {stage_name}")
-        
-        # 外部ファイルから「このステージでのAIの役割・思想・指示」を読み込む
-        stage_instruction = open(stage_file, "r", encoding="utf-8").read().strip()
-        
-        # プロンプトの合成：【ステージの指示】＋【前段までの文脈/結果】
-        combined_prompt = f"""
-{stage_instruction}
+    name = name or os.path.splitext(os.path.basename(os.path.normpath(source)))[0]
+    root = batch_root(name)
+    os.makedirs(root, exist_ok=True)
+    records = load_manifest(root)
 
-【現在の文脈 / 前ステージからの入力】:
-{current_context}
-"""
-        # AI実行
-        result = call_llm(combined_prompt)
-        
-        # 結果の保存と、次ステージへのバトンタッチ（Contextの更新）
-        out_path = os.path.join(DIRS["workspace"], f"output_{stage_name}")
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(result)
-        
-        current_context = result # 出力を次の入力とする（パイプライン）
-        print(f"✔️ {stage_name} 完了。結果をworkspaceに出力しました。")
+    # 指令ごとの状態。完了済みの出力は文字列で持たず、必要になった時にファイルから読む
+    state = {}
+    for oid, text in orders:
+        order_hash = checkpoint.content_hash(text)
+        done = _completed(graph, records, oid, order_hash, root)
+        failed = not retry_failed and any(records.get((oid, s), {}).get("status") == "failed"
+                                          and records[(oid, s)].get("order_hash") == order_hash for s in graph if s not in done)
+        os.makedirs(os.path.join(root, oid), exist_ok=True)
+        state[oid] = {"text": text, "hash": order_hash, "outputs": {s: None for s in done}, "failed": failed}
+    open_orders = [oid for oid, _ in orders if not state[oid]["failed"] and len(state[oid]["outputs"]) < len(graph)]
+    skipped = sum(len(st["outputs"]) for st in state.values())
+    print(f"📄 {len(orders)}件の指令 × {len(graph)}ステージ（完了済み {skipped}組 / 残り指令 {len(open_orders)}件 / 同時実行 {concurrency}）")
+    held = sum(1 for st in state.values() if st["failed"])
+    if held: print(f"  ⚠️ 前回失敗した指令 {held}件は実行しません（--retry-failed で再挑戦）")
 
-    print("\n🏁 [ENGINE FINISHED] 全ステージのパイプライン処理が完了しました。")
+    running = {}
+    started, completed, errors = time.time(), 0, 0
+    with deadline.run_budget(), ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as pool:
+        try:
+            while open_orders or running:
+                # 先に来た指令の後段を優先して空き枠を埋める（指令単位で早く仕上がり、後続の指令は前段を進める）
+                for oid in open_orders:
+                    if len(running) >= concurrency: break
+                    st = state[oid]
+                    for stage, node in graph.items():
+                        if len(running) >= concurrency: break
+                        if stage in st["outputs"] or (oid, stage) in running.values(): continue
+                        if all(d in st["outputs"] for d in node["deps"]):
+                            out_dir = os.path.join(root, oid)
+                            context = _stage_input(node, st["outputs"], st["text"], out_dir)
+                            future = pool.submit(deadline.bind(run_stage), stage, node, context, out_dir, f"{name}/{oid}/{stage}")
+                            running[future] = (oid, stage)
+                if not running: break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    oid, stage = running.pop(future)
+                    st = state[oid]
+                    record = {"order": oid, "stage": stage, "order_hash": st["hash"], "stage_hash": _stage_hash(graph[stage]), "ts": time.time()}
+                    try:
+                        future.result()
+                    except deadline.BudgetExceeded:
+                        raise
+                    except Exception as e:
+                        # 失敗した指令だけを止め、他の指令は流し続ける（--retry-failed で再挑戦）
+                        print(f"  ⚠️ {oid}/{stage} 失敗: {e}")
+                        _append_manifest(root, dict(record, status="failed", error=str(e)[:500]))
+                        st["failed"] = True
+                        errors += 1
+                        continue
+                    _append_manifest(root, dict(record, status="done"))
+                    st["outputs"][stage] = None  # 後段へはファイルで渡す（全指令の出力をメモリに溜めない）
+                    completed += 1
+                open_orders = [oid for oid in open_orders if not state[oid]["failed"] and len(state[oid]["outputs"]) < len(graph)]
+        except deadline.BudgetExceeded as e:
+            print(f"\n🛑 [BUDGET REACHED] 実行予算を使い切りました。続きは同じコマンドで再開できます。({e})")
+
+    elapsed = time.time() - started
+    finished_orders = sum(1 for st in state.values() if len(st["outputs"]) == len(graph))
+    print(f"\n🏁 [ENGINE BATCH FINISHED] 完了 {finished_orders}/{len(orders)}件 / 今回実行 {completed}組 / 失敗 {errors}組 "
+          f"({elapsed:.1f}s, {completed / max(elapsed, 1e-6):.2f} stages/s)")
+    print(f"📂 出力: {root}")
+    print(f"🗃️ キャッシュ: {llm_cache.STATS}")
+    print(telemetry.describe(telemetry.finish_run()))
+
+def batch_status(name):
+    """バッチの進み具合（manifest.jsonl から）"""
+    records = load_manifest(batch_root(name))
+    if not records:
+        print(f"バッチ {name} の記録がありません。")
+        return
+    per_order = {}
+    for (oid, stage), record in records.items():
+        per_order.setdefault(oid, {})[stage] = record
+    done = sum(1 for r in records.values() if r["status"] == "done")
+    failed = {oid: r for oid, stages in per_order.items() for r in stages.values() if r["status"] == "failed"}
+    print(f"バッチ {name}: 指令 {len(per_order)}件 / 完了した組 {done} / 失敗した指令 {len(failed)}件")
+    for oid, r in sorted(failed.items()):
+        print(f"  ⚠️ {oid}/{r['stage']}: {r.get('error', '').splitlines()[0][:80] if r.get('error') else ''}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ステージ列のパイプラインを実行する（既定は order/order.txt の1件）")
+    parser.add_argument("--batch", metavar="SOURCE", help="指令ディレクトリ（*.txt）または JSONL をまとめて流す")
+    parser.add_argument("--name", help="バッチ名（既定は SOURCE の名前。workspace/batch/<名前>/ に出力）")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="全指令合計の同時実行数")
+    parser.add_argument("--retry-failed", action="store_true", help="前回失敗した指令も再挑戦する")
+    parser.add_argument("--status", metavar="NAME", help="バッチの進み具合を表示する")
+    args = parser.parse_args(argv)
+
+    if args.status: batch_status(args.status)
+    elif args.batch: run_batch(args.batch, args.name, max(1, args.concurrency), args.retry_failed)
+    else: run_pipeline()
 
 if __name__ == "__main__":
-    run_pipeline()
\ No newline at end of file
+    main()
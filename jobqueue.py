@@ -0,0 +1,354 @@
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# ---------------------------------------------------------
+# 1. 永続ジョブキューの基盤（SQLite WAL。ファクトリの進化・探求ジョブを貸出制で配る）
+#    - 同じキーの待機ジョブは1件にまとめる（実行中に来た指令更新は「次の1回」になる）
+#    - 取得したジョブは期限付きの貸出（lease）。ワーカーは心拍で延長し、期限切れは他のワーカーが回収する
+#    - 同じキーのジョブは同時に1件だけ実行し、全プロセス合計の実行数にも上限を設ける
+#    回収されたジョブはチェックポイントから再開されるので、プロセスが落ちても仕事は失われない。
+# ---------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.getenv("JOB_QUEUE_DB") or os.path.join(BASE_DIR, ".jobqueue", "jobs.db")
+
+LEASE_SEC = float(os.getenv("JOB_LEASE_SEC", "120"))          # 心拍が途絶えてから回収されるまでの時間
+HEARTBEAT_SEC = max(1.0, LEASE_SEC / 4)                        # 貸出の延長間隔
+MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", "4"))           # 全ワーカープロセス合計の同時実行数
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))         # これを超えて失敗・回収されたジョブは failed
+RETRY_BACKOFF_SEC = float(os.getenv("JOB_RETRY_BACKOFF_SEC", "30"))
+POLL_SEC = float(os.getenv("JOB_POLL_SEC", "1.0"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    key TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued / running / done / failed / superseded
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    available_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_until REAL,
+    worker TEXT,
+    error TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS jobs_queued_key ON jobs(queue, key) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, queue, available_at);
+"""
+
+_init_lock = threading.Lock()
+_initialized = set()
+
+def _connect():
+    """スレッドごとに接続を開く（sqlite3 の接続はスレッド間で共有しない）"""
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA busy_timeout = 30000")
+    conn.execute("PRAGMA synchronous = FULL")  # 貸出・完了の記録は電源断でも失わない
+    with _init_lock:
+        if DB_PATH not in _initialized:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(_SCHEMA)
+            _initialized.add(DB_PATH)
+    return conn
+
+class _transaction:
+    """BEGIN IMMEDIATE で書き込みを直列化する（取得・回収の判定が他プロセスと競合しない）"""
+    def __enter__(self):
+        self.conn = _connect()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
+
+def _to_job(row):
+    if row is None: return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    return job
+
+def _requeue(conn, job_id, available_at, attempts_delta=0):
+    """実行中のジョブを待機へ戻す。同じキーの待機ジョブが既にあれば、そちらが新しいので superseded にする"""
+    cur = conn.execute("UPDATE OR IGNORE jobs SET status = 'queued', worker = NULL, lease_until = NULL, "
+                       "available_at = ?, attempts = attempts + ? WHERE id = ?", (available_at, attempts_delta, job_id))
+    if cur.rowcount == 0:
+        conn.execute("UPDATE jobs SET status = 'superseded', finished_at = ?, worker = NULL, lease_until = NULL "
+                     "WHERE id = ?", (time.time(), job_id))
+        return False
+    return True
+
+# ---------------------------------------------------------
+# 2. 投入・取得・心拍・完了
+# ---------------------------------------------------------
+def enqueue(queue, key, payload):
+    """ジョブを積む。同じキーの待機ジョブがあれば内容だけ最新にして1件にまとめる（待ち時間は古い方を保つ）"""
+    now = time.time()
+    with _transaction() as conn:
+        conn.execute("INSERT INTO jobs (queue, key, payload, enqueued_at, available_at) VALUES (?, ?, ?, ?, ?) "
+                     "ON CONFLICT(queue, key) WHERE status = 'queued' DO UPDATE SET payload = excluded.payload",
+                     (queue, key, json.dumps(payload, ensure_ascii=False), now, now))
+        return conn.execute("SELECT id FROM jobs WHERE queue = ? AND key = ? AND status = 'queued'",
+                            (queue, key)).fetchone()["id"]
+
+def _reclaim(conn, now):
+    """心拍の途絶えた実行中ジョブを回収する（試行回数を使い切っていれば failed）"""
+    expired = conn.execute("SELECT id, queue, key, attempts, worker FROM jobs WHERE status = 'running' AND lease_until < ?",
+                           (now,)).fetchall()
+    for job in expired:
+        if job["attempts"] >= MAX_ATTEMPTS:
+            conn.execute("UPDATE jobs SET status = 'failed', finished_at = ?, lease_until = NULL, "
+                         "error = 'lease expired' WHERE id = ?", (now, job["id"]))
+            print(f"  ☠️ [QUEUE] {job['queue']}/{job['key']} (#{job['id']}): 貸出切れが続いたため failed にしました。")
+        elif _requeue(conn, job["id"], now):
+            print(f"  ♻️ [QUEUE] {job['queue']}/{job['key']} (#{job['id']}): {job['worker']} の貸出切れを回収しました。")
+    return len(expired)
+
+def claim(queue, worker):
+    """実行できるジョブを1件借りる。全体の上限に達しているか、実行可能なものが無ければ None"""
+    now = time.time()
+    with _transaction() as conn:
+        _reclaim(conn, now)
+        running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running'").fetchone()[0]
+        if running >= MAX_RUNNING: return None
+        row = conn.execute("SELECT * FROM jobs WHERE queue = ? AND status = 'queued' AND available_at <= ? "
+                           "AND key NOT IN (SELECT key FROM jobs WHERE queue = ? AND status = 'running') "
+                           "ORDER BY available_at, id LIMIT 1", (queue, now, queue)).fetchone()
+        if row is None: return None
+        conn.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, started_at = ?, "
+                     "lease_until = ?, error = NULL WHERE id = ?", (worker, now, now + LEASE_SEC, row["id"]))
+        return _to_job(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+
+def heartbeat(job_id, worker):
+    """貸出を延長する。既に他のワーカーへ回収されていれば False"""
+    with _transaction() as conn:
+        cur = conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                           (time.time() + LEASE_SEC, job_id, worker))
+        return cur.rowcount == 1
+
+def complete(job_id, worker):
+    """完了を記録する。貸出を失っていた場合は記録せず False（回収した側の結果を正とする）"""
+    with _transaction() as conn:
+        cur = conn.execute("UPDATE jobs SET status = 'done', finished_at = ?, lease_until = NULL "
+                           "WHERE id = ? AND worker = ? AND status = 'running'", (time.time(), job_id, worker))
+        return cur.rowcount == 1
+
+def fail(job_id, worker, error):
+    """失敗を記録する。試行回数が残っていれば待ってから再実行、使い切っていれば failed"""
+    now = time.time()
+    with _transaction() as conn:
+        job = conn.execute("SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND status = 'running'",
+                           (job_id, worker)).fetchone()
+        if job is None: return None
+        conn.execute("UPDATE jobs SET error = ? WHERE id = ?", (str(error)[:2000], job_id))
+        if job["attempts"] < MAX_ATTEMPTS:
+            _requeue(conn, job_id, now + RETRY_BACKOFF_SEC * 2 ** (job["attempts"] - 1))
+            return "retry"
+        conn.execute("UPDATE jobs SET status = 'failed', finished_at = ?, lease_until = NULL WHERE id = ?", (now, job_id))
+        return "failed"
+
+# ---------------------------------------------------------
+# 貸出の喪失（回収されたジョブの旧所有者は、以後ファイルもチェックポイントも書かない）
+# ---------------------------------------------------------
+class LeaseLost(RuntimeError):
+    """このワーカーの貸出が他のワーカーへ回収された（同じターゲットを二重に進めないため処理を打ち切る）"""
+
+class Lease:
+    """実行中ジョブの貸出。心拍が失敗すると cancelled が立ち、check() が LeaseLost を送出する"""
+    def __init__(self, job_id, worker):
+        self.job_id, self.worker = job_id, worker
+        self.cancelled = threading.Event()
+
+    def check(self):
+        """書き込みの直前に呼ぶ。心拍で延長して所有を確かめ、失っていれば LeaseLost"""
+        if not self.cancelled.is_set():
+            try:
+                if not heartbeat(self.job_id, self.worker): self.cancelled.set()
+            except sqlite3.Error:
+                pass  # 一時的に DB へ届かないだけなら、心拍スレッドの判断に任せる
+        if self.cancelled.is_set():
+            raise LeaseLost(f"job #{self.job_id}: {self.worker} の貸出は他のワーカーへ回収されました")
+
+# フェーズの奥（スレッドプール内も deadline.bind で引き継ぐ）から今の貸出を確かめられるよう ContextVar に置く
+_current_lease = contextvars.ContextVar("current_lease", default=None)
+
+@contextmanager
+def holding(lease):
+    """この中での ensure_lease() を lease で確かめる（lease が None ならキュー外の実行として何もしない）"""
+    token = _current_lease.set(lease)
+    try:
+        yield
+    finally:
+        _current_lease.reset(token)
+
+def ensure_lease():
+    """ファイル・チェックポイント・記憶を書く直前に呼ぶ。キューの外で動いているときは何もしない"""
+    lease = _current_lease.get()
+    if lease is not None: lease.check()
+
+def release(job_id, worker):
+    """停止するワーカーが実行中のジョブを手放す（試行回数に数えず、すぐ他のワーカーが拾えるようにする）"""
+    with _transaction() as conn:
+        if conn.execute("SELECT 1 FROM jobs WHERE id = ? AND worker = ? AND status = 'running'", (job_id, worker)).fetchone():
+            _requeue(conn, job_id, time.time(), attempts_delta=-1)
+
+def retry(job_id):
+    """failed のジョブを待機へ戻す（試行回数はリセット）"""
+    with _transaction() as conn:
+        cur = conn.execute("UPDATE jobs SET attempts = 0, error = NULL, finished_at = NULL WHERE id = ? AND status = 'failed'",
+                           (job_id,))
+        return _requeue(conn, job_id, time.time()) if cur.rowcount else None
+
+# ---------------------------------------------------------
+# 3. ワーカー（1プロセスに slots 本の実行スレッド + 心拍スレッド）
+# ---------------------------------------------------------
+def serve(queue, handler, slots=1, on_idle=None, stop=None):
+    """
+    queue のジョブを handler(payload, lease) で処理し続ける。Ctrl+C で止めると、実行中のジョブを手放してから戻る。
+    lease は心拍が失敗すると cancelled になる。handler はフェーズの合間と書き込みの前に lease.check() を呼び、
+    LeaseLost が出たら何も書かずに戻ること（回収した別のワーカーが同じジョブを進めている）。
+    on_idle: このプロセスの仕事が一段落した（実行中が0件になり、待機も無くなった）ときに1回呼ぶ。
+    """
+    stop = stop or threading.Event()
+    worker_base = f"{socket.gethostname()}:{os.getpid()}"
+    active = {}  # job_id -> Lease
+    state = {"busy": 0, "did_work": False}
+    lock = threading.Lock()
+
+    def beat():
+        while not stop.wait(HEARTBEAT_SEC):
+            with lock: leases = list(active.values())
+            for lease in leases:
+                if lease.cancelled.is_set(): continue
+                try:
+                    if not heartbeat(lease.job_id, lease.worker):
+                        lease.cancelled.set()
+                        print(f"  ⚠️ [QUEUE] #{lease.job_id}: 貸出を失いました（他のワーカーが回収済み）。処理を打ち切ります。")
+                except sqlite3.Error as e:
+                    print(f"  ⚠️ [QUEUE] 心拍に失敗: {e}")
+
+    def run_slot(slot):
+        worker = f"{worker_base}:{slot}"
+        while not stop.is_set():
+            try:
+                job = claim(queue, worker)
+            except sqlite3.Error as e:
+                print(f"  ⚠️ [QUEUE] 取得に失敗: {e}")
+                job = None
+            if job is None:
+                idle = False
+                with lock:
+                    if state["busy"] == 0 and state["did_work"]:
+                        state["did_work"], idle = False, True
+                if idle and on_idle: on_idle()
+                stop.wait(POLL_SEC)
+                continue
+            lease = Lease(job["id"], worker)
+            with lock:
+                active[job["id"]] = lease
+                state["busy"] += 1
+            print(f"\n📥 [QUEUE] {queue}/{job['key']} (#{job['id']}, 試行{job['attempts']}) を {worker} が実行します。")
+            try:
+                with holding(lease): handler(job["payload"], lease)
+                if not complete(job["id"], worker):
+                    print(f"  ⚠️ [QUEUE] #{job['id']}: 貸出を失っていたため完了を記録しませんでした。")
+            except LeaseLost as e:
+                # 結果は回収した側が記録する。こちらは失敗としても数えない
+                print(f"  ✋ [QUEUE] 打ち切りました: {e}")
+            except Exception as e:
+                print(f"❌ 致命的エラー: {e}")
+                outcome = fail(job["id"], worker, e)
+                if outcome == "retry": print(f"  🔁 [QUEUE] #{job['id']}: 後で再実行します。")
+                elif outcome == "failed": print(f"  ☠️ [QUEUE] #{job['id']}: 試行回数を使い切りました。")
+            finally:
+                with lock:
+                    active.pop(job["id"], None)
+                    state["busy"] -= 1
+                    state["did_work"] = True
+
+    threads = [threading.Thread(target=beat, name=f"{queue}-heartbeat", daemon=True)]
+    threads += [threading.Thread(target=run_slot, args=(i,), name=f"{queue}-{i}", daemon=True) for i in range(slots)]
+    for t in threads: t.start()
+    try:
+        while not stop.wait(1): pass
+    except KeyboardInterrupt:
+        stop.set()
+        with lock: jobs = list(active.values())
+        for lease in jobs: release(lease.job_id, lease.worker)
+        if jobs: print(f"\n⏸️ [QUEUE] 実行中の {len(jobs)} 件を手放しました（チェックポイントから再開されます）。")
+
+# ---------------------------------------------------------
+# 4. 状況の確認（python jobqueue.py stats / list / retry）
+# ---------------------------------------------------------
+def stats():
+    """キューごとの状態別件数、最古の待機ジョブの待ち時間、実行中の貸出残り"""
+    now = time.time()
+    conn = _connect()
+    try:
+        result = {}
+        for row in conn.execute("SELECT queue, status, COUNT(*) AS n, MIN(enqueued_at) AS oldest, "
+                                "MIN(lease_until) AS lease FROM jobs GROUP BY queue, status"):
+            q = result.setdefault(row["queue"], {"counts": {}, "oldest_queued_age": None, "min_lease_left": None})
+            q["counts"][row["status"]] = row["n"]
+            if row["status"] == "queued": q["oldest_queued_age"] = round(now - row["oldest"], 1)
+            if row["status"] == "running" and row["lease"]: q["min_lease_left"] = round(row["lease"] - now, 1)
+        return result
+    finally:
+        conn.close()
+
+def jobs(queue=None, status=None, limit=20):
+    conn = _connect()
+    try:
+        where = [c for c, v in (("queue = ?", queue), ("status = ?", status)) if v]
+        sql = "SELECT * FROM jobs" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id DESC LIMIT ?"
+        return [_to_job(r) for r in conn.execute(sql, [v for v in (queue, status) if v] + [limit])]
+    finally:
+        conn.close()
+
+def _age(ts, now):
+    return "-" if ts is None else f"{now - ts:.0f}s"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ファクトリのジョブキューを確認する")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="キューごとの深さと待ち時間")
+    p_list = sub.add_parser("list", help="ジョブごとの状態")
+    p_list.add_argument("--queue")
+    p_list.add_argument("--status")
+    p_list.add_argument("-n", type=int, default=20)
+    p_retry = sub.add_parser("retry", help="failed のジョブを待機へ戻す")
+    p_retry.add_argument("job_id", type=int)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "stats":
+        json.dump(stats(), sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    elif args.cmd == "list":
+        now = time.time()
+        print(f"{'id':>6} {'queue':<12} {'key':<24} {'status':<10} {'try':>3} {'age':>7} {'lease':>6} worker / error")
+        for job in jobs(args.queue, args.status, args.n):
+            lease = f"{job['lease_until'] - now:.0f}s" if job["status"] == "running" and job["lease_until"] else "-"
+            tail = job["worker"] or ""
+            if job["error"]: tail += f" {job['error'].splitlines()[0][:60]}"
+            print(f"{job['id']:>6} {job['queue']:<12} {job['key'][:24]:<24} {job['status']:<10} {job['attempts']:>3} "
+                  f"{_age(job['enqueued_at'], now):>7} {lease:>6} {tail}")
+    elif args.cmd == "retry":
+        result = retry(args.job_id)
+        print("再投入しました。" if result else "failed のジョブではありません（または同じキーの待機ジョブに統合されました）。")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import re
+import json
+
+# ---------------------------------------------------------
+# LLM応答の寛容なJSONパーサ（LLMに修復させる前に、手元で直せるものは直す）
+#   - ```json フェンスや前後の地の文
+#   - 文字列内の生の改行・タブ（エスケープ漏れ）
+#   - 閉じ括弧直前の余分なカンマ
+#   - 末尾で途切れた閉じ括弧（ただし途切れた文字列は内容が欠けているので直さない）
+# ---------------------------------------------------------
+_FENCE_RE = re.compile(r"```[A-Za-z]*[ \t]*\n?")
+_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t"}
+
+def _strip_fences(text):
+    """JSON本体より前にある開始フェンスまでを捨てる（閉じフェンスは後続の地の文として読み飛ばす）"""
+    m = _FENCE_RE.search(text)
+    brace = min([i for i in (text.find("{"), text.find("[")) if i >= 0], default=len(text))
+    return text[m.end():] if m and m.start() < brace else text
+
+def _drop_trailing(out, notes):
+    """閉じ括弧を置く前に、末尾の空白と余分なカンマを取り除く"""
+    while out and out[-1].isspace(): out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+        notes.add("余分なカンマ")
+        while out and out[-1].isspace(): out.pop()
+
+def repair(text):
+    """修復済みのJSON文字列と、行った修復の一覧を返す。途切れた文字列に当たったら None"""
+    notes = set()
+    body = _strip_fences(text.strip())
+    if body != text.strip(): notes.add("フェンス除去")
+    starts = [i for i in (body.find("{"), body.find("[")) if i >= 0]
+    if not starts: return None, notes
+    if body[:min(starts)].strip(): notes.add("前置きの地の文")
+
+    out, stack, in_str, esc = [], [], False, False
+    end = len(body)
+    for i in range(min(starts), len(body)):
+        ch = body[i]
+        if in_str:
+            if esc:
+                esc = False
+            elif ch == "\\":
+                esc = True
+            elif ch == '"':
+                in_str = False
+            elif ch in _ESCAPES or ord(ch) < 0x20:
+                out.append(_ESCAPES.get(ch) or f"\\u{ord(ch):04x}")
+                notes.add("文字列内の改行")
+                continue
+            out.append(ch)
+            continue
+        if ch == '"':
+            in_str = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            _drop_trailing(out, notes)
+            if stack: stack.pop()
+            out.append(ch)
+            if not stack:
+                end = i + 1
+                break
+            continue
+        out.append(ch)
+
+    if in_str: return None, notes
+    if body[end:].strip(): notes.add("後続の地の文")
+    if stack:
+        notes.add("閉じ括弧の補完")
+        while stack:
+            _drop_trailing(out, notes)
+            # "key": で途切れていたらキーごと捨てる
+            if out and out[-1] == ":":
+                head = "".join(out[:-1]).rstrip()
+                out[:] = list(head[:head.rfind('"', 0, len(head) - 1)])
+                _drop_trailing(out, notes)
+            out.append(stack.pop())
+    return "".join(out), notes
+
+def loads(text):
+    """json.loads を試し、失敗したら手元で修復してから読む。(値, 修復の一覧) を返す"""
+    try:
+        return json.loads(text), []
+    except json.JSONDecodeError as e:
+        error = e
+    fixed, notes = repair(text)
+    if fixed is None: raise error
+    try:
+        return json.loads(fixed), sorted(notes)
+    except json.JSONDecodeError:
+        raise error
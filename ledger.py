@@ -0,0 +1,356 @@
+import os
+import sys
+import json
+import gzip
+import time
+import zlib
+import bisect
+import struct
+import atexit
+import argparse
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス内ロックのみで動作
+    fcntl = None
+
+# ---------------------------------------------------------
+# 1. 不可逆台帳（全エンジンの状態遷移を追記のみで記録する）
+#    台帳が本体なのは L1（短期記憶）だけで、ファクトリは latest() で読み戻す。
+#    L2 の教訓ストアと成果物はこれまでどおりファイルが本体で、台帳には L2 の差分・成果物の世代・
+#    フェーズ遷移などの出来事を残すだけ（state_at で当時の L2 を再構成できるが、実行時には読まない）。
+#    レビューは台帳に載せない（run-archive 側）
+#    <LEDGER_DIR>/seg-<先頭seq>.log   : 1行1レコード "<seq> <crc32> <json>"（書き込み中のセグメント）
+#    <LEDGER_DIR>/seg-<先頭seq>.log.gz: 上限に達して閉じたセグメント（索引ブロックごとに独立した gzip メンバー）
+#    <LEDGER_DIR>/seg-<先頭seq>.idx   : INDEX_EVERY 件ごとの (seq, バイト位置) を固定長で並べた疎な索引
+#    <LEDGER_DIR>/head.json           : 次の seq と書き込み中のセグメント名（プロセス間で共有）
+#    <LEDGER_DIR>/latest.json         : 閉じたセグメントまでの (kind, key) ごとの最新 data（切り替え時に畳み込む）
+# ---------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LEDGER_DIR = os.getenv("LEDGER_DIR") or os.path.join(BASE_DIR, "ledger")
+ENABLED = os.getenv("LEDGER", "1") != "0"
+SEGMENT_BYTES = int(os.getenv("LEDGER_SEGMENT_BYTES", str(8 * 1024 * 1024)))
+INDEX_EVERY = 64
+_INDEX_ENTRY = struct.Struct("<QQ")
+
+_cond = threading.Condition()
+_pending = []        # まだディスクに書いていないレコード（seq 未採番）
+_flushing = False    # いずれかのスレッドがグループコミット中か
+_durable = 0         # このプロセスで fsync 済みになった書き込み要求の通し番号
+_submitted = 0       # このプロセスで受け付けた書き込み要求の通し番号
+_local_lock = threading.Lock()
+
+def _seg_name(first_seq):
+    return f"seg-{first_seq:012d}"
+
+@contextmanager
+def _locked():
+    """台帳全体のプロセス間ロック（追記・セグメントの圧縮・読み手のスナップショット取得）"""
+    with _local_lock:
+        os.makedirs(LEDGER_DIR, exist_ok=True)
+        with open(os.path.join(LEDGER_DIR, "ledger.lock"), "a+") as lock_fd:
+            if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+@contextmanager
+def _locked_head():
+    """head.json をロック下で読み書きする（複数プロセスが同じ台帳へ追記できるように）"""
+    with _locked():
+        path = os.path.join(LEDGER_DIR, "head.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f: head = json.load(f)
+        except (OSError, ValueError):
+            head = {"next_seq": 1, "active": _seg_name(1)}
+        yield head
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f: json.dump(head, f)
+        os.replace(tmp_path, path)
+
+# ---------------------------------------------------------
+# 2. 追記（グループコミット: 同時に届いた追記をまとめて1回の fsync にする）
+# ---------------------------------------------------------
+def append(kind, key, wait=True, **data):
+    """
+    レコードを追記する。wait=True なら fsync 済みになるまで待つ。
+    待っている間に他スレッドから届いた追記も同じ fsync に相乗りする（待たない追記は次のコミットで書かれる）。
+    """
+    global _submitted, _durable, _flushing
+    if not ENABLED: return
+    record = {"ts": round(time.time(), 3), "pid": os.getpid(), "kind": kind, "key": key, "data": data}
+    with _cond:
+        _submitted += 1
+        ticket = _submitted
+        _pending.append(record)
+        if not wait: return
+        while _durable < ticket:
+            if _flushing:
+                _cond.wait()
+                continue
+            # このスレッドがリーダーとして、溜まっている分をまとめて書く
+            batch, last = list(_pending), _submitted
+            _pending.clear()
+            _flushing = True
+            _cond.release()
+            try:
+                _write_batch(batch)
+            finally:
+                _cond.acquire()
+                _flushing = False
+                _durable = max(_durable, last)
+                _cond.notify_all()
+
+def flush():
+    """待たずに積んだレコードも含め、溜まっている分を書き出す"""
+    global _durable, _flushing
+    if not ENABLED: return
+    with _cond:
+        while _flushing: _cond.wait()
+        if not _pending: return
+        batch, last = list(_pending), _submitted
+        _pending.clear()
+        _flushing = True
+    try:
+        _write_batch(batch)
+    finally:
+        with _cond:
+            _flushing = False
+            _durable = max(_durable, last)
+            _cond.notify_all()
+
+def _line_start(f, end):
+    """end より前にある最後の改行の直後の位置（無ければ 0）を後ろ向きに探す"""
+    pos = end
+    while pos > 0:
+        step = min(65536, pos)
+        f.seek(pos - step)
+        cut = f.read(step).rfind(b"\n")
+        if cut >= 0: return pos - step + cut + 1
+        pos -= step
+    return 0
+
+def _recover_tail(f, head):
+    """
+    前回のプロセスが書きかけで落ちた最終行を切り捨て、最後に書けたレコードの seq に head を合わせる
+    （fsync 後・head.json 更新前に落ちても seq を二重に振らない）
+    """
+    size = f.seek(0, os.SEEK_END)
+    if not size: return
+    f.seek(size - 1)
+    if f.read(1) != b"\n":
+        size = _line_start(f, size)
+        f.truncate(size)
+    if not size: return
+    f.seek(_line_start(f, size - 1))
+    last_seq = int(f.readline().split(b" ", 1)[0])
+    head["next_seq"] = max(head["next_seq"], last_seq + 1)
+
+def _write_batch(batch):
+    with _locked_head() as head:
+        path = os.path.join(LEDGER_DIR, head["active"] + ".log")
+        index = []
+        with open(path, "ab+") as f:
+            _recover_tail(f, head)
+            offset = f.seek(0, os.SEEK_END)
+            lines = []
+            for record in batch:
+                seq = head["next_seq"]
+                head["next_seq"] += 1
+                payload = json.dumps(dict(record, seq=seq), ensure_ascii=False).encode("utf-8")
+                line = b"%d %08x " % (seq, zlib.crc32(payload)) + payload + b"\n"
+                # 各セグメントの先頭と INDEX_EVERY 件ごとに索引を打つ
+                if offset == 0 or seq % INDEX_EVERY == 0: index.append(_INDEX_ENTRY.pack(seq, offset))
+                lines.append(line)
+                offset += len(line)
+            f.write(b"".join(lines))
+            f.flush()
+            os.fsync(f.fileno())
+        if index:
+            with open(os.path.join(LEDGER_DIR, head["active"] + ".idx"), "ab") as f:
+                f.write(b"".join(index))
+                f.flush()
+                os.fsync(f.fileno())
+        if offset >= SEGMENT_BYTES:
+            closed = head["active"]
+            head["active"] = _seg_name(head["next_seq"])
+            _fold_latest()
+            _compress_segment(closed)
+
+def _compress_segment(name):
+    """閉じたセグメントを索引ブロックごとの gzip メンバーに詰め直し、索引の位置も付け替える"""
+    log_path, idx_path = os.path.join(LEDGER_DIR, name + ".log"), os.path.join(LEDGER_DIR, name + ".idx")
+    entries = _read_index(idx_path)
+    if not entries or entries[0][1] != 0:
+        # 先頭の索引を書く前に落ちていた場合は、先頭行から補う
+        with open(log_path, "rb") as f: entries.insert(0, (int(f.readline().split(b" ", 1)[0]), 0))
+    starts = [offset for _, offset in entries] + [os.path.getsize(log_path)]
+    new_index = []
+    with open(log_path, "rb") as src, open(log_path + ".gz.tmp", "wb") as dst:
+        for (seq, _), begin, end in zip(entries, starts, starts[1:]):
+            src.seek(begin)
+            new_index.append(_INDEX_ENTRY.pack(seq, dst.tell()))
+            dst.write(gzip.compress(src.read(end - begin)))
+        dst.flush()
+        os.fsync(dst.fileno())
+    with open(idx_path + ".tmp", "wb") as f: f.write(b"".join(new_index))
+    os.replace(log_path + ".gz.tmp", log_path + ".gz")
+    os.replace(idx_path + ".tmp", idx_path)
+    os.remove(log_path)
+
+atexit.register(flush)
+
+# ---------------------------------------------------------
+# 3. 読み出し（索引を二分探索して任意の seq から再生する）
+# ---------------------------------------------------------
+def _read_index(idx_path):
+    try:
+        with open(idx_path, "rb") as f: data = f.read()
+    except OSError:
+        return []
+    usable = len(data) - len(data) % _INDEX_ENTRY.size
+    return [_INDEX_ENTRY.unpack_from(data, i) for i in range(0, usable, _INDEX_ENTRY.size)]
+
+def _segments():
+    """(先頭seq, セグメント名, 圧縮済みか) を seq 順に返す"""
+    try:
+        names = os.listdir(LEDGER_DIR)
+    except OSError:
+        return []
+    segs = {}
+    for name in names:
+        if not name.startswith("seg-") or not name.endswith((".log", ".log.gz")): continue
+        # 圧縮の途中で両方が見えたら、索引が付け替わる圧縮版を採る
+        first = int(name[4:16])
+        segs[first] = segs.get(first) or name.endswith(".gz")
+    return [(first, _seg_name(first), compressed) for first, compressed in sorted(segs.items())]
+
+def _parse(line, strict):
+    seq, crc, payload = line.rstrip(b"\n").split(b" ", 2)
+    if int(crc, 16) != zlib.crc32(payload):
+        if strict: raise ValueError(f"台帳のチェックサム不一致: seq {int(seq)}")
+        return None
+    return json.loads(payload)
+
+def replay(start_seq=1, end_seq=None):
+    """start_seq 以降のレコードを seq 順に返す（end_seq を含む）"""
+    flush()
+    with _locked(): segs = _segments()
+    firsts = [s[0] for s in segs]
+    for first, name, _ in segs[max(0, bisect.bisect_right(firsts, start_seq) - 1):]:
+        if end_seq is not None and first > end_seq: return
+        # 索引とファイルは圧縮と食い違わないよう、ロック下で組にして開く
+        with _locked():
+            compressed = os.path.exists(os.path.join(LEDGER_DIR, name + ".log.gz"))
+            raw = open(os.path.join(LEDGER_DIR, name + (".log.gz" if compressed else ".log")), "rb")
+            entries = _read_index(os.path.join(LEDGER_DIR, name + ".idx"))
+        pos = bisect.bisect_right([seq for seq, _ in entries], start_seq) - 1
+        offset = entries[pos][1] if pos >= 0 else 0
+        with raw:
+            raw.seek(offset)
+            stream = gzip.GzipFile(fileobj=raw) if compressed else raw
+            for line in stream:
+                # 書きかけの最終行（改行なし）は、書き手が次に修復するまで読まない
+                if not line.endswith(b"\n"): break
+                record = _parse(line, strict=compressed)
+                if record is None: break
+                if record["seq"] < start_seq: continue
+                if end_seq is not None and record["seq"] > end_seq: return
+                yield record
+
+# ---------------------------------------------------------
+# 4. 状態の再構成
+# ---------------------------------------------------------
+_view = {"seq": 0, "latest": {}}
+_view_lock = threading.Lock()
+
+def _load_latest():
+    """latest.json（無ければ空）。書き換えは os.replace なのでロックなしで読める"""
+    try:
+        with open(os.path.join(LEDGER_DIR, "latest.json"), "r", encoding="utf-8") as f: snap = json.load(f)
+    except (OSError, ValueError):
+        return {"seq": 0, "latest": {}}
+    return {"seq": snap["seq"], "latest": {(kind, key): data for kind, key, data in snap["latest"]}}
+
+def _fold_latest():
+    """
+    閉じたセグメントまでの最新を latest.json に畳み込む（_locked 下、圧縮前に呼ぶ）。
+    新しいプロセスの latest() は全体を seq 1 から再生せず、これと書き込み中のセグメントだけを読む
+    """
+    snap = _load_latest()
+    segs = _segments()
+    for i, (first, name, compressed) in enumerate(segs):
+        # 丸ごと畳み込み済みのセグメントは開かない（台帳の途中から使い始めた場合は古い分も拾う）
+        if i + 1 < len(segs) and segs[i + 1][0] <= snap["seq"] + 1: continue
+        with open(os.path.join(LEDGER_DIR, name + (".log.gz" if compressed else ".log")), "rb") as raw:
+            stream = gzip.GzipFile(fileobj=raw) if compressed else raw
+            for line in stream:
+                if not line.endswith(b"\n"): break
+                record = _parse(line, strict=compressed)
+                if record is None: break
+                if record["seq"] <= snap["seq"]: continue
+                snap["latest"][(record["kind"], record["key"])] = record["data"]
+                snap["seq"] = record["seq"]
+    path = os.path.join(LEDGER_DIR, "latest.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"seq": snap["seq"], "latest": [[kind, key, data] for (kind, key), data in snap["latest"].items()]},
+                  f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def latest(kind, key, default=None):
+    """(kind, key) の最新レコードの data。初回は latest.json から始め、それ以降に増えた分だけを読んで追いつく"""
+    if not ENABLED: return default
+    with _view_lock:
+        if not _view["seq"]: _view.update(_load_latest())
+        for record in replay(_view["seq"] + 1):
+            _view["latest"][(record["kind"], record["key"])] = record["data"]
+            _view["seq"] = record["seq"]
+        return _view["latest"].get((kind, key), default)
+
+def state_at(seq=None, ts=None):
+    """seq（または時刻 ts）時点の L1 / L2 を再構成する"""
+    state = {"seq": 0, "l1": {}, "l2": {}}
+    for record in replay(1, seq):
+        if ts is not None and record["ts"] > ts: break
+        data = record["data"]
+        if record["kind"] == "l1":
+            state["l1"][record["key"]] = data.get("text", "")
+        elif record["kind"] == "l2":
+            lessons = state["l2"].setdefault(record["key"], {})
+            for lesson_id in data.get("retired", []): lessons.pop(str(lesson_id), None)
+            for lesson in data.get("added", []): lessons[str(lesson["id"])] = lesson["text"]
+        state["seq"] = record["seq"]
+    return state
+
+def main():
+    parser = argparse.ArgumentParser(description="不可逆台帳の閲覧と再生")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("tail", help="末尾のレコードを表示")
+    p.add_argument("-n", type=int, default=20)
+    p = sub.add_parser("replay", help="seq の範囲を表示")
+    p.add_argument("--from", dest="start", type=int, default=1)
+    p.add_argument("--to", dest="end", type=int)
+    p.add_argument("--kind")
+    p = sub.add_parser("state", help="ある時点の L1 / L2 を再構成して表示")
+    p.add_argument("--seq", type=int)
+    p.add_argument("--ts", type=float)
+    args = parser.parse_args()
+
+    if args.cmd == "state":
+        print(json.dumps(state_at(args.seq, args.ts), ensure_ascii=False, indent=2))
+        return
+    if args.cmd == "tail":
+        with _locked_head() as head: next_seq = head["next_seq"]
+        records = replay(max(1, next_seq - args.n))
+    else:
+        records = replay(args.start, args.end)
+    for record in records:
+        if args.cmd == "replay" and args.kind and record["kind"] != args.kind: continue
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+if __name__ == "__main__":
+    main()
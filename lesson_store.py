@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import math
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+import convergence
+import ledger
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス内ロックのみで動作
+    fcntl = None
+
+# ---------------------------------------------------------
+# 1. 教訓ストアの基盤（L2を1件ずつの教訓として保存し、関係するものだけを取り出す）
+#    <workspace>/lessons_<名前>.json に全件を持ち、検索はローカルの BM25（ネットワーク埋め込みなし）。
+# ---------------------------------------------------------
+TOP_K = int(os.getenv("LESSON_TOP_K", "5"))
+MAX_LESSONS = int(os.getenv("LESSON_MAX", "500"))
+DEDUP_SIMILARITY = float(os.getenv("LESSON_DEDUP_SIMILARITY", "0.8"))
+QUERY_CHARS = 4000  # 検索クエリに使う先頭文字数（巨大な成果物で索引引きが重くならないように）
+BM25_K1, BM25_B = 1.5, 0.75
+
+_lock = threading.Lock()
+_loaded = {}  # path -> (mtime_ns, store, index)
+_path_locks = {}  # path -> プロセス内のロック（flock はスレッドを区別しないため、先にこれで並べる）
+_held = threading.local()
+
+_WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+_CJK_RE = re.compile(r"[぀-ヿ㐀-鿿豈-﫿]+")
+_ITEM_RE = re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+(.+)$")
+
+def tokenize(text):
+    """英数字は単語、日本語は文字 bigram（分かち書き辞書なしで引けるように）"""
+    tokens = [w.lower() for w in _WORD_RE.findall(text)]
+    for run in _CJK_RE.findall(text):
+        tokens += [run[i:i + 2] for i in range(len(run) - 1)] if len(run) > 1 else [run]
+    return tokens
+
+def _empty():
+    return {"next_id": 1, "lessons": []}
+
+def _build_index(store):
+    """語 → [(教訓の位置, 出現数)] の転置索引と、各教訓の語数"""
+    postings, lengths = {}, []
+    for i, lesson in enumerate(store["lessons"]):
+        counts = Counter(tokenize(lesson["text"]))
+        lengths.append(sum(counts.values()))
+        for term, tf in counts.items(): postings.setdefault(term, []).append((i, tf))
+    avg_len = sum(lengths) / len(lengths) if lengths else 0.0
+    return {"postings": postings, "lengths": lengths, "avg_len": avg_len}
+
+@contextmanager
+def locked(path):
+    """
+    ストアの読み込み→更新→保存→書き出しを、スレッドとワーカープロセスをまたいで直列化する。
+    同じスレッドの中では入れ子にできる（Librarian 全体を囲んだ中で update を呼べる）
+    """
+    depth = _held.__dict__.setdefault("depth", {})
+    if depth.get(path):
+        depth[path] += 1
+        try:
+            yield
+        finally:
+            depth[path] -= 1
+        return
+    with _lock: local = _path_locks.setdefault(path, threading.Lock())
+    with local:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f"{path}.lock", "a+") as lock_fd:
+            if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            depth[path] = 1
+            try:
+                yield
+            finally:
+                depth[path] = 0
+                if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+def _load(path):
+    """ファイルの更新時刻が変わっていなければ、読み込み済みの索引を使い回す"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return _empty(), _build_index(_empty())
+    with _lock:
+        cached = _loaded.get(path)
+        if cached and cached[0] == mtime: return cached[1], cached[2]
+    try:
+        with open(path, "r", encoding="utf-8") as f: store = json.load(f)
+    except (OSError, ValueError):
+        store = _empty()
+    index = _build_index(store)
+    with _lock: _loaded[path] = (mtime, store, index)
+    return store, index
+
+def _save(path, store):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f: json.dump(store, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+    with _lock: _loaded[path] = (os.stat(path).st_mtime_ns, store, _build_index(store))
+
+# ---------------------------------------------------------
+# 2. 検索（BM25 上位 k 件）
+# ---------------------------------------------------------
+def search(path, query, k=TOP_K):
+    """query に関係の深い教訓を最大 k 件返す（1語も当たらない教訓は返さない）"""
+    store, index = _load(path)
+    lessons = store["lessons"]
+    if not lessons: return []
+    n = len(lessons)
+    scores = [0.0] * n
+    for term in set(tokenize(query[:QUERY_CHARS])):
+        postings = index["postings"].get(term)
+        if not postings: continue
+        idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+        for i, tf in postings:
+            norm = 1 - BM25_B + BM25_B * index["lengths"][i] / (index["avg_len"] or 1)
+            scores[i] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+    ranked = sorted((i for i in range(n) if scores[i] > 0), key=lambda i: (-scores[i], -lessons[i]["added"]))
+    return [lessons[i] for i in ranked[:k]]
+
+def render(lessons, empty="まだ教訓はない。"):
+    if not lessons: return empty
+    return "\n".join(f"- [L{l['id']}] {l['text']}" for l in lessons)
+
+# ---------------------------------------------------------
+# 3. 追加・退役（locked(path) の下で読み込みから保存までを行う）
+# ---------------------------------------------------------
+def parse_items(markdown):
+    """マークダウンのリスト項目を教訓の本文として取り出す"""
+    return [m.group(1).strip() for line in markdown.splitlines() if (m := _ITEM_RE.match(line))]
+
+def update(path, added=(), retired=(), source=""):
+    """
+    教訓を追加し、指定IDを退役させる。既存とほぼ同じ教訓は追加せず、既存側の更新時刻だけ進める。
+    上限を超えたら最も長く更新されていないものから捨てる。(追加数, 重複数, 退役数) を返す。
+    """
+    with locked(path):
+        return _update_locked(path, added, retired, source)
+
+def _update_locked(path, added, retired, source):
+    store, _ = _load(path)
+    store = json.loads(json.dumps(store))  # 読み込み済みキャッシュを書き換えない
+    lessons = store["lessons"]
+    retired = {int(i) for i in retired}
+    before = len(lessons)
+    lessons[:] = [l for l in lessons if l["id"] not in retired]
+    n_retired = before - len(lessons)
+
+    n_dup, new_lessons = 0, []
+    now = time.time()
+    for text in added:
+        text = " ".join(text.split())
+        if not text: continue
+        dup = next((l for l in lessons if convergence.similarity(l["text"], text) >= DEDUP_SIMILARITY), None)
+        if dup:
+            dup["added"] = now
+            n_dup += 1
+            continue
+        new_lessons.append({"id": store["next_id"], "text": text, "added": now, "source": source})
+        lessons.append(new_lessons[-1])
+        store["next_id"] += 1
+
+    if len(lessons) > MAX_LESSONS:
+        lessons.sort(key=lambda l: l["added"])
+        evicted = lessons[:len(lessons) - MAX_LESSONS]
+        del lessons[:len(lessons) - MAX_LESSONS]
+        lessons.sort(key=lambda l: l["id"])
+        retired |= {l["id"] for l in evicted}
+    # L2 の変化は台帳にも差分で残す（任意の時点の L2 を ledger.state_at で再構成できる）。
+    # 台帳は記録で、検索に使う本体はこれまでどおり JSON 全体を書き直す（件数は MAX_LESSONS で頭打ち）
+    family = os.path.splitext(os.path.basename(path))[0]
+    ledger.append("l2", family, added=[{"id": l["id"], "text": l["text"]} for l in new_lessons], retired=sorted(retired))
+    _save(path, store)
+    return len(new_lessons), n_dup, n_retired
+
+def migrate(path, markdown_path):
+    """旧形式の L2 マークダウン（最大5箇条）しか無ければ、その項目でストアを作る"""
+    if os.path.exists(path) or not os.path.exists(markdown_path): return
+    with open(markdown_path, "r", encoding="utf-8") as f: items = parse_items(f.read())
+    if items: update(path, items, source=os.path.basename(markdown_path))
+
+def export_markdown(path, markdown_path):
+    """人が読む用に、全教訓を新しい順で従来の L2 ファイルへ書き出す"""
+    with locked(path):
+        _export_locked(path, markdown_path)
+
+def _export_locked(path, markdown_path):
+    store, _ = _load(path)
+    lessons = sorted(store["lessons"], key=lambda l: -l["added"])
+    tmp_path = f"{markdown_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f: f.write(render(lessons) + "\n")
+    os.replace(tmp_path, markdown_path)
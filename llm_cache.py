@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス内ロックのみで動作
+    fcntl = None
+
+# ---------------------------------------------------------
+# 1. 応答キャッシュの基盤（内容アドレス方式 + LRU退避）
+#    <CACHE_DIR>/<key[:2]>/<key>.txt : 応答の実体。最終利用時刻はファイルの mtime（ヒット時に os.utime で進める）
+#    <CACHE_DIR>/index.json           : 合計バイト数と累計統計だけ（登録時にのみロック下で書き換える）
+#    参照はロックも索引の書き換えも無しにファイルを開くだけ。退避のための走査は登録で上限を超えたときだけ。
+# ---------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.getenv("LLM_CACHE_DIR") or os.path.join(BASE_DIR, ".llm_cache")
+INDEX_FILE = os.path.join(CACHE_DIR, "index.json")
+LOCK_FILE = os.path.join(CACHE_DIR, "index.lock")
+
+ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# このプロセス内のヒット/ミス数（累計は index.json の "stats" に、登録のたびにまとめて足し込む）
+STATS = {"hits": 0, "misses": 0, "bypass": 0, "evictions": 0}
+_unflushed = {}  # まだ index.json の累計へ足していない分
+
+_local_lock = threading.Lock()
+_stats_lock = threading.Lock()  # 統計の加算だけ（参照が登録のロック待ちにならないように分ける）
+
+def make_key(model, prompt, config=None):
+    """(モデル, プロンプト, 生成設定) のハッシュをキャッシュキーとする"""
+    payload = json.dumps([model, str(prompt), config], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _entry_path(key):
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.txt")
+
+@contextmanager
+def _locked_index():
+    """index.json（合計バイト数と累計統計）をファイルロック下で読み書きする"""
+    with _local_lock:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(LOCK_FILE, "a+") as lock_fd:
+            if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(INDEX_FILE, "r", encoding="utf-8") as f: index = json.load(f)
+                except (OSError, ValueError):
+                    index = None
+                if index is None or "entries" in index:
+                    # 初回と、エントリごとの索引を持っていた旧形式からは、実体を走査して合計を作り直す
+                    stats = (index or {}).get("stats", {})
+                    index = {"total_bytes": sum(size for _, size, _ in _scan()), "stats": stats}
+                with _stats_lock:
+                    for name, n in _unflushed.items(): index["stats"][name] = index["stats"].get(name, 0) + n
+                    _unflushed.clear()
+                yield index
+                tmp_path = f"{INDEX_FILE}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f: json.dump(index, f)
+                os.replace(tmp_path, INDEX_FILE)
+            finally:
+                if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+def _count(name):
+    with _stats_lock:
+        STATS[name] += 1
+        _unflushed[name] = _unflushed.get(name, 0) + 1
+
+def _scan():
+    """全エントリの (最終利用時刻, サイズ, パス)。退避と索引の作り直しのときだけ使う"""
+    entries = []
+    for sub in os.scandir(CACHE_DIR) if os.path.isdir(CACHE_DIR) else ():
+        if not sub.is_dir(): continue
+        for entry in os.scandir(sub.path):
+            if not entry.name.endswith(".txt"): continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    return entries
+
+# ---------------------------------------------------------
+# 2. 参照と登録
+# ---------------------------------------------------------
+def _touch(path):
+    """ヒットしたエントリの最終利用時刻を進める（LRU の順位はファイルの mtime で持つ）"""
+    try: os.utime(path)
+    except OSError: pass
+
+def get(key):
+    """ヒットすれば応答テキストを返し、ミスなら None"""
+    if not ENABLED: return None
+    path = _entry_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f: text = f.read()
+    except OSError:  # 未登録か、他プロセスが退避した
+        _count("misses")
+        return None
+    _touch(path)
+    _count("hits")
+    return text
+
+def copy_to(key, dest_path):
+    """ヒットすれば応答を文字列に載せずに dest_path へ複製して True を返す"""
+    if not ENABLED: return False
+    path = _entry_path(key)
+    try:
+        shutil.copyfile(path, dest_path)
+    except OSError:
+        _count("misses")
+        return False
+    _touch(path)
+    _count("hits")
+    return True
+
+def _register(key, size, old_size):
+    """保存済みエントリを合計に足し、容量上限を超えたときだけ全体を走査して最も古く使われたものから捨てる"""
+    with _locked_index() as index:
+        index["total_bytes"] += size - old_size
+        if index["total_bytes"] <= MAX_BYTES: return
+        keep = _entry_path(key)
+        entries = sorted(_scan())
+        total = sum(size for _, size, _ in entries)  # 走査のついでに、ずれた合計を正す
+        for _, old, path in entries:
+            if total <= MAX_BYTES: break
+            if path == keep: continue
+            try: os.remove(path)
+            except OSError: continue
+            total -= old
+            with _stats_lock: STATS["evictions"] += 1
+            index["stats"]["evictions"] = index["stats"].get("evictions", 0) + 1
+        index["total_bytes"] = total
+
+def _old_size(path):
+    try: return os.path.getsize(path)
+    except OSError: return 0
+
+def put(key, text):
+    """応答を保存する"""
+    if not ENABLED or not text: return
+    data = text.encode("utf-8")
+    if len(data) > MAX_BYTES: return
+    path = _entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    old_size = _old_size(path)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f: f.write(data)
+    os.replace(tmp_path, path)
+    _register(key, len(data), old_size)
+
+def put_file(key, src_path):
+    """ストリーミングで書き出し済みのファイルをそのまま保存する"""
+    if not ENABLED: return
+    size = os.path.getsize(src_path)
+    if not size or size > MAX_BYTES: return
+    path = _entry_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    old_size = _old_size(path)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, path)
+    _register(key, size, old_size)
+
+def note_bypass():
+    """キャッシュを意図的に迂回した呼び出しを数える（非決定性が必要なステージ用）"""
+    with _stats_lock: STATS["bypass"] += 1
+
+def stats():
+    """このプロセスの統計と、ディスク上の累計統計を返す（エントリ数の数え上げに走査する）"""
+    with _locked_index() as index:
+        return {"process": dict(STATS), "total": dict(index["stats"]),
+                "entries": len(_scan()), "bytes": index["total_bytes"]}
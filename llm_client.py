@@ -0,0 +1,296 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+# ---------------------------------------------------------
+# 1. 共有LLMクライアントの基盤（全ファクトリ・全エンジン共通）
+#    - SDK の import とクライアント生成は最初の呼び出しまで遅らせる
+#    - HTTP接続は keep-alive で使い回し、同時接続数に上限を設ける
+#    - 複数のAPIキー（プロジェクト）をラウンドロビンで使い、429 を受けたキーは休ませて次へ回す
+#    - 期限付きの呼び出しと、遅い応答への保険の2本目（ヘッジ）
+# ---------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 各モジュールの設定値（LLM_RPM など）が .env から読まれるよう、最初に import されること
+load_dotenv(os.path.join(BASE_DIR, ".env"))
+import rate_limiter  # noqa: E402  (.env の読み込み後に設定値を読ませる)
+import deadline  # noqa: E402
+
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+KEEPALIVE_SEC = float(os.getenv("LLM_KEEPALIVE_SEC", "60"))
+KEY_COOLDOWN_SEC = float(os.getenv("LLM_KEY_COOLDOWN_SEC", "60"))  # Retry-After が無い 429 の休止秒数
+HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))    # この分位の遅延を過ぎたら2本目を送る
+HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))  # 遅延の分布がこれだけ溜まるまではヘッジしない
+HEDGE_MAX_RATIO = float(os.getenv("LLM_HEDGE_MAX_RATIO", "0.1"))   # 呼び出し数に対するヘッジ送信の上限割合
+
+def api_keys():
+    """GEMINI_API_KEYS="key1,key2" を優先し、無ければ GEMINI_API_KEY の1本だけを使う"""
+    keys = [k.strip() for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip()]
+    return keys or [os.getenv("GEMINI_API_KEY")]
+
+_lock = threading.Lock()
+_slots = None
+_next = 0
+_latencies = {}  # model -> 直近の応答時間（秒）
+_counts = {"calls": 0, "hedges": 0, "hedge_wins": 0, "timeouts": 0}
+
+def _http_options():
+    """接続プールの上限と keep-alive を httpx に渡す（対応していない SDK なら既定のまま）"""
+    try:
+        import httpx
+        from google.genai import types
+        limits = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS,
+                              keepalive_expiry=KEEPALIVE_SEC)
+        return types.HttpOptions(client_args={"limits": limits})
+    except (ImportError, AttributeError, TypeError, ValueError):
+        return None
+
+def _get_slots():
+    global _slots
+    with _lock:
+        if _slots is None:
+            _slots = [{"key": key, "client": None, "cooldown_until": 0.0, "calls": 0, "failovers": 0}
+                      for key in api_keys()]
+        return _slots
+
+def _client(slot):
+    with _lock:
+        if slot["client"] is None:
+            from google import genai
+            http_options = _http_options()
+            if http_options is None:
+                slot["client"] = genai.Client(api_key=slot["key"])
+            else:
+                slot["client"] = genai.Client(api_key=slot["key"], http_options=http_options)
+        return slot["client"]
+
+def _pick(tried):
+    """休止中でないキーを順番に選ぶ。全キーが休止中（または試行済み）なら None"""
+    global _next
+    slots = _get_slots()
+    now = time.time()
+    with _lock:
+        for i in range(len(slots)):
+            slot = slots[(_next + i) % len(slots)]
+            if id(slot) in tried or slot["cooldown_until"] > now: continue
+            _next = (_next + i + 1) % len(slots)
+            slot["calls"] += 1
+            return slot
+    return None
+
+def _cool_down(slot, error):
+    delay = rate_limiter.retry_after(error)
+    with _lock:
+        slot["cooldown_until"] = time.time() + (KEY_COOLDOWN_SEC if delay is None else delay)
+        slot["failovers"] += 1
+
+def _with_failover(fn):
+    """429 を受けたら別のキーで即座にやり直す。全キーが使えなければ最後の例外をそのまま上げる"""
+    tried, last_error = set(), None
+    while True:
+        slot = _pick(tried)
+        if slot is None:
+            if last_error is not None: raise last_error
+            # 全キーが休止中: 最も早く復帰するキーで送り、429 なら呼び出し側のバックオフに任せる
+            slot = min(_get_slots(), key=lambda s: s["cooldown_until"])
+            with _lock: slot["calls"] += 1
+        tried.add(id(slot))
+        try:
+            return fn(_client(slot))
+        except Exception as e:
+            if not rate_limiter.is_rate_limited(e): raise
+            _cool_down(slot, e)
+            if len(tried) >= len(_get_slots()): raise
+            last_error = e
+
+# ---------------------------------------------------------
+# 2. 期限とヘッジ
+#    SDK の同期呼び出しは外から止められないので、別スレッドで送って期限まで待つ。
+#    見捨てた呼び出しは HTTP のタイムアウトで接続ごと閉じられ、結果は捨てる。
+#    ヘッジせず期限も既定のままなら（deadline.watched）、スレッドを作らず HTTP のタイムアウトだけで打ち切る。
+#    ただし HTTP に期限を渡せない設定のときは見張る側に回す。
+# ---------------------------------------------------------
+def _with_timeout(config, timeout, slack=5):
+    """
+    HTTP 側にも同じ期限（見張る場合は少し長め）を渡し、見捨てた呼び出しが接続を握り続けないようにする。
+    戻り値は (config, 期限を渡せたか)。dict でも model_copy を持つ型付きの設定でもなければ渡せない
+    """
+    if timeout is None: return config, True
+    millis = int((timeout + slack) * 1000)
+    if config is None or isinstance(config, dict):
+        current = (config or {}).get("http_options")
+        if current is not None and not isinstance(current, dict):
+            if not hasattr(current, "model_copy"): return config, False
+            return {**config, "http_options": current.model_copy(update={"timeout": millis})}, True
+        return {**(config or {}), "http_options": {**(current or {}), "timeout": millis}}, True
+    if not hasattr(config, "model_copy"): return config, False
+    try:
+        from google.genai import types
+        current = getattr(config, "http_options", None)
+        if current is None: http_options = types.HttpOptions(timeout=millis)
+        elif isinstance(current, dict): http_options = types.HttpOptions(**{**current, "timeout": millis})
+        else: http_options = current.model_copy(update={"timeout": millis})
+        return config.model_copy(update={"http_options": http_options}), True
+    except (ImportError, AttributeError, TypeError, ValueError):
+        return config, False
+
+def _direct(model, call, timeout):
+    """呼び出し元のスレッドで送る。HTTP のタイムアウトで打ち切られたら DeadlineExceeded に揃える"""
+    started = time.monotonic()
+    try:
+        return call()
+    except Exception as e:
+        if timeout is None or rate_limiter.is_rate_limited(e) or time.monotonic() - started < timeout: raise
+        with _lock: _counts["timeouts"] += 1
+        raise deadline.DeadlineExceeded(f"{model}: no response within {timeout:.1f}s") from e
+
+def _spawn(fn):
+    """fn をデーモンスレッドで実行する Future（止まった呼び出しがプロセス終了を妨げない）"""
+    future = Future()
+    def run():
+        if not future.set_running_or_notify_cancel(): return
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, name="llm-call", daemon=True).start()
+    return future
+
+def _record_latency(model, seconds):
+    with _lock: _latencies.setdefault(model, deque(maxlen=200)).append(seconds)
+
+def hedge_delay(model):
+    """直近の応答時間の分位点（標本が足りなければ None = ヘッジしない）"""
+    with _lock: samples = sorted(_latencies.get(model, ()))
+    if len(samples) < HEDGE_MIN_SAMPLES: return None
+    return samples[int(HEDGE_QUANTILE * (len(samples) - 1))]
+
+def _may_hedge(model, contents):
+    """ヘッジ送信は上限割合の内側で、レート制限の枠が待たずに取れるときだけ"""
+    with _lock:
+        if _counts["hedges"] + 1 > HEDGE_MAX_RATIO * _counts["calls"]: return False
+    if not rate_limiter.try_acquire(model, rate_limiter.estimate_tokens(contents)): return False
+    with _lock: _counts["hedges"] += 1
+    return True
+
+def _race(model, contents, call, timeout, hedge):
+    """call を送り、必要ならヘッジの2本目も送って、先に成功した方を返す。期限を過ぎたら DeadlineExceeded"""
+    started = time.monotonic()
+    deadline_at = started + timeout if timeout is not None else None
+    delay = hedge_delay(model) if hedge else None
+    hedge_at = started + delay if delay is not None else None
+    primary = _spawn(call)
+    pending, error = {primary}, None
+    while pending:
+        waits = [t - time.monotonic() for t in (deadline_at, hedge_at) if t is not None]
+        done, pending = wait(pending, timeout=max(0.0, min(waits)) if waits else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is not primary:
+                    with _lock: _counts["hedge_wins"] += 1
+                for other in pending: other.cancel()
+                return future.result()
+            error = error or future.exception()
+        if not pending: break
+        now = time.monotonic()
+        if deadline_at is not None and now >= deadline_at:
+            with _lock: _counts["timeouts"] += 1
+            raise deadline.DeadlineExceeded(f"{model}: no response within {timeout:.1f}s")
+        if hedge_at is not None and now >= hedge_at:
+            hedge_at = None
+            if _may_hedge(model, contents):
+                print(f"  🪁 {model}: {delay:.1f}s を超えたため2本目を送ります。")
+                pending.add(_spawn(call))
+    raise error
+
+# ---------------------------------------------------------
+# 3. 呼び出し口
+# ---------------------------------------------------------
+def generate(model, contents, config=None, timeout=None, hedge=False):
+    """
+    client.models.generate_content と同じ応答を返す。
+    timeout: 秒。過ぎたら DeadlineExceeded / hedge: 応答が遅ければ p95 を過ぎた時点で2本目を送る
+    """
+    direct = not hedge and (timeout is None or not deadline.watched())
+    config, bounded = _with_timeout(config, timeout, 0 if direct else 5)
+    # HTTP に期限を渡せない設定は、見張りスレッドで打ち切る
+    direct = direct and (bounded or timeout is None)
+    def call():
+        started = time.monotonic()
+        res = _with_failover(lambda c: c.models.generate_content(model=model, contents=contents, config=config))
+        _record_latency(model, time.monotonic() - started)
+        return res
+    with _lock: _counts["calls"] += 1
+    if direct: return _direct(model, call, timeout)
+    return _race(model, contents, call, timeout, hedge)
+
+def generate_stream(model, contents, config=None, timeout=None):
+    """
+    client.models.generate_content_stream と同じチャンクを返す。フェイルオーバーは最初のチャンクまで。
+    timeout は最初のチャンクまでの期限（以降は HTTP のタイムアウトで打ち切る）。ストリームはヘッジしない
+    """
+    direct = timeout is None or not deadline.watched()
+    config, bounded = _with_timeout(config, timeout, 0 if direct else 5)
+    direct = direct and (bounded or timeout is None)
+    def start(c):
+        chunks = iter(c.models.generate_content_stream(model=model, contents=contents, config=config))
+        return chunks, next(chunks, None)
+    with _lock: _counts["calls"] += 1
+    if direct: chunks, first = _direct(model, lambda: _with_failover(start), timeout)
+    else: chunks, first = _race(model, contents, lambda: _with_failover(start), timeout, False)
+    if first is None: return
+    yield first
+    yield from chunks
+
+def stats():
+    """キーごとの呼び出し数と 429 によるフェイルオーバー数（キー自体は伏せる）"""
+    return [{"key": f"#{i}", "calls": s["calls"], "failovers": s["failovers"]} for i, s in enumerate(_get_slots())]
+
+def latency_stats():
+    """呼び出し数・ヘッジ送信数・ヘッジが先着した数・期限切れ数と、モデルごとのヘッジ開始遅延"""
+    with _lock: result = dict(_counts)
+    result["hedge_delay_s"] = {m: round(d, 3) for m in list(_latencies) if (d := hedge_delay(m)) is not None}
+    return result
+
+# ---------------------------------------------------------
+# 4. 再送（全ファクトリ・全エンジンの呼び出し口が共有する）
+#    期限切れ: 手元でジッター付きの短い休止を挟んで再送（共有のレート制限状態は触らない）
+#    429: Retry-After 優先の指数バックオフ（rate_limiter 経由で全プロセスに共有）
+#    それ以外: そのまま上げる（呼び出し側が on_error で再送を選んだものを除く）
+# ---------------------------------------------------------
+def with_retries(role, meter, send, on_error=None, attempts=3, name=None):
+    """
+    send(model, timeout, hedge) を最大 attempts 回呼び、最初に返った値を返す。
+    model は meter.model（呼び出し側が昇格で差し替えられる）、timeout と hedge は role の期限設定から決める。
+    on_error(e, attempt) が True を返した例外は待たずに再送する。最後まで期限切れなら
+    deadline.retries_exhausted（予算切れなら BudgetExceeded）、それ以外の使い切りは RuntimeError
+    """
+    name = name or role
+    last_error = None
+    for attempt in range(attempts):
+        meter.attempts += 1
+        try:
+            return send(meter.model, deadline.timeout_for(role), deadline.hedged(role))
+        except Exception as e:
+            last_error = e
+            if on_error is not None and on_error(e, attempt): continue
+            if deadline.is_timeout(e):
+                # 最後の試行の後は待たない
+                sleep_time = deadline.retry_pause(attempt) if attempt < attempts - 1 else 0.0
+                meter.sleep_s += sleep_time
+                print(f"  ⏱️ 応答なし({attempt+1}/{attempts}): {sleep_time:.1f}秒待機しました。({e})")
+            elif rate_limiter.is_rate_limited(e):
+                sleep_time = rate_limiter.backoff(meter.model, e, attempt)
+                meter.sleep_s += sleep_time
+                print(f"  ⚠️ 制限到達({attempt+1}/{attempts}): {sleep_time:.1f}秒待機しました。")
+            else:
+                meter.fail(e)
+                raise
+    if deadline.is_timeout(last_error):
+        meter.fail(last_error)
+        raise deadline.retries_exhausted(name, attempts) from last_error
+    note = "429" if rate_limiter.is_rate_limited(last_error) else type(last_error).__name__
+    meter.fail(f"retries exhausted ({note})")
+    raise RuntimeError(f"{name}: no usable response after {attempts} attempts ({note}).") from last_error
@@ -0,0 +1,71 @@
+import os
+import re
+import fnmatch
+import llm_client  # noqa: F401  (.env を先に読み込む)
+import telemetry
+import ledger
+
+# ---------------------------------------------------------
+# ロール別のモデル振り分け（安い段から始め、出力が怪しいときだけ強い段へ昇格する）
+#   段: fast < standard < strong。各段のモデルは未設定なら GEMINI_MODEL（= 振り分けなしと同じ動作）
+#   LLM_ROUTES="Reviewer=fast,step*_02_*=strong" のようにロール名（fnmatch）→ 段を指定する。先に書いたものが優先。
+# ---------------------------------------------------------
+TIERS = ["fast", "standard", "strong"]
+DEFAULT_MODEL = os.getenv("GEMINI_MODEL")
+TIER_MODELS = {tier: os.getenv(f"LLM_MODEL_{tier.upper()}") or DEFAULT_MODEL for tier in TIERS}
+
+# 判定の1行目だけが大事なロールや、死角1つを探すだけのロールは安い段で足りる
+_DEFAULT_ROUTES = ("Reviewer=fast,StressTester=fast,Architect=strong,Librarian=standard,Philosopher=standard,"
+                   "librarian=standard,*=standard")
+# 安い段が出したら強い段で確かめ直す判定（ロール=STATUS|STATUS）。ABORT は探求そのものを打ち切るので二重確認する
+_DEFAULT_DOUBLE_CHECK = "Reviewer=ABORT"
+_STATUS_RE = re.compile(r"\[STATUS:\s*([A-Z]+)\s*\]")
+STATUS_ROLES = {"Reviewer": {"DONE", "CONTINUE", "ABORT"}}  # 1行目に有効な判定行を必ず書くロール
+
+def _parse_rules(spec):
+    rules = []
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        pattern, _, value = item.partition("=")
+        rules.append((pattern.strip(), value.strip()))
+    return rules
+
+ROUTES = [(p, t) for p, t in _parse_rules(os.getenv("LLM_ROUTES", "") + "," + _DEFAULT_ROUTES) if t in TIERS]
+DOUBLE_CHECK = {p: set(v.upper().split("|")) for p, v in _parse_rules(os.getenv("LLM_DOUBLE_CHECK", _DEFAULT_DOUBLE_CHECK))}
+
+def route(role):
+    """ロールの開始段（最初に一致した規則）"""
+    return next((tier for pattern, tier in ROUTES if fnmatch.fnmatchcase(role, pattern)), "standard")
+
+def model_for(role):
+    return TIER_MODELS[route(role)]
+
+def _tier_of(model):
+    """そのモデルが受け持つ最も強い段の位置"""
+    return max((i for i, tier in enumerate(TIERS) if TIER_MODELS[tier] == model), default=len(TIERS) - 1)
+
+# ---------------------------------------------------------
+# 昇格の判断と記録
+# ---------------------------------------------------------
+def check(role, text, double_check=True):
+    """
+    ロールの方針に照らして、強い段でやり直すべき出力なら理由を返す（問題なければ None）。
+    二重確認は開始段の答えに1回だけ: 昇格して得た答えは double_check=False で書式だけを見て、判定は確定とする
+    """
+    statuses = next((s for pattern, s in STATUS_ROLES.items() if fnmatch.fnmatchcase(role, pattern)), None)
+    if statuses is None: return None
+    first_line = text.strip().splitlines()[0] if text.strip() else ""
+    m = _STATUS_RE.search(first_line)
+    if not m or m.group(1) not in statuses: return f"判定行が不正: {first_line[:40]!r}"
+    if not double_check: return None
+    confirm = next((s for pattern, s in DOUBLE_CHECK.items() if fnmatch.fnmatchcase(role, pattern)), set())
+    if m.group(1) in confirm: return f"{m.group(1)} 判定の二重確認"
+    return None
+
+def escalate(role, model, reason):
+    """model より強い段のモデルを返す（無ければ None）。昇格は必ず表示・計測・台帳に残す"""
+    stronger = next((TIER_MODELS[t] for t in TIERS[_tier_of(model) + 1:] if TIER_MODELS[t] != model), None)
+    if stronger is None: return None
+    print(f"  ⤴️ [ROUTER] {role}: {model} → {stronger} ({reason})")
+    telemetry.escalation(role, model, stronger, reason)
+    ledger.append("escalation", role, wait=False, model=model, to=stronger, reason=reason)
+    return stronger
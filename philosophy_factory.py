@@ -1,104 +1,186 @@
 import time
 import os
+import sys
 import re
-from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from google import genai
-from dotenv import load_dotenv
+import llm_client
+import rate_limiter
+import llm_cache
+import telemetry
+import model_router
+import deadline
+import checkpoint
+import artifact_store
+import ledger
+import archive
+import jobqueue
+import convergence
+import lesson_store
+from concurrent.futures import ThreadPoolExecutor
+from watcher import OrderWatcher
 
 # ---------------------------------------------------------
 # 1. 概念錬成の基盤
 # ---------------------------------------------------------
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-load_dotenv(os.path.join(BASE_DIR, ".env"))
 
 DIRS = {k: os.path.join(BASE_DIR, k) for k in ["order", "original", "workspace", "reviews"]}
 for d in DIRS.values(): os.makedirs(d, exist_ok=True)
 
-L1_MEMORY_FILE = os.path.join(DIRS["workspace"], "short_term_debate.txt")
-L2_MEMORY_FILE = os.path.join(DIRS["workspace"], "core_philosophy.md")
+L1_MEMORY_TEMPLATE = os.path.join(DIRS["workspace"], "short_term_debate_{}.txt")  # テーマごとの短期記憶
+L2_MEMORY_FILE = os.path.join(DIRS["workspace"], "core_philosophy.md")  # 閲覧用（全教訓を新しい順に書き出す）
+L2_STORE = os.path.join(DIRS["workspace"], "lessons_philosophy.json")     # 本体（教訓ごとに索引付けして保存）
+MANIFEST_DIR = os.path.join(DIRS["workspace"], "manifests")  # ターゲットごとの世代台帳（最新版を O(1) で引く）
+
+MAX_WORKERS = int(os.getenv("FACTORY_WORKERS", "4"))  # このプロセスで同時に探求するoriginalの数（全体の上限は JOB_MAX_RUNNING）
+QUEUE_NAME = "philosophy"
+
+def l1_memory_path(raw_name):
+    return L1_MEMORY_TEMPLATE.format(raw_name)
+
+def save_l1(raw_name, text):
+    """短期記憶はファイルを丸ごと書き換えず、台帳へ追記する（台帳を切っている場合のみ従来のファイル）"""
+    jobqueue.ensure_lease()
+    if ledger.ENABLED: ledger.append("l1", f"philosophy/{raw_name}", text=text)
+    else:
+        with open(l1_memory_path(raw_name), "w", encoding="utf-8") as f: f.write(text)
+
+def save_review(raw_name, name, text):
+    """レビューはアーカイブにだけ入れ、再開用の参照を返す（アーカイブが無効なときだけ reviews/ のファイルに書く）"""
+    jobqueue.ensure_lease()
+    return archive.keep(raw_name, name, text, DIRS["reviews"])
+
+def load_l1(raw_name, default=""):
+    text = ledger.latest("l1", f"philosophy/{raw_name}", {}).get("text")
+    # 台帳に無ければ、台帳導入前の短期記憶ファイルから引き継ぐ
+    return text if text is not None else read_text(l1_memory_path(raw_name), default)
 
 # ---------------------------------------------------------
 # 2. 思考エンジン
 # ---------------------------------------------------------
-GEMINI_MODEL = os.getenv("GEMINI_MODEL")
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
-
-def call_ai(prompt, role):
-    for attempt in range(3):
-        try:
-            res = client.models.generate_content(model=GEMINI_MODEL, contents=prompt)
-            if res.text: return res.text
-            raise ValueError("Empty response.")
-        except Exception as e:
-            if "429" in str(e) or "RESOURCE_EXHAUSTED" in str(e):
-                print(f"  ⚠️ 思考過熱({attempt+1}/3): 30秒冷却...")
-                time.sleep(30)
-            else: raise e
-    raise RuntimeError(f"{role} failed.")
+def call_ai(prompt, role, use_cache=True):
+    """ロールの段のモデルで生成し、方針に合わない出力（判定行の不正・要確認の判定）は強い段でやり直す"""
+    model = start = model_router.model_for(role)
+    while True:
+        text = _generate(prompt, role, model, use_cache)
+        # 要確認の判定は開始段の答えだけを確かめ直し、昇格先の判定はそのまま受け入れる
+        reason = model_router.check(role, text, double_check=model == start)
+        stronger = model_router.escalate(role, model, reason) if reason else None
+        if stronger is None: return text
+        model = stronger
+
+def _generate(prompt, role, model, use_cache=True):
+    est_tokens = rate_limiter.estimate_tokens(prompt)
+    meter = telemetry.CallMeter(role, model, est_tokens)
+    cache_key = llm_cache.make_key(model, prompt)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            meter.done(response_text=cached, cached=True)
+            return cached
+    else: llm_cache.note_bypass()
+
+    def send(model, timeout, hedge):
+        meter.sleep_s += rate_limiter.acquire(model, est_tokens)
+        res = llm_client.generate(model, prompt, timeout=timeout, hedge=hedge)
+        rate_limiter.settle(model, est_tokens, rate_limiter.usage_tokens(res))
+        if not res.text: raise ValueError("Empty response.")
+        return res
+    res = llm_client.with_retries(role, meter, send)
+    if use_cache: llm_cache.put(cache_key, res.text)
+    meter.done(res, res.text)
+    return res.text
 
 def get_latest_v(raw_name):
-    files = [f for f in os.listdir(DIRS["workspace"]) if f.startswith(raw_name)]
-    versions = [int(m.group(1)) for f in files if (m := re.search(r"_v(\d+)\.", f))]
-    return max(versions) if versions else 0
+    # workspace 全体を走査せず、ターゲットごとのマニフェストから引く（初回のみ既存ファイルから作る）
+    return artifact_store.latest(MANIFEST_DIR, raw_name, DIRS["workspace"], raw_name)
 
 # ---------------------------------------------------------
 # 3. 哲人（Librarian） - 普遍的真理の抽出
 # ---------------------------------------------------------
 def run_philosopher(raw_name, final_review):
-    print(f"\n🧠 [PHILOSOPHER ACTIVE] 議論が収束しました。思想の結晶化（L2キャッシュ更新）を開始します。")
-    current_l2 = open(L2_MEMORY_FILE, "r", encoding="utf-8").read() if os.path.exists(L2_MEMORY_FILE) else "まだ哲学はない。"
+    # 読み込み→統合→書き戻しの間に他の探求（別のワーカープロセスも含む）が割り込まないよう、L2全体をロックする
+    with lesson_store.locked(L2_STORE):
+        _run_philosopher_locked(raw_name, final_review)
+
+def _run_philosopher_locked(raw_name, final_review):
+    print(f"\n🧠 [PHILOSOPHER ACTIVE] 議論が収束しました({raw_name})。思想の結晶化（L2キャッシュ更新）を開始します。")
+    related = lesson_store.search(L2_STORE, f"{raw_name}\n{final_review}")
 
     lib_prompt = f"""Role: 真理の探究者 (Philosopher).
 あなたは、今回の激しい議論と試行錯誤から「普遍的な真理や設計思想」を抽出し、長期記憶として定着させる役割を持つ。
 
-【現在のコア哲学 (L2 Cache)】
-{current_l2}
+【関連する既存のコア哲学 (L2 Cache より抜粋)】
+{lesson_store.render(related, "まだ哲学はない。")}
 
 【今回の議論の結論 (Review)】
 {final_review}
 
 【指令】
-上記を統合し、「今後、どのような設計や思想を考える上でも絶対に守るべき黄金律」を【最大5箇条のマークダウンリスト】で出力せよ。
-枝葉末節のテクニックは捨て、本質（なぜ失敗するのか、どうあるべきか）のみを残すこと。"""
+今回の結論から得られた「今後、どのような設計や思想を考える上でも絶対に守るべき黄金律」を【最大5箇条のマークダウンリスト】で出力せよ。
+枝葉末節のテクニックは捨て、本質（なぜ失敗するのか、どうあるべきか）のみを残すこと。既存の哲学と同じ内容は繰り返さないこと。
+上の既存の哲学のうち、今回の結論により覆ったものがあれば、最終行に `RETIRE: L番号, L番号` の形式で挙げよ。"""
     
     new_l2 = call_ai(lib_prompt, "Philosopher")
-    with open(L2_MEMORY_FILE, "w", encoding="utf-8") as f: f.write(new_l2)
-    print("  ✔️ コア哲学 (core_philosophy.md) を昇華しました。")
+
+    retire = re.search(r"^RETIRE:\s*(.+)$", new_l2, re.MULTILINE)
+    retired = re.findall(r"L(\d+)", retire.group(1)) if retire else []
+    jobqueue.ensure_lease()
+    added, dup, removed = lesson_store.update(L2_STORE, lesson_store.parse_items(new_l2), retired, source=raw_name)
+    lesson_store.export_markdown(L2_STORE, L2_MEMORY_FILE)
+    print(f"  ✔️ コア哲学を昇華しました: 追加 {added} / 重複 {dup} / 退役 {removed}")
 
 # ---------------------------------------------------------
 # 4. 概念錬成エンジン（Ideation Workflow）
+#    Architect → Stress Test → Auditor → 判定 を状態機械として回し、
+#    フェーズ完了ごとにチェックポイントを書く。落ちたプロセスは同じフェーズから再開する。
 # ---------------------------------------------------------
-def run_ideation(target_file, is_new_order=False, loop_count=1):
-    MAX_LOOP = 5
-    base = os.path.basename(target_file)
-    raw = base.split('_v')[0]
-    ext = os.path.splitext(base)[1]
+MAX_LOOP = 5
+CHECKPOINT_DIR = os.path.join(DIRS["workspace"], "checkpoints")
 
-    order_path = os.path.join(DIRS["order"], "order.txt")
-    order = open(order_path, "r", encoding="utf-8").read().strip() if os.path.exists(order_path) else "現状維持"
-    
-    if is_new_order and loop_count == 1:
-        l1_memory = "【新たな探求の開始】"
-        with open(L1_MEMORY_FILE, "w", encoding="utf-8") as f: f.write(l1_memory)
-    else:
-        l1_memory = open(L1_MEMORY_FILE, "r", encoding="utf-8").read() if os.path.exists(L1_MEMORY_FILE) else ""
+# Red Team の並列化: 視点の異なる K 本の Stress Test を同時に走らせ、死角を手元で統合・順位付けして Auditor へ渡す
+# （1 なら従来どおり1本で死角を1つだけ探す）
+STRESS_FANOUT = max(1, int(os.getenv("STRESS_FANOUT", "1")))
+STRESS_MAX_FINDINGS = int(os.getenv("STRESS_MAX_FINDINGS", "5"))          # Auditor へ渡す死角の上限
+STRESS_DEDUP_SIMILARITY = float(os.getenv("STRESS_DEDUP_SIMILARITY", "0.5"))  # これ以上似た死角は同じものとみなす
+STRESS_LENSES = [
+    ("現実の残酷さ", "資源・時間・権力の制約や、善意が報われない現実"),
+    ("極端なエッジケース", "想定外の入力・境界条件・規模の極端な状況"),
+    ("人間の心理的バイアス", "認知バイアス・自己欺瞞・集団心理"),
+    ("悪用とインセンティブ", "悪意ある参加者・抜け道・歪んだ動機付け"),
+    ("時間と規模", "長期的な劣化・二次的影響・規模が変わったときの破綻"),
+    ("反証可能性", "検証できない前提・循環論法・後付けの説明"),
+]
+_SEVERITY_RE = re.compile(r"致命度\s*[:：]\s*([1-5])")
+
+def read_text(path, default=""):
+    return open(path, "r", encoding="utf-8").read() if path and os.path.exists(path) else default
+
+def _mark_converged(ctx, reason):
+    """収束した世代はレビューの代わりに理由を記録し、判定フェーズへ直行する"""
+    review = f"[STATUS: CONVERGED]\n{reason}"
+    ctx["review_ref"] = save_review(ctx["raw"], f"{ctx['raw']}_v{ctx['version']}_rev.txt", review)
+    ctx["hashes"]["review"] = checkpoint.content_hash(review)
+    print(f"  🧊 収束を検知: {reason}")
+    return "DECIDE"
 
-    l2_memory = open(L2_MEMORY_FILE, "r", encoding="utf-8").read() if os.path.exists(L2_MEMORY_FILE) else "哲学なし"
-    prev_concept = open(target_file, "r", encoding="utf-8").read() if os.path.exists(target_file) else ""
+def _phase_architect(ctx, order):
+    raw, ext = ctx["raw"], ctx["ext"]
+    prev_concept = read_text(ctx["target_file"])
+    # コア哲学は全件ではなく、テーマ・直近の議論・現在の概念に関係する上位の教訓だけを渡す
+    l2_memory = lesson_store.render(lesson_store.search(L2_STORE, f"{order}\n{ctx['l1']}\n{prev_concept}"), "哲学なし")
 
-    next_v = get_latest_v(raw) + (1 if is_new_order else 0)
+    next_v = get_latest_v(raw) + (1 if ctx["is_new_order"] else 0)
     if next_v == 0: next_v = 1
     save_path = os.path.join(DIRS["workspace"], f"{raw}_v{next_v}{ext}")
 
-    print(f"\n[🌀 CONCEPT EVOLUTION v{next_v}] (Loop: {loop_count}/{MAX_LOOP})")
+    print(f"\n[🌀 CONCEPT EVOLUTION {raw} v{next_v}] (Loop: {ctx['loop']}/{MAX_LOOP})")
 
     # --- PHASE 1: Architect (概念の拡張と再構築) ---
     arch_prompt = f"""Role: 概念構築者 (Concept Architect).
 あなたは与えられた思想・設計・戦略を、より高次元の「完成された形」へと昇華させる天才だ。
 
 【探求のテーマ/指令】: {order}
-【短期記憶 (直近の議論・反省)】: {l1_memory}
+【短期記憶 (直近の議論・反省)】: {ctx['l1']}
 【コア哲学 (絶対の判断基準)】: {l2_memory}
 【現在の概念/設計 (これを叩き直せ)】:
 {prev_concept}
@@ -106,16 +188,95 @@ def run_ideation(target_file, is_new_order=False, loop_count=1):
 記憶と哲学に従い、矛盾を排除し、より強固で洗練された【設計・思想の全文】を出力せよ。説明不要。"""
     
     new_concept = call_ai(arch_prompt, "Architect")
+    jobqueue.ensure_lease()  # 生成中に貸出を失っていたら、回収した側と同じ世代を書かない
     with open(save_path, "w", encoding="utf-8") as f: f.write(new_concept)
-    
+    artifact_store.record(MANIFEST_DIR, raw, next_v, save_path)
+
+    ctx.update(version=next_v, save_path=save_path)
+    ctx["hashes"] = {"prev": checkpoint.content_hash(prev_concept), "new": checkpoint.content_hash(new_concept)}
+
+    # 概念がほぼ変わっていなければ、耐衝撃テストも監査もスリープも不要
+    reason = convergence.check(prev_concept, new_concept, ext)
+    # 連続して収束した回数（1回なら監査だけを省いて続け、2回続いたら終える）
+    ctx["converged"] = ctx.get("converged", 0) + 1 if reason else 0
+    if reason: return _mark_converged(ctx, reason)
+    return "STRESS_TEST"
+
+def _phase_stress_test(ctx, order):
+    new_concept = read_text(ctx["save_path"])
+
     # --- PHASE 2: Stress Tester (悪魔の代弁者による極限シミュレーション) ---
-    print(f"  🌪️ Stress Test: 概念の耐衝撃テストを実行中...")
-    stress_prompt = f"""Role: 悪魔の代弁者 (Red Teamer).
+    if STRESS_FANOUT > 1:
+        stress_test_result = _fanout_stress_test(new_concept)
+    else:
+        print(f"  🌪️ Stress Test: 概念の耐衝撃テストを実行中...")
+        stress_prompt = f"""Role: 悪魔の代弁者 (Red Teamer).
 以下の設計・思想に対し、「現実の残酷さ」「極端なエッジケース」「人間の心理的バイアス」をぶつけ、論理が崩壊する【死角】を1つだけ見つけ出せ。
 対象概念:
 {new_concept}"""
-    stress_test_result = call_ai(stress_prompt, "StressTester")
-    print(f"  ⚠️ 発見された死角: {stress_test_result.splitlines()[0][:50]}...")
+        # 同じ概念に対しても毎回新しい死角を探させるため、キャッシュを迂回する
+        stress_test_result = call_ai(stress_prompt, "StressTester", use_cache=False)
+        print(f"  ⚠️ 発見された死角: {stress_test_result.splitlines()[0][:50]}...")
+
+    # 再開時にこの呼び出しをやり直さないよう、死角も成果物として残す
+    ctx["stress_ref"] = save_review(ctx["raw"], f"{ctx['raw']}_v{ctx['version']}_stress.txt", stress_test_result)
+    ctx["hashes"]["stress"] = checkpoint.content_hash(stress_test_result)
+    return "REVIEW"
+
+def _stress_lens(new_concept, lens):
+    name, focus = lens
+    prompt = f"""Role: 悪魔の代弁者 (Red Teamer).
+以下の設計・思想に対し、【{name}】の視点（{focus}）だけから攻撃し、論理が崩壊する【死角】を1つだけ見つけ出せ。
+他の視点の死角は別の担当者が探すので書かなくてよい。
+
+【出力形式】
+1行目: [致命度: 1〜5] (5 = この死角だけで思想全体が崩壊する)
+2行目以降: 死角の内容を簡潔に
+対象概念:
+{new_concept}"""
+    return call_ai(prompt, "StressTester", use_cache=False)
+
+def _parse_finding(lens_name, text):
+    m = _SEVERITY_RE.search(text)
+    body = _SEVERITY_RE.sub("", text, count=1).strip().strip("[]").strip() if m else text.strip()
+    return {"lenses": [lens_name], "severity": int(m.group(1)) if m else 3, "text": body}
+
+def merge_findings(findings, limit=STRESS_MAX_FINDINGS):
+    """ほぼ同じ死角は1つにまとめ（複数の視点が見つけたものほど確からしい）、致命度・裏付けの多い順に並べる"""
+    merged = []
+    for f in findings:
+        same = next((m for m in merged if convergence.similarity(m["text"], f["text"]) >= STRESS_DEDUP_SIMILARITY), None)
+        if same:
+            same["lenses"] += f["lenses"]
+            if f["severity"] > same["severity"]: same.update(severity=f["severity"], text=f["text"])
+        else:
+            merged.append(dict(f, lenses=list(f["lenses"])))
+    merged.sort(key=lambda m: (-m["severity"], -len(m["lenses"])))
+    return merged[:limit]
+
+def _fanout_stress_test(new_concept):
+    """K 視点の Stress Test を並列に投げ、統合した死角を重要度順の1つの文書にする"""
+    lenses = STRESS_LENSES[:min(STRESS_FANOUT, len(STRESS_LENSES))]
+    print(f"  🌪️ Stress Test: {len(lenses)}視点で並列に耐衝撃テストを実行中...")
+    started = time.time()
+    findings = []
+    with ThreadPoolExecutor(max_workers=len(lenses), thread_name_prefix="redteam") as pool:
+        futures = [(lens[0], pool.submit(deadline.bind(_stress_lens), new_concept, lens)) for lens in lenses]
+        for name, future in futures:
+            try:
+                findings.append(_parse_finding(name, future.result()))
+            except Exception as e:
+                print(f"  ⚠️ {name} の視点は失敗しました: {e}")
+    if not findings: raise RuntimeError("StressTester failed on every lens.")
+    merged = merge_findings(findings)
+    print(f"  ⚠️ 発見された死角: {len(findings)}件 → 統合後 {len(merged)}件 ({time.time() - started:.1f}s)")
+    for m in merged: print(f"    - 致命度{m['severity']} [{'/'.join(m['lenses'])}] {m['text'].splitlines()[0][:50]}...")
+    return "\n\n".join(f"【死角 {i}】(致命度 {m['severity']} / 視点: {'・'.join(m['lenses'])})\n{m['text']}"
+                       for i, m in enumerate(merged, 1))
+
+def _phase_review(ctx, order):
+    raw, next_v = ctx["raw"], ctx["version"]
+    new_concept, stress_test_result = read_text(ctx["save_path"]), archive.fetch(ctx["stress_ref"])
 
     # --- PHASE 3: Destructive Auditor (極限監査とバトン) ---
     rev_prompt = f"""Role: 破壊的監査官.
@@ -135,28 +296,109 @@ def run_ideation(target_file, is_new_order=False, loop_count=1):
     
     review = call_ai(rev_prompt, "Reviewer")
     
-    with open(os.path.join(DIRS["reviews"], f"{raw}_v{next_v}_rev.txt"), "w", encoding="utf-8") as f: f.write(review)
+    ctx["review_ref"] = save_review(raw, f"{raw}_v{next_v}_rev.txt", review)
     
     l1_match = re.search(r"【🐾 思考のバトン】(.*)", review, re.DOTALL)
-    new_l1 = l1_match.group(1).strip() if l1_match else f"STATUS: {review.splitlines()[0]}"
-    with open(L1_MEMORY_FILE, "w", encoding="utf-8") as f: f.write(new_l1)
+    ctx["l1"] = l1_match.group(1).strip() if l1_match else f"STATUS: {review.splitlines()[0]}"
+    save_l1(raw, ctx["l1"])
 
-    status_line = review.splitlines()[0]
-    if "[STATUS: CONTINUE]" in status_line and loop_count < MAX_LOOP:
+    ctx["hashes"]["review"] = checkpoint.content_hash(review)
+    return "DECIDE"
+
+def _phase_decide(ctx, order):
+    status_line = archive.fetch(ctx["review_ref"]).splitlines()[0]
+    if "[STATUS: CONTINUE]" in status_line and ctx["loop"] < MAX_LOOP:
         print(f"  🐺 思想に隙あり。再構築へ移行。")
         time.sleep(20)
-        run_ideation_safe(save_path, is_new_order=True, loop_count=loop_count + 1)
+        ctx.update(target_file=ctx["save_path"], is_new_order=True, loop=ctx["loop"] + 1)
+        return "ARCHITECT"
+    elif "[STATUS: CONVERGED]" in status_line:
+        if ctx.get("converged", 0) >= 2 or ctx["loop"] >= MAX_LOOP:
+            print(f"🧊 思考が収束したため探求を終了: v{ctx['version']} (二世代連続で実質同一)")
+            return "END"
+        print(f"  🧊 収束1回目: 耐衝撃テストと監査を省いて再構築を続けます。")
+        ctx.update(target_file=ctx["save_path"], is_new_order=True, loop=ctx["loop"] + 1)
+        return "ARCHITECT"
     elif "[STATUS: DONE]" in status_line:
-        print(f"🏁 概念の結晶化完了: v{next_v}")
-        run_philosopher(raw, review)
+        print(f"🏁 概念の結晶化完了: v{ctx['version']}")
+        return "PHILOSOPHER"
+    print(f"🛑 探求終了: {status_line}")
+    return "END"
+
+def _phase_philosopher(ctx, order):
+    run_philosopher(ctx["raw"], archive.fetch(ctx["review_ref"]))
+    return "END"
+
+PHASES = {
+    "ARCHITECT": _phase_architect,
+    "STRESS_TEST": _phase_stress_test,
+    "REVIEW": _phase_review,
+    "DECIDE": _phase_decide,
+    "PHILOSOPHER": _phase_philosopher,
+}
+
+def _resume(raw, order_hash):
+    """同じテーマのチェックポイントがあれば、成果物が無傷な最も進んだフェーズから再開する"""
+    ctx = checkpoint.load(CHECKPOINT_DIR, raw)
+    if not ctx: return None
+    if ctx.get("order_hash") != order_hash:
+        checkpoint.clear(CHECKPOINT_DIR, raw)
+        return None
+    if ctx["phase"] in ("DECIDE", "PHILOSOPHER") and not checkpoint.intact(ctx, "review", "review_ref", archive.fetch):
+        ctx["phase"] = "REVIEW"
+    if ctx["phase"] == "REVIEW" and not checkpoint.intact(ctx, "stress", "stress_ref", archive.fetch):
+        ctx["phase"] = "STRESS_TEST"
+    if ctx["phase"] in ("STRESS_TEST", "REVIEW") and not checkpoint.intact(ctx, "new", "save_path"):
+        ctx["phase"] = "ARCHITECT"
+    return ctx
+
+def run_ideation(target_file, is_new_order=False, loop_count=1):
+    base = os.path.basename(target_file)
+    raw = base.split('_v')[0]
+
+    order_path = os.path.join(DIRS["order"], "order.txt")
+    order = open(order_path, "r", encoding="utf-8").read().strip() if os.path.exists(order_path) else "現状維持"
+    order_hash = checkpoint.content_hash(order)
+
+    ctx = _resume(raw, order_hash)
+    if ctx:
+        print(f"\n♻️ [RESUME] {raw}: Loop {ctx['loop']} の {ctx['phase']} から再開します。")
     else:
-        print(f"🛑 探求終了: {status_line}")
+        if is_new_order and loop_count == 1:
+            l1_memory = "【新たな探求の開始】"
+            save_l1(raw, l1_memory)
+        else:
+            l1_memory = load_l1(raw)
+        ctx = {"phase": "ARCHITECT", "raw": raw, "ext": os.path.splitext(base)[1], "order_hash": order_hash,
+               "target_file": target_file, "is_new_order": is_new_order, "loop": loop_count, "l1": l1_memory}
 
-def run_ideation_safe(path, is_new_order, loop_count):
+    while ctx["phase"] != "END":
+        # 貸出を失ったワーカーは次のフェーズにも、チェックポイントの書き込みにも進まない
+        jobqueue.ensure_lease()
+        ctx["phase"] = PHASES[ctx["phase"]](ctx, order)
+        jobqueue.ensure_lease()
+        ledger.append("phase", f"philosophy/{raw}", wait=False, phase=ctx["phase"], loop=ctx["loop"],
+                      version=ctx.get("version"), hashes=ctx.get("hashes"))
+        if ctx["phase"] == "END": checkpoint.clear(CHECKPOINT_DIR, raw)
+        else: checkpoint.save(CHECKPOINT_DIR, raw, ctx)
+
+def _run_job(payload, lease=None):
+    """
+    ジョブキューから借りた1件を実行する（例外はキュー側で再試行・failed として記録される）。
+    lease を失うと、フェーズの合間と各書き込みの直前で LeaseLost が送出されて打ち切られる
+    """
     try:
-        run_ideation(path, is_new_order, loop_count)
-    except Exception as e:
-        print(f"❌ 致命的エラー: {e}")
+        with jobqueue.holding(lease), deadline.run_budget():
+            run_ideation(payload["path"], payload["is_new_order"], payload["loop"])
+    except deadline.BudgetExceeded as e:
+        # 予算切れは再試行しない（チェックポイントは残るので、次の指令で同じフェーズから再開できる）
+        print(f"🛑 [BUDGET REACHED] {os.path.basename(payload['path'])}: {e}")
+
+def _report():
+    """このプロセスの仕事が一段落したら、ここまでの集計を出して次の集計を始める"""
+    print(f"🗃️ キャッシュ: {llm_cache.STATS}")
+    print(telemetry.describe(telemetry.finish_run()))
+    telemetry.start_run("philosophy_factory")
 
 # ---------------------------------------------------------
 # 5. 起動と監視
@@ -166,23 +408,25 @@ def boot_sequence():
     print(f"👁️ PHILOSOPHY FACTORY [思想・設計工房] ACTIVE")
     print("="*60)
     originals = [f for f in os.listdir(DIRS["original"]) if os.path.isfile(os.path.join(DIRS["original"], f))]
+    # 各originalを独立した探求として並行に進める: originalごとに1件ずつ永続キューへ積み、ワーカーが貸出制で取り出す
+    # （同じoriginalの待機ジョブは1件にまとまり、実行中のものは終わってから次の1回が走る）
     for f in originals:
-        run_ideation_safe(os.path.join(DIRS["original"], f), is_new_order=True, loop_count=1)
-
-class Handler(FileSystemEventHandler):
-    def on_modified(self, event):
-        if event.is_directory: return
-        if "order.txt" in event.src_path:
-            print("\n📡 新たな探求テーマを検知。思考を開始します。")
-            boot_sequence()
+        jobqueue.enqueue(QUEUE_NAME, f, {"path": os.path.join(DIRS["original"], f), "is_new_order": True, "loop": 1})
+    print(f"📥 {len(originals)}件をキューへ積みました: {jobqueue.stats().get(QUEUE_NAME, {}).get('counts', {})}")
 
 if __name__ == "__main__":
-    boot_sequence()
-    obs = Observer()
-    obs.schedule(Handler(), BASE_DIR, recursive=True)
-    obs.start()
+    # --worker: 監視せず、キューのジョブだけを処理するワーカーとして起動する（同じマシンで複数起動できる）
+    worker_only = "--worker" in sys.argv[1:]
+    telemetry.start_run("philosophy_factory")
+    # 旧形式の L2 マークダウンしか無ければ、起動時に1回だけストアへ移す（import しただけでは書き込まない）
+    lesson_store.migrate(L2_STORE, L2_MEMORY_FILE)
+    # 起動時の1回も監視と同じ作業キューに積み、実行中の指令更新は次の1回にまとめる
+    obs = None if worker_only else OrderWatcher(BASE_DIR, boot_sequence, ignore_dirs=[DIRS["workspace"], DIRS["reviews"]],
+                                                message="\n📡 新たな探求テーマを検知。思考を開始します。").start()
+    if obs: obs.trigger()
     try:
-        while True: time.sleep(1)
-    except KeyboardInterrupt:
-        obs.stop()
-    obs.join()
\ No newline at end of file
+        jobqueue.serve(QUEUE_NAME, _run_job, slots=MAX_WORKERS, on_idle=_report)
+    finally:
+        if obs:
+            obs.stop()
+            obs.join()
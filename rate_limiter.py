@@ -0,0 +1,167 @@
+import os
+import re
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: プロセス間ロックなし（プロセス内ロックのみ）で動作
+    fcntl = None
+
+# ---------------------------------------------------------
+# 1. 共有レート制限の基盤（全ファクトリ・全エンジン共通）
+# ---------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_DIR = os.getenv("RATE_LIMIT_DIR") or os.path.join(BASE_DIR, ".rate_limit")
+STATE_FILE = os.path.join(STATE_DIR, "buckets.json")
+LOCK_FILE = os.path.join(STATE_DIR, "buckets.lock")
+
+DEFAULT_RPM = float(os.getenv("LLM_RPM", "15"))
+DEFAULT_TPM = float(os.getenv("LLM_TPM", "250000"))
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 60.0
+
+_local_lock = threading.Lock()
+
+def _parse_limits(spec):
+    """LLM_RATE_LIMITS="model=RPM:TPM,model2=RPM:TPM" をモデル別の上限へ変換"""
+    limits = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, value = item.partition("=")
+        rpm, _, tpm = value.partition(":")
+        limits[name.strip()] = (float(rpm or DEFAULT_RPM), float(tpm or DEFAULT_TPM))
+    return limits
+
+MODEL_LIMITS = _parse_limits(os.getenv("LLM_RATE_LIMITS", ""))
+# 上限はAPIキー（プロジェクト）ごとの値。llm_client が複数キーへ振り分けるので、全体の上限はキー数倍になる
+KEY_COUNT = max(1, len([k for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip()]))
+
+def get_limits(model):
+    rpm, tpm = MODEL_LIMITS.get(model, (DEFAULT_RPM, DEFAULT_TPM))
+    return rpm * KEY_COUNT, tpm * KEY_COUNT
+
+def estimate_tokens(text):
+    """送信前の概算トークン数（ASCIIは4文字≒1トークン、日本語などは1文字≒1トークン）"""
+    text = str(text)
+    ascii_len = len(text.encode("ascii", "ignore"))
+    return ascii_len // 4 + (len(text) - ascii_len) + 1
+
+def usage_tokens(res):
+    """レスポンスの usage_metadata から実トークン数を取得（無ければ None）"""
+    usage = getattr(res, "usage_metadata", None)
+    return getattr(usage, "prompt_token_count", None) if usage else None
+
+@contextmanager
+def _locked_state():
+    """プロセス間で共有するバケット状態をファイルロック下で読み書きする"""
+    with _local_lock:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        with open(LOCK_FILE, "a+") as lock_fd:
+            if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(STATE_FILE, "r", encoding="utf-8") as f: state = json.load(f)
+                except (OSError, ValueError):
+                    state = {}
+                yield state
+                tmp_path = f"{STATE_FILE}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f: json.dump(state, f)
+                os.replace(tmp_path, STATE_FILE)
+            finally:
+                if fcntl: fcntl.flock(lock_fd, fcntl.LOCK_UN)
+
+def _refill(bucket, rpm, tpm, now):
+    elapsed = max(0.0, now - bucket.get("ts", now))
+    bucket["req"] = min(rpm, bucket.get("req", rpm) + elapsed * rpm / 60)
+    bucket["tok"] = min(tpm, bucket.get("tok", tpm) + elapsed * tpm / 60)
+    bucket["ts"] = now
+
+# ---------------------------------------------------------
+# 2. トークンバケット（RPM / TPM）
+# ---------------------------------------------------------
+def acquire(model, prompt_tokens):
+    """RPM/TPMバケットから1リクエスト分を確保する。不足時は補充まで待ち、待機秒数を返す"""
+    rpm, tpm = get_limits(model)
+    need = min(float(prompt_tokens), tpm)
+    waited = 0.0
+    while True:
+        now = time.time()
+        with _locked_state() as state:
+            bucket = state.setdefault(model, {})
+            _refill(bucket, rpm, tpm, now)
+            wait = max(0.0, bucket.get("blocked_until", 0) - now)
+            if not wait:
+                if bucket["req"] >= 1 and bucket["tok"] >= need:
+                    bucket["req"] -= 1
+                    bucket["tok"] -= need
+                    return waited
+                wait = max((1 - bucket["req"]) * 60 / rpm, (need - bucket["tok"]) * 60 / tpm)
+        # 複数プロセスが同じ瞬間に起きて取り合わないよう少し揺らす
+        wait += random.uniform(0, 0.25)
+        time.sleep(wait)
+        waited += wait
+
+def try_acquire(model, prompt_tokens):
+    """待たずに確保できるときだけ1リクエスト分を確保する（ヘッジ送信など、無くても困らない呼び出し用）"""
+    rpm, tpm = get_limits(model)
+    need = min(float(prompt_tokens), tpm)
+    now = time.time()
+    with _locked_state() as state:
+        bucket = state.setdefault(model, {})
+        _refill(bucket, rpm, tpm, now)
+        if bucket.get("blocked_until", 0) > now or bucket["req"] < 1 or bucket["tok"] < need: return False
+        bucket["req"] -= 1
+        bucket["tok"] -= need
+        return True
+
+def settle(model, estimated, actual):
+    """実トークン数が判明したら概算との差分をTPMバケットへ反映"""
+    if actual is None: return
+    rpm, tpm = get_limits(model)
+    with _locked_state() as state:
+        bucket = state.setdefault(model, {})
+        _refill(bucket, rpm, tpm, time.time())
+        bucket["tok"] -= actual - min(float(estimated), tpm)
+
+# ---------------------------------------------------------
+# 3. 429 応答の処理（Retry-After 優先 + ジッター付き指数バックオフ）
+# ---------------------------------------------------------
+_RETRY_RE = re.compile(r"retry[-_ ]?(?:after|delay)['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)", re.IGNORECASE)
+
+def is_rate_limited(error):
+    return "429" in str(error) or "RESOURCE_EXHAUSTED" in str(error)
+
+def retry_after(error):
+    """例外から Retry-After ヘッダ、または RetryInfo の retryDelay を秒数で取り出す"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    value = headers.get("retry-after") or headers.get("Retry-After") if headers else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    m = _RETRY_RE.search(str(error))
+    return float(m.group(1)) if m else None
+
+def backoff(model, error, attempt):
+    """429受信時の待機。待機期間は共有状態に書き込まれ、他プロセスも同じモデルへの送信を控える"""
+    delay = retry_after(error)
+    if delay is None:
+        delay = random.uniform(BACKOFF_BASE, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** (attempt + 1)))
+    else:
+        delay += random.uniform(0, 1)
+    rpm, tpm = get_limits(model)
+    with _locked_state() as state:
+        bucket = state.setdefault(model, {})
+        _refill(bucket, rpm, tpm, time.time())
+        bucket["req"] = 0.0
+        bucket["blocked_until"] = max(bucket.get("blocked_until", 0), time.time() + delay)
+    time.sleep(delay)
+    return delay
@@ -0,0 +1,182 @@
+import io
+import os
+import sys
+import json
+import glob
+import shutil
+import hashlib
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from contextlib import redirect_stdout, redirect_stderr
+
+try:
+    import tomllib
+except ImportError:  # Python 3.10 以前
+    try:
+        import tomli as tomllib
+    except ImportError:
+        tomllib = None
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# ---------------------------------------------------------
+# 1. 検証エンジンの基盤（拡張子ごとの差し替え可能なチェック群）
+# ---------------------------------------------------------
+RUN_PYTEST = os.getenv("REALITY_CHECK_PYTEST", "0") == "1"
+PYTEST_TIMEOUT = float(os.getenv("REALITY_CHECK_TIMEOUT", "60"))
+PYTEST_WORKERS = int(os.getenv("REALITY_CHECK_WORKERS", "2"))
+
+# 拡張子 → チェック関数のリスト。各関数は (source, context) を受け取り (ok, label, detail) を返す
+#   ok: True=合格 / False=不合格 / None=実行せず
+CHECKS = {}
+
+_results = {}
+_results_lock = threading.Lock()
+_pool = None
+_pool_lock = threading.Lock()
+
+def register(*exts):
+    """チェック関数を拡張子に登録するデコレータ"""
+    def deco(fn):
+        for ext in exts: CHECKS.setdefault(ext, []).append(fn)
+        return fn
+    return deco
+
+def _error_text(e):
+    return "".join(traceback.format_exception_only(type(e), e)).strip()
+
+# ---------------------------------------------------------
+# 2. 標準チェック（すべてプロセス内で完結）
+# ---------------------------------------------------------
+@register(".py")
+def check_python(source, context):
+    try:
+        compile(source, context["path"], "exec", dont_inherit=True)
+        return True, "Syntax OK", ""
+    except (SyntaxError, ValueError) as e:
+        return False, "Syntax Error", _error_text(e)
+
+@register(".json")
+def check_json(source, context):
+    try:
+        json.loads(source)
+        return True, "JSON OK", ""
+    except ValueError as e:
+        return False, "JSON Error", _error_text(e)
+
+@register(".yaml", ".yml")
+def check_yaml(source, context):
+    if yaml is None: return None, "YAML skipped (PyYAML未導入)", ""
+    try:
+        list(yaml.safe_load_all(source))
+        return True, "YAML OK", ""
+    except yaml.YAMLError as e:
+        return False, "YAML Error", str(e)
+
+@register(".toml")
+def check_toml(source, context):
+    if tomllib is None: return None, "TOML skipped (tomllib未導入)", ""
+    try:
+        tomllib.loads(source)
+        return True, "TOML OK", ""
+    except tomllib.TOMLDecodeError as e:
+        return False, "TOML Error", _error_text(e)
+
+# ---------------------------------------------------------
+# 3. ターゲット自身の pytest（使い回すワーカープロセスでタイムアウト付き実行）
+# ---------------------------------------------------------
+def _pytest_worker(workdir):
+    """ワーカープロセス側: pytest をプロセス内で実行し、持ち込んだモジュールを片付ける"""
+    import pytest
+    before = set(sys.modules)
+    sys.path.insert(0, workdir)
+    buf = io.StringIO()
+    try:
+        with redirect_stdout(buf), redirect_stderr(buf):
+            code = pytest.main(["-q", "-p", "no:cacheprovider", workdir])
+        return int(code), buf.getvalue()[-4000:]
+    finally:
+        sys.path.remove(workdir)
+        for name in set(sys.modules) - before: sys.modules.pop(name, None)
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.get_context("spawn").Pool(PYTEST_WORKERS, maxtasksperchild=50)
+        return _pool
+
+def _reset_pool():
+    """タイムアウトしたワーカーは止められないので、プールごと作り直す"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None: _pool.terminate()
+        _pool = None
+
+def find_tests(module_name, test_dirs):
+    files = []
+    for d in test_dirs:
+        files += glob.glob(os.path.join(d, f"test_{module_name}.py")) + glob.glob(os.path.join(d, f"test_{module_name}_*.py"))
+    return sorted(set(files))
+
+@register(".py")
+def check_pytest(source, context):
+    tests = context.get("tests") or []
+    if not RUN_PYTEST or not tests: return None, "", ""
+    workdir = tempfile.mkdtemp(prefix="reality_")
+    try:
+        # 生成物をターゲット本来のモジュール名で置き、テストから import できるようにする
+        with open(os.path.join(workdir, f"{context['module_name']}.py"), "w", encoding="utf-8") as f: f.write(source)
+        for t in tests: shutil.copy(t, workdir)
+        try:
+            code, output = _get_pool().apply_async(_pytest_worker, (workdir,)).get(PYTEST_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            _reset_pool()
+            return False, "pytest Timeout", f"{PYTEST_TIMEOUT}秒以内に終了しませんでした。"
+        summary = output.strip().splitlines()[-1] if output.strip() else f"exit {code}"
+        return code == 0, f"pytest {summary}", "" if code == 0 else output
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# ---------------------------------------------------------
+# 4. 実行（内容ハッシュで結果をキャッシュ）
+# ---------------------------------------------------------
+def run(file_path, module_name=None, test_dirs=()):
+    """全チェックを実行し、1行目に PASS/FAIL の要約を持つ結果文字列を返す"""
+    ext = os.path.splitext(file_path)[1]
+    checks = CHECKS.get(ext)
+    if not checks: return f"UNKNOWN_EXT ({ext})"
+    source = open(file_path, "r", encoding="utf-8").read()
+
+    module_name = module_name or os.path.splitext(os.path.basename(file_path))[0]
+    tests = find_tests(module_name, test_dirs) if RUN_PYTEST else []
+    digest = hashlib.sha256(source.encode("utf-8"))
+    for t in tests: digest.update(open(t, "rb").read())
+    key = (ext, module_name, digest.hexdigest())
+    with _results_lock:
+        if key in _results: return _results[key]
+
+    context = {"path": file_path, "module_name": module_name, "tests": tests}
+    results = []
+    for fn in checks:
+        results.append(fn(source, context))
+        # 構文で落ちたものに重いチェック（pytest など）を走らせても意味がない
+        if results[-1][0] is False: break
+    failed = [(label, detail) for ok, label, detail in results if ok is False]
+    passed = [label for ok, label, _ in results if ok]
+    if failed:
+        summary = f"FAIL ({', '.join(label for label, _ in failed)}):\n" + "\n".join(detail for _, detail in failed)
+    elif passed:
+        summary = f"PASS ({', '.join(passed)})"
+    else:
+        summary = f"UNKNOWN_EXT ({ext})"
+
+    with _results_lock:
+        if len(_results) >= 1024: _results.clear()
+        _results[key] = summary
+    return summary
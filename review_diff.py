@@ -0,0 +1,87 @@
+import os
+import re
+import ast
+import difflib
+import rate_limiter
+
+# ---------------------------------------------------------
+# Reviewer 向けの差分入力（unified diff + 関数/クラス名の注釈 + トークン予算）
+# ---------------------------------------------------------
+CONTEXT_LINES = int(os.getenv("REVIEW_DIFF_CONTEXT", "3"))
+TOKEN_BUDGET = int(os.getenv("REVIEW_TOKEN_BUDGET", "6000"))
+
+_HUNK_RE = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@")
+
+def _scopes(source):
+    """Pythonソースの (開始行, 終了行, "class A.def f") を内側ほど後ろになる順で返す"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        return []
+    scopes = []
+    def walk(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                kind = "class" if isinstance(child, ast.ClassDef) else "def"
+                name = f"{prefix}{kind} {child.name}"
+                scopes.append((child.lineno, child.end_lineno, name))
+                walk(child, name + ".")
+    walk(tree, "")
+    return scopes
+
+def _scope_at(scopes, line):
+    hits = [name for start, end, name in scopes if start <= line <= end]
+    return hits[-1] if hits else ""
+
+def _first_changed_line(hunk):
+    """hunk 内で最初に変更された行の、今回生成側での行番号"""
+    m = _HUNK_RE.match(hunk[0])
+    line = int(m.group(1)) if m else 0
+    for l in hunk[1:]:
+        if l.startswith(("+", "-")): break
+        line += 1
+    return line
+
+def _split_hunks(diff_lines):
+    hunks, current = [], None
+    for line in diff_lines:
+        if line.startswith("@@"):
+            current = [line]
+            hunks.append(current)
+        elif current is not None:
+            current.append(line)
+    return hunks
+
+def build(prev_text, new_text, ext, budget=TOKEN_BUDGET, context=CONTEXT_LINES):
+    """前世代→今回の変更をレビュー用テキストにする。差分がファイル本体より大きければ全文を渡す"""
+    diff_lines = list(difflib.unified_diff(prev_text.splitlines(), new_text.splitlines(),
+                                           "前世代", "今回生成", n=context, lineterm=""))
+    if not diff_lines: return "（差分なし: 前世代と同一）"
+
+    diff_text = "\n".join(diff_lines)
+    if len(diff_text) >= len(new_text):
+        header = "（差分がファイル本体より大きいため、今回生成の全文を示す）\n"
+        return header + _truncate(new_text, budget - rate_limiter.estimate_tokens(header))
+
+    # 各hunkの見出しに、変更箇所を含む関数/クラス名を付ける（git の funcname 相当）
+    scopes = _scopes(new_text) if ext == ".py" else []
+    hunks = _split_hunks(diff_lines)
+    out = [diff_lines[0], diff_lines[1]]
+    used = rate_limiter.estimate_tokens("\n".join(out))
+    for i, hunk in enumerate(hunks):
+        scope = _scope_at(scopes, _first_changed_line(hunk)) if scopes else ""
+        if scope: hunk = [f"{hunk[0]} {scope}"] + hunk[1:]
+        text = "\n".join(hunk)
+        cost = rate_limiter.estimate_tokens(text)
+        if used + cost > budget:
+            out.append(f"... (トークン予算 {budget} 超過のため残り {len(hunks) - i} hunk を省略)")
+            break
+        out.append(text)
+        used += cost
+    return "\n".join(out)
+
+def _truncate(text, budget):
+    if rate_limiter.estimate_tokens(text) <= budget: return text
+    # 概算トークン数に比例して切り詰める
+    keep = max(0, int(len(text) * budget / rate_limiter.estimate_tokens(text)))
+    return text[:keep] + f"\n... (トークン予算 {budget} 超過のため以降省略)"
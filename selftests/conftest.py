@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+# 基盤モジュールの単体テスト（tests/ はファクトリが進化させるターゲット用なので使わない）
+#   実行: python -m pytest -q selftests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive  # noqa: E402
+import jobqueue  # noqa: E402
+import ledger  # noqa: E402
+import rate_limiter  # noqa: E402
+import telemetry  # noqa: E402
+
+@pytest.fixture(autouse=True)
+def isolated(tmp_path, monkeypatch):
+    """台帳・ジョブキュー・アーカイブ・レート制限・計測の共有状態の置き場所をテストごとの一時ディレクトリへ移す"""
+    monkeypatch.setattr(ledger, "LEDGER_DIR", str(tmp_path / "ledger"))
+    monkeypatch.setattr(ledger, "ENABLED", True)
+    monkeypatch.setattr(ledger, "_view", {"seq": 0, "latest": {}})
+    monkeypatch.setattr(jobqueue, "DB_PATH", str(tmp_path / "jobqueue" / "jobs.db"))
+    monkeypatch.setattr(archive, "ARCHIVE_DIR", str(tmp_path / "archive"))
+    monkeypatch.setattr(rate_limiter, "STATE_DIR", str(tmp_path / "rate_limit"))
+    monkeypatch.setattr(rate_limiter, "STATE_FILE", str(tmp_path / "rate_limit" / "buckets.json"))
+    monkeypatch.setattr(rate_limiter, "LOCK_FILE", str(tmp_path / "rate_limit" / "buckets.lock"))
+    monkeypatch.setattr(telemetry, "RUNS_DIR", str(tmp_path / "runs"))
+    monkeypatch.setattr(telemetry, "_run", None)
+    yield tmp_path
+    # wait=False で積んだ台帳レコードは、このテストの台帳に書き切ってから次のテストへ
+    ledger.flush()
@@ -0,0 +1,80 @@
+import os
+import threading
+
+import archive
+
+def test_put_read_round_trip_and_dedup():
+    text = '{"artifact": "本文"}\n' * 50
+    record_id = archive.put("run-1", "step3_02_refine.txt_raw.txt", text, status="ok")
+    assert archive.put("run-1", "step3_02_refine.txt_raw.txt", text, status="ok") == record_id
+    record = archive.get(record_id)
+    assert (record["kind"], record["step"], record["stage"], record["status"]) == ("raw", 3, "02_refine.txt", "ok")
+    assert archive.read(record) == text
+    assert record["length"] < record["size"]
+
+def test_query_filters_by_index_fields():
+    archive.put("target", "target_v1_rev.txt", "[STATUS: CONTINUE]\n直す", ts=100)
+    archive.put("target", "target_v2_rev.txt", "[STATUS: DONE]\nok", ts=200)
+    archive.put("target", "target_v2_stress.txt", "stress", ts=300)
+    archive.put("run-2", "calls.jsonl", "{}\n", ts=400)
+    assert [r["name"] for r in archive.query(run="target", kind="review")] == ["target_v2_rev.txt", "target_v1_rev.txt"]
+    assert [r["status"] for r in archive.query(kind="review", status="DONE")] == ["DONE"]
+    assert [r["kind"] for r in archive.query(since=250)] == ["calls", "stress"]
+    assert archive.stats()["records"] == 4
+
+def test_concurrent_puts_are_all_readable():
+    def writer(n):
+        for i in range(20): archive.put(f"run-{n}", f"step{i}_s_raw.txt", f"{n}-{i}" * 100)
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    records = archive.query()
+    assert len(records) == 80
+    assert {archive.read(r) for r in records} == {f"{n}-{i}" * 100 for n in range(4) for i in range(20)}
+
+def test_pack_run_moves_files_and_export_restores_them(tmp_path):
+    run_dir = tmp_path / "runs" / "run-3"
+    run_dir.mkdir(parents=True)
+    (run_dir / "step1_a_raw.txt").write_text("raw", encoding="utf-8")
+    (run_dir / "summary.json").write_text("{}", encoding="utf-8")
+    assert archive.pack_run(str(run_dir)) == 2
+    assert not run_dir.exists()
+    out = tmp_path / "restored"
+    assert archive.export("run-3", str(out)) == 2
+    assert sorted(os.listdir(out)) == ["step1_a_raw.txt", "summary.json"]
+    assert (out / "step1_a_raw.txt").read_text(encoding="utf-8") == "raw"
+
+def test_kept_reviews_live_only_in_the_archive(tmp_path, monkeypatch):
+    import checkpoint
+    monkeypatch.setattr(archive, "ENABLED", True)
+    reviews = tmp_path / "reviews"
+    reviews.mkdir()
+    ref = archive.keep("target", "target_v3_rev.txt", "[STATUS: CONTINUE]\n直す", str(reviews))
+    assert os.listdir(reviews) == []
+    assert archive.fetch(ref) == "[STATUS: CONTINUE]\n直す"
+    assert archive.query(run="target", kind="review")[0]["status"] == "CONTINUE"
+    state = {"review_ref": ref, "hashes": {"review": checkpoint.content_hash("[STATUS: CONTINUE]\n直す")}}
+    assert checkpoint.intact(state, "review", "review_ref", archive.fetch)
+    assert not checkpoint.intact(dict(state, review_ref="archive:999"), "review", "review_ref", archive.fetch)
+    # 旧形式のチェックポイント（ファイルのパスを持たない）は作り直させる
+    assert not checkpoint.intact({"hashes": state["hashes"]}, "review", "review_ref", archive.fetch)
+
+def test_kept_reviews_fall_back_to_files_when_the_archive_is_off(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ENABLED", False)
+    ref = archive.keep("target", "target_v1_stress.txt", "死角", str(tmp_path))
+    assert ref == str(tmp_path / "target_v1_stress.txt") and archive.fetch(ref) == "死角"
+    assert archive.fetch(str(tmp_path / "missing.txt"), None) is None
+
+def test_factory_resume_reads_the_review_back_from_the_archive(tmp_path, monkeypatch):
+    import pytest
+    debate_factory = pytest.importorskip("debate_factory")
+    import checkpoint
+    monkeypatch.setattr(archive, "ENABLED", True)
+    monkeypatch.setattr(debate_factory, "CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+    ref = debate_factory.save_review("calc", "calc_v2_rev.txt", "[STATUS: DONE]\nok")
+    ctx = {"phase": "DECIDE", "order_hash": "h", "review_ref": ref, "save_path": "",
+           "hashes": {"review": checkpoint.content_hash("[STATUS: DONE]\nok")}}
+    checkpoint.save(debate_factory.CHECKPOINT_DIR, "calc", ctx)
+    assert debate_factory._resume("calc", "h")["phase"] == "DECIDE"
+    assert debate_factory._phase_decide(dict(ctx, version=2, loop=1), "order") == "LIBRARIAN"
+    assert not os.path.exists(os.path.join(debate_factory.DIRS["reviews"], "calc_v2_rev.txt"))
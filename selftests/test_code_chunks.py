@@ -0,0 +1,78 @@
+import code_chunks
+
+SOURCE = '''"""モジュールの説明"""
+import os
+
+LIMIT = 3
+
+# ヘルパー
+def helper(x):
+    """値を2倍にする"""
+    return x * 2
+
+
+@staticmethod
+def decorated(a,
+              b):
+    return a + b
+
+class Store:
+    """保存先"""
+    def load(self, path):
+        return open(path).read()
+
+    def save(self, path, text):
+        pass
+
+def helper(x):
+    return x * 3
+
+if __name__ == "__main__":
+    print(helper(LIMIT))
+'''
+
+def test_split_covers_the_whole_file_and_splices_back_unchanged():
+    chunks = code_chunks.split(SOURCE)
+    assert "".join(c["text"] for c in chunks) == SOURCE
+    assert code_chunks.splice(chunks, {}) == SOURCE
+    lines = [(c["start"], c["end"]) for c in chunks]
+    assert lines[0][0] == 1 and lines[-1][1] == SOURCE.count("\n")
+    assert all(a[1] + 1 == b[0] for a, b in zip(lines, lines[1:]))
+
+def test_split_names_definitions_with_decorators_and_comments():
+    chunks = {c["name"]: c for c in code_chunks.split(SOURCE)}
+    assert chunks["helper"]["text"].startswith("# ヘルパー\ndef helper")
+    assert chunks["decorated"]["text"].startswith("@staticmethod\n")
+    assert chunks["Store"]["kind"] == "class"
+    # 同名の再定義は取り違えないよう別名にする
+    assert "return x * 3" in chunks["helper#2"]["text"]
+    assert chunks["<module header>"]["kind"] == "module"
+
+def test_split_rejects_syntax_errors():
+    assert code_chunks.split("def broken(:\n    pass\n") is None
+
+def test_splice_replaces_only_the_selected_chunk_and_keeps_spacing():
+    chunks = code_chunks.split(SOURCE)
+    out = code_chunks.splice(chunks, {"decorated": "def decorated(a, b):\n    return a - b"})
+    assert "return a - b\n\nclass Store:" in out
+    assert out.replace("def decorated(a, b):\n    return a - b\n\n", "") == \
+        SOURCE.replace("@staticmethod\ndef decorated(a,\n              b):\n    return a + b\n\n", "")
+
+def test_select_prefers_named_definitions_and_error_lines():
+    chunks = code_chunks.split(SOURCE)
+    assert code_chunks.select(chunks, "Store.save を直せ", "")[0] == "Store"
+    line = next(c for c in chunks if c["name"] == "decorated")["start"] + 1
+    assert code_chunks.select(chunks, "修正せよ", f'File "x.py", line {line}, in decorated')[0] == "decorated"
+    assert code_chunks.select(chunks, "まったく関係のない指令", "", top_k=2) == []
+
+def test_outline_keeps_signatures_and_marks_targets():
+    chunks = code_chunks.split(SOURCE)
+    text = code_chunks.outline(chunks, {"Store"}, SOURCE)
+    assert "# <<< 書き換え対象: Store" in text
+    assert 'def helper(x):\n    """値を2倍にする"""\n    ...' in text
+    assert "return a + b" not in text
+
+def test_strip_fence_and_enabled():
+    assert code_chunks.strip_fence("```python\ndef f():\n    pass\n```") == "def f():\n    pass"
+    assert code_chunks.strip_fence("def f(): pass") == "def f(): pass"
+    assert not code_chunks.enabled(SOURCE, ".md")
@@ -0,0 +1,42 @@
+import context_budget
+from rate_limiter import estimate_tokens
+
+LOG = "\n".join(f"line {i}: " + "詳細" * 20 for i in range(200))
+
+def test_clip_keeps_the_requested_side_and_marks_the_gap():
+    tail = context_budget.clip(LOG, 300, "tail")
+    head = context_budget.clip(LOG, 300, "head")
+    ends = context_budget.clip(LOG, 300, "ends")
+    for text in (tail, head, ends):
+        assert estimate_tokens(text) <= 300 and "行省略" in text
+    assert tail.endswith("line 199: " + "詳細" * 20) and "line 0:" not in tail
+    assert head.startswith("line 0:") and "line 199:" not in head
+    assert ends.startswith("line 0:") and ends.endswith("line 199: " + "詳細" * 20)
+    assert context_budget.clip("short", 300) == "short"
+
+def test_clip_cuts_a_single_overlong_line_by_characters():
+    text = "x" * 10000
+    assert estimate_tokens(context_budget.clip(text, 100, "head")) <= 110
+
+def test_fit_trims_earliest_sections_first_and_respects_floors():
+    sections = [("l1", LOG, 200, "tail"), ("l2", LOG, 300, "head"), ("artifact", LOG, 10 ** 6, "ends")]
+    total = sum(estimate_tokens(t) for _, t, _, _ in sections)
+    budget = total - estimate_tokens(LOG) // 2
+    fitted, report = context_budget.fit(sections, budget)
+    assert sum(estimate_tokens(t) for t in fitted.values()) <= budget
+    assert fitted["artifact"] == LOG and fitted["l2"] == LOG
+    assert [name for name, _, _ in report] == ["l1"]
+
+def test_fit_reports_overflow_when_floors_exceed_the_budget():
+    sections = [("l1", LOG, 200, "tail"), ("artifact", LOG, estimate_tokens(LOG), "ends")]
+    fitted, _ = context_budget.fit(sections, 500)
+    assert fitted["artifact"] == LOG
+    assert sum(estimate_tokens(t) for t in fitted.values()) > 500
+
+def test_patch_edits_apply_in_order_and_report_misses():
+    import universal_agent_engine as uae
+    artifact, failed = uae.apply_edits("a = 1\nb = 2\n", [{"find": "a = 1", "replace": "a = 10"},
+                                                          {"find": "", "replace": "c = 3"},
+                                                          {"find": "zzz", "replace": "x"}, "junk"])
+    assert artifact == "a = 10\nb = 2\nc = 3"
+    assert len(failed) == 2 and "zzz" in failed[0]
@@ -0,0 +1,45 @@
+import random
+import time
+
+import convergence
+
+def _prose(seed, sentences=60):
+    rng = random.Random(seed)
+    words = ["観測", "記録", "分離", "仮説", "検証", "構造", "境界", "責任", "反証", "前提", "帰結", "運用"]
+    return "".join("".join(rng.choice(words) for _ in range(rng.randint(3, 6))) + "である。" for _ in range(sentences))
+
+def test_identical_and_whitespace_only_changes_converge():
+    text = _prose(0)
+    assert convergence.check(text, text, ".md") == "前世代とバイト単位で同一"
+    assert "正規化ハッシュ" in convergence.check("def f():\n    return 1\n", "def f():  # c\n\n    return 1\n", ".py")
+
+def test_one_new_sentence_in_long_prose_is_not_convergence():
+    prev = _prose(1, 120)
+    assert len(prev.encode("utf-8")) > 4000
+    new = prev[:len(prev) // 2] + "ただし反証可能性の条件を明示しなければならない。" + prev[len(prev) // 2:]
+    assert convergence.similarity(prev, new) > 0.97
+    assert convergence.check(prev, new, ".md") is None
+
+def test_a_few_changed_characters_in_prose_converge():
+    prev = _prose(2)
+    new = prev.replace("である。", "だ。", 1)
+    reason = convergence.check(prev, new, ".md")
+    assert reason and "変更" in reason
+
+def test_code_is_never_judged_by_prose_similarity():
+    prev = "def f():\n    return 1\n" * 50
+    assert convergence.check(prev, prev.replace("return 1", "return 2", 1), ".py") is None
+
+def test_similarity_is_order_sensitive_and_bounded():
+    assert convergence.similarity("abc", "abc") == 1.0
+    assert convergence.similarity("", "abc") == 0.0
+    # 同じ文字 3-gram の集合でも、並びが入れ替われば別物
+    a = "観測と記録を分離する。責任の境界を定める。"
+    b = "責任の境界を定める。観測と記録を分離する。"
+    assert convergence.similarity(a, b) < 0.7
+
+def test_check_stays_fast_on_unrelated_long_documents():
+    prev, new = _prose(3, 400), _prose(4, 400)
+    start = time.perf_counter()
+    assert convergence.check(prev, new, ".md") is None
+    assert time.perf_counter() - start < 2.0
@@ -0,0 +1,59 @@
+import os
+import time
+import threading
+
+import pytest
+
+import deadline
+import rate_limiter
+
+@pytest.fixture
+def slept(monkeypatch):
+    calls = []
+    monkeypatch.setattr(time, "sleep", calls.append)
+    return calls
+
+def test_retry_pause_is_local_jittered_and_doubling(slept, monkeypatch):
+    monkeypatch.setattr(deadline, "RETRY_PAUSE_CAP_SEC", 4.0)
+    for attempt in range(5):
+        for _ in range(20): assert 0 <= deadline.retry_pause(attempt) <= min(4.0, 2 ** attempt)
+    assert len(slept) == 100
+    # 期限切れの待機は共有のバケットに何も書かない（他プロセス・他キーを止めない）
+    assert not os.path.exists(rate_limiter.STATE_FILE)
+
+def test_timeout_for_uses_role_rules_and_the_remaining_budget(monkeypatch):
+    monkeypatch.setattr(deadline, "ROLE_DEADLINES", deadline._parse_deadlines("Architect=300, Rev*=60, *=180"))
+    assert deadline.timeout_for("Architect") == 300
+    assert deadline.timeout_for("Reviewer") == 60
+    assert deadline.timeout_for("stage") == 180
+    with deadline.run_budget(10):
+        assert 9 < deadline.timeout_for("Architect") <= 10
+    with deadline.run_budget(0.01):
+        time.sleep(0.02)
+        with pytest.raises(deadline.BudgetExceeded):
+            deadline.timeout_for("Architect")
+
+def test_watched_only_when_deadlines_or_a_budget_are_explicit(monkeypatch):
+    monkeypatch.setattr(deadline, "_DEADLINE_SPEC", deadline.DEFAULT_DEADLINES)
+    assert not deadline.watched()
+    with deadline.run_budget(60): assert deadline.watched()
+    monkeypatch.setattr(deadline, "_DEADLINE_SPEC", "Reviewer=60,*=300")
+    assert deadline.watched()
+
+def test_retries_exhausted_distinguishes_timeouts_from_budget():
+    error = deadline.retries_exhausted("Reviewer", 3)
+    assert type(error) is deadline.DeadlineExceeded and deadline.is_timeout(error)
+    with deadline.run_budget(0.01):
+        time.sleep(0.02)
+        error = deadline.retries_exhausted("Reviewer", 3)
+    assert isinstance(error, deadline.BudgetExceeded) and not deadline.is_timeout(error)
+
+def test_bind_carries_the_budget_into_worker_threads():
+    seen = []
+    with deadline.run_budget(30):
+        fn = deadline.bind(lambda: seen.append(deadline.remaining()))
+    thread = threading.Thread(target=fn)
+    thread.start()
+    thread.join()
+    assert seen and 0 < seen[0] <= 30
+    assert deadline.remaining() is None
@@ -0,0 +1,126 @@
+import threading
+
+import pytest
+
+import engine
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    paths = {k: tmp_path / k for k in ("order", "workspace", "stages")}
+    for path in paths.values(): path.mkdir()
+    monkeypatch.setattr(engine, "DIRS", {k: str(v) for k, v in paths.items()})
+    monkeypatch.setattr(engine, "BATCH_DIR", str(paths["workspace"] / "batch"))
+    return paths
+
+def _stage(dirs, name, text):
+    (dirs["stages"] / name).write_text(text, encoding="utf-8")
+
+def _graph(dirs):
+    return engine.build_stage_graph(sorted(str(p) for p in dirs["stages"].glob("*.txt")))
+
+def test_stages_without_headers_chain_in_file_order(dirs):
+    _stage(dirs, "01_a.txt", "A")
+    _stage(dirs, "02_b.txt", "@cache: off\nB")
+    graph = _graph(dirs)
+    assert [graph[n]["deps"] for n in graph] == [[], ["01_a.txt"]]
+    assert graph["02_b.txt"]["headers"] == {"cache": "off"} and graph["02_b.txt"]["instruction"] == "B"
+
+def test_unknown_dependencies_and_cycles_are_rejected(dirs):
+    _stage(dirs, "01_a.txt", "@depends: 02_b.txt\nA")
+    _stage(dirs, "02_b.txt", "@depends: 01_a.txt\nB")
+    with pytest.raises(ValueError, match="循環"): _graph(dirs)
+    _stage(dirs, "02_b.txt", "@depends: 09_missing.txt\nB")
+    with pytest.raises(ValueError, match="存在しない"): _graph(dirs)
+
+def test_independent_stages_run_in_parallel_and_join_their_outputs(dirs, monkeypatch):
+    (dirs["order"] / "order.txt").write_text("注文", encoding="utf-8")
+    _stage(dirs, "01_a.txt", "@depends:\nA")
+    _stage(dirs, "02_b.txt", "@depends:\nB")
+    _stage(dirs, "03_c.txt", "@depends: 01_a.txt, 02_b.txt\nC")
+    both_running = threading.Barrier(2, timeout=5)
+    prompts = {}
+    def fake_call_llm(prompt, use_cache=True, role="stage"):
+        prompts[role] = prompt
+        # 01 と 02 は互いの開始を待つ: 直列に実行されていれば Barrier が破れて失敗する
+        if role != "03_c.txt": both_running.wait()
+        return f"out-{role}"
+    monkeypatch.setattr(engine, "call_llm", fake_call_llm)
+    engine.run_pipeline()
+    assert "注文" in prompts["01_a.txt"] and "注文" in prompts["02_b.txt"]
+    assert "【01_a.txt の出力】\nout-01_a.txt" in prompts["03_c.txt"] and "out-02_b.txt" in prompts["03_c.txt"]
+    assert (dirs["workspace"] / "output_03_c.txt").read_text(encoding="utf-8") == "out-03_c.txt"
+
+def test_a_failing_stage_stops_the_pipeline_before_its_dependents(dirs, monkeypatch):
+    (dirs["order"] / "order.txt").write_text("注文", encoding="utf-8")
+    _stage(dirs, "01_a.txt", "A")
+    _stage(dirs, "02_b.txt", "B")
+    calls = []
+    def fake_call_llm(prompt, use_cache=True, role="stage"):
+        calls.append(role)
+        raise RuntimeError("boom")
+    monkeypatch.setattr(engine, "call_llm", fake_call_llm)
+    with pytest.raises(RuntimeError, match="boom"): engine.run_pipeline()
+    assert calls == ["01_a.txt"]
+
+def _orders(tmp_path, n):
+    source = tmp_path / "orders"
+    source.mkdir()
+    for i in range(n): (source / f"o{i}.txt").write_text(f"指令{i}", encoding="utf-8")
+    return str(source)
+
+def test_batch_pipelines_orders_and_resumes_from_the_manifest(tmp_path, dirs, monkeypatch):
+    _stage(dirs, "01_a.txt", "A")
+    _stage(dirs, "02_b.txt", "B")
+    source = _orders(tmp_path, 3)
+    calls = []
+    def fake_call_llm(prompt, use_cache=True, role="stage"):
+        calls.append(role)
+        if "指令1" in prompt: raise RuntimeError("boom")
+        return prompt.strip().splitlines()[-1] + f" -> {role}"
+    monkeypatch.setattr(engine, "call_llm", fake_call_llm)
+    engine.run_batch(source, "b1", concurrency=2)
+    root = dirs["workspace"] / "batch" / "b1"
+    assert (root / "o2" / "output_02_b.txt").read_text(encoding="utf-8") == "指令2 -> 01_a.txt -> 02_b.txt"
+    records = engine.load_manifest(str(root))
+    assert records[("o1", "01_a.txt")]["status"] == "failed" and ("o1", "02_b.txt") not in records
+    assert sorted(calls) == ["01_a.txt"] * 3 + ["02_b.txt"] * 2
+
+    # 再実行: 完了済みの組は飛ばし、失敗した指令は --retry-failed のときだけやり直す
+    calls.clear()
+    engine.run_batch(source, "b1", concurrency=2)
+    assert calls == []
+    monkeypatch.setattr(engine, "call_llm", lambda prompt, use_cache=True, role="stage": calls.append(role) or "ok")
+    engine.run_batch(source, "b1", concurrency=2, retry_failed=True)
+    assert calls == ["01_a.txt", "02_b.txt"]
+
+def test_changed_orders_or_stages_are_rerun(tmp_path, dirs, monkeypatch):
+    _stage(dirs, "01_a.txt", "A")
+    source = _orders(tmp_path, 2)
+    calls = []
+    monkeypatch.setattr(engine, "call_llm", lambda prompt, use_cache=True, role="stage": calls.append(prompt) or "ok")
+    engine.run_batch(source, "b2")
+    (tmp_path / "orders" / "o0.txt").write_text("指令0 改訂", encoding="utf-8")
+    calls.clear()
+    engine.run_batch(source, "b2")
+    assert len(calls) == 1 and "指令0 改訂" in calls[0]
+    _stage(dirs, "01_a.txt", "A2")
+    calls.clear()
+    engine.run_batch(source, "b2")
+    assert len(calls) == 2
+
+def test_batch_concurrency_is_shared_across_orders(tmp_path, dirs, monkeypatch):
+    _stage(dirs, "01_a.txt", "A")
+    _stage(dirs, "02_b.txt", "B")
+    source = _orders(tmp_path, 6)
+    lock, active, peak = threading.Lock(), [0], [0]
+    def fake_call_llm(prompt, use_cache=True, role="stage"):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        threading.Event().wait(0.02)
+        with lock: active[0] -= 1
+        return "ok"
+    monkeypatch.setattr(engine, "call_llm", fake_call_llm)
+    engine.run_batch(source, "b3", concurrency=3)
+    assert peak[0] == 3
+    assert sum(1 for r in engine.load_manifest(str(dirs["workspace"] / "batch" / "b3")).values() if r["status"] == "done") == 12
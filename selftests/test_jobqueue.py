@@ -0,0 +1,98 @@
+import time
+import threading
+
+import pytest
+
+import jobqueue
+
+def test_enqueue_coalesces_waiting_jobs_with_the_same_key():
+    first = jobqueue.enqueue("debate", "target.py", {"v": 1})
+    second = jobqueue.enqueue("debate", "target.py", {"v": 2})
+    assert first == second
+    job = jobqueue.claim("debate", "w1")
+    assert job["payload"] == {"v": 2} and job["attempts"] == 1
+    assert jobqueue.claim("debate", "w2") is None
+
+def test_claim_complete_round_trip():
+    job_id = jobqueue.enqueue("debate", "a", {"path": "a.py"})
+    job = jobqueue.claim("debate", "w1")
+    assert job["id"] == job_id and job["status"] == "running" and job["worker"] == "w1"
+    assert jobqueue.heartbeat(job_id, "w1")
+    assert jobqueue.complete(job_id, "w1")
+    assert jobqueue.jobs("debate", "done")[0]["id"] == job_id
+    # 実行中に同じキーを積むと、完了後にもう1回走る
+    jobqueue.enqueue("debate", "a", {"path": "a.py"})
+    assert jobqueue.claim("debate", "w1")["id"] != job_id
+
+def test_concurrent_workers_never_claim_the_same_job(monkeypatch):
+    monkeypatch.setattr(jobqueue, "MAX_RUNNING", 1000)
+    for i in range(40): jobqueue.enqueue("debate", f"t{i}", {"i": i})
+    claimed, lock = [], threading.Lock()
+    def worker(n):
+        while (job := jobqueue.claim("debate", f"w{n}")) is not None:
+            with lock: claimed.append(job["id"])
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(6)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len(claimed) == 40 and len(set(claimed)) == 40
+
+def test_max_running_caps_claims_across_queues(monkeypatch):
+    monkeypatch.setattr(jobqueue, "MAX_RUNNING", 1)
+    jobqueue.enqueue("debate", "a", {})
+    jobqueue.enqueue("philosophy", "b", {})
+    assert jobqueue.claim("debate", "w1") is not None
+    assert jobqueue.claim("philosophy", "w2") is None
+
+def test_expired_lease_is_reclaimed_and_the_old_owner_is_fenced(monkeypatch):
+    monkeypatch.setattr(jobqueue, "LEASE_SEC", 0.05)
+    job_id = jobqueue.enqueue("debate", "a", {})
+    assert jobqueue.claim("debate", "w1")["id"] == job_id
+    time.sleep(0.1)
+    job = jobqueue.claim("debate", "w2")
+    assert job["id"] == job_id and job["worker"] == "w2" and job["attempts"] == 2
+    assert not jobqueue.heartbeat(job_id, "w1")
+    assert not jobqueue.complete(job_id, "w1")
+    lease = jobqueue.Lease(job_id, "w1")
+    with jobqueue.holding(lease), pytest.raises(jobqueue.LeaseLost):
+        jobqueue.ensure_lease()
+    assert lease.cancelled.is_set()
+    # 回収した側の貸出は有効なまま
+    with jobqueue.holding(jobqueue.Lease(job_id, "w2")): jobqueue.ensure_lease()
+    assert jobqueue.complete(job_id, "w2")
+
+def test_ensure_lease_is_a_no_op_outside_the_queue():
+    jobqueue.ensure_lease()
+
+def test_failures_retry_with_backoff_then_fail(monkeypatch):
+    monkeypatch.setattr(jobqueue, "MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(jobqueue, "RETRY_BACKOFF_SEC", 0)
+    job_id = jobqueue.enqueue("debate", "a", {})
+    jobqueue.claim("debate", "w1")
+    assert jobqueue.fail(job_id, "w1", "boom") == "retry"
+    jobqueue.claim("debate", "w1")
+    assert jobqueue.fail(job_id, "w1", "boom") == "failed"
+    assert jobqueue.claim("debate", "w1") is None
+    assert jobqueue.retry(job_id)
+    assert jobqueue.claim("debate", "w1")["attempts"] == 1
+
+def test_serve_stops_a_handler_whose_lease_was_reclaimed(monkeypatch):
+    monkeypatch.setattr(jobqueue, "POLL_SEC", 0.01)
+    job_id = jobqueue.enqueue("debate", "a", {})
+    stop, seen = threading.Event(), []
+    def handler(payload, lease):
+        # 別のワーカーが回収したことにして、次の書き込み前の確認で打ち切られるか
+        with jobqueue._transaction() as conn:
+            conn.execute("UPDATE jobs SET worker = 'other' WHERE id = ?", (job_id,))
+        try:
+            jobqueue.ensure_lease()
+        except jobqueue.LeaseLost:
+            seen.append("lost")
+            stop.set()
+            raise
+        seen.append("wrote")
+    thread = threading.Thread(target=jobqueue.serve, args=("debate", handler), kwargs={"stop": stop}, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert seen == ["lost"]
+    job = jobqueue.jobs("debate")[0]
+    assert job["status"] == "running" and job["worker"] == "other" and job["error"] is None
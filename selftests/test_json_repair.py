@@ -0,0 +1,64 @@
+import json
+import random
+
+import pytest
+
+import json_repair
+
+STATE = {"thought_process": "考える", "artifact": "line1\nline2 \"quoted\"", "l1_memory": "", "next_stage": "END"}
+
+def test_valid_json_round_trips_without_repairs():
+    rng = random.Random(0)
+    for _ in range(50):
+        value = {f"k{i}": rng.choice([rng.random(), "改行\nあり", [1, {"x": None}], True]) for i in range(rng.randint(0, 6))}
+        assert json_repair.loads(json.dumps(value, ensure_ascii=False)) == (value, [])
+
+@pytest.mark.parametrize("text, note", [
+    ("```json\n" + json.dumps(STATE, ensure_ascii=False) + "\n```", "フェンス除去"),
+    ("以下が出力です。\n" + json.dumps(STATE, ensure_ascii=False), "前置きの地の文"),
+    (json.dumps(STATE, ensure_ascii=False) + "\n以上です。", "後続の地の文"),
+    (json.dumps(STATE, ensure_ascii=False)[:-1] + ",}", "余分なカンマ"),
+    (json.dumps(STATE, ensure_ascii=False).replace("\\n", "\n"), "文字列内の改行"),
+])
+def test_common_breakage_is_repaired_locally(text, note):
+    value, notes = json_repair.loads(text)
+    assert value == STATE
+    assert note in notes
+
+def test_missing_closers_are_completed():
+    value, notes = json_repair.loads('{"a": [1, 2, {"b": "c"')
+    assert value == {"a": [1, 2, {"b": "c"}]}
+    assert "閉じ括弧の補完" in notes
+
+def test_dangling_key_is_dropped():
+    value, _ = json_repair.loads('{"a": 1, "b":')
+    assert value == {"a": 1}
+
+@pytest.mark.parametrize("text", ['{"a": "途切れた文字列', "JSON ではない応答", ""])
+def test_unrepairable_text_raises_the_original_error(text):
+    with pytest.raises(json.JSONDecodeError):
+        json_repair.loads(text)
+
+def test_call_llm_json_drops_a_rejected_schema_and_repairs_locally(tmp_path, monkeypatch):
+    import archive
+    import llm_client
+    import universal_agent_engine as uae
+    monkeypatch.setattr(uae, "STRUCTURED_OUTPUT", "on")
+    monkeypatch.setattr(uae, "_SCHEMA_UNSUPPORTED", set())
+    configs = []
+    class Response:
+        text = '```json\n{"artifact": "本文", "next_stage": "END",}\n```'
+        usage_metadata = None
+    def generate(model, contents, config=None, timeout=None, hedge=False):
+        configs.append(config)
+        if config is not None: raise RuntimeError("400 INVALID_ARGUMENT: response_schema is not supported")
+        return Response()
+    monkeypatch.setattr(llm_client, "generate", generate)
+    schema = uae._object_schema("artifact", "next_stage")
+    run_dir = tmp_path / "run-x"
+    run_dir.mkdir()
+    result = uae.call_llm_json("prompt", str(run_dir), "step1_01_a.txt", use_cache=False, schema=schema)
+    assert result == {"artifact": "本文", "next_stage": "END"}
+    assert configs[0]["response_schema"] == schema and configs[1] is None
+    assert uae._json_config(schema, uae.model_router.model_for("step1_01_a.txt")) is None
+    assert [r["status"] for r in archive.query(run="run-x")] == ["repaired"]
@@ -0,0 +1,74 @@
+import hashlib
+import threading
+import multiprocessing
+
+import pytest
+
+import ledger
+import lesson_store
+
+def test_update_search_and_export_round_trip(tmp_path):
+    path = str(tmp_path / "lessons_test.json")
+    assert lesson_store.update(path, ["Always validate JSON before saving", "キャッシュは内容のハッシュで引く"]) == (2, 0, 0)
+    # ほぼ同じ教訓は追加しない
+    assert lesson_store.update(path, ["Always validate JSON before saving."]) == (0, 1, 0)
+    assert lesson_store.search(path, "cache hash キャッシュ", k=1)[0]["text"] == "キャッシュは内容のハッシュで引く"
+    assert lesson_store.update(path, retired=[1]) == (0, 0, 1)
+    md = tmp_path / "l2.md"
+    lesson_store.export_markdown(path, str(md))
+    assert lesson_store.parse_items(md.read_text(encoding="utf-8")) == ["[L2] キャッシュは内容のハッシュで引く"]
+    # 台帳には差分が残る
+    assert ledger.state_at()["l2"] == {"lessons_test": {"2": "キャッシュは内容のハッシュで引く"}}
+
+def _texts(path):
+    """ストアに残っている全教訓（新しい順）"""
+    return [l["text"] for l in sorted(lesson_store._load(path)[0]["lessons"], key=lambda l: -l["added"])]
+
+def test_search_returns_only_lessons_that_match(tmp_path):
+    path = str(tmp_path / "lessons_match.json")
+    lesson_store.update(path, ["Always validate JSON before saving", "Retry only idempotent calls", "Prefer small diffs"])
+    assert [l["text"] for l in lesson_store.search(path, "validate the json", k=5)] == ["Always validate JSON before saving"]
+    # 1語も当たらなければ、無関係な教訓で埋めずに空を返す
+    assert lesson_store.search(path, "量子色力学", k=5) == []
+    assert lesson_store.search(path, "", k=5) == []
+
+def test_max_lessons_evicts_the_stalest(tmp_path, monkeypatch):
+    monkeypatch.setattr(lesson_store, "MAX_LESSONS", 3)
+    path = str(tmp_path / "lessons_cap.json")
+    for text in ["alpha rule one", "beta rule two", "gamma rule three", "delta rule four"]:
+        lesson_store.update(path, [text])
+    assert _texts(path) == ["delta rule four", "gamma rule three", "beta rule two"]
+
+def test_migrate_imports_the_old_markdown_once(tmp_path):
+    path, md = str(tmp_path / "lessons_old.json"), tmp_path / "core_lessons.md"
+    md.write_text("- 入力を検証する\n- 出力を小さく保つ\n本文ではない行\n", encoding="utf-8")
+    lesson_store.migrate(path, str(md))
+    lesson_store.migrate(path, str(md))
+    assert sorted(_texts(path)) == sorted(["入力を検証する", "出力を小さく保つ"])
+
+def _distinct(seed):
+    """重複判定に掛からない、互いに似ていない教訓の本文"""
+    return hashlib.sha256(seed.encode()).hexdigest()
+
+def test_concurrent_updates_from_threads_are_all_kept(tmp_path):
+    path = str(tmp_path / "lessons_threads.json")
+    def worker(n):
+        for i in range(10): lesson_store.update(path, [_distinct(f"thread{n}-{i}")])
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len(_texts(path)) == 40
+
+def _update_from_child(path, n):
+    for i in range(10): lesson_store.update(path, [_distinct(f"process{n}-{i}")])
+
+@pytest.mark.skipif(lesson_store.fcntl is None, reason="プロセス間ロックには fcntl が必要")
+def test_concurrent_updates_from_processes_are_all_kept(tmp_path):
+    path = str(tmp_path / "lessons_procs.json")
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_update_from_child, args=(path, n)) for n in range(3)]
+    for p in procs: p.start()
+    for p in procs: p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    lesson_store._loaded.clear()
+    assert len(_texts(path)) == 30
@@ -0,0 +1,65 @@
+import os
+import threading
+
+import pytest
+
+import llm_cache
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    root = tmp_path / "llm_cache"
+    monkeypatch.setattr(llm_cache, "CACHE_DIR", str(root))
+    monkeypatch.setattr(llm_cache, "INDEX_FILE", str(root / "index.json"))
+    monkeypatch.setattr(llm_cache, "LOCK_FILE", str(root / "index.lock"))
+    monkeypatch.setattr(llm_cache, "ENABLED", True)
+    monkeypatch.setattr(llm_cache, "STATS", {"hits": 0, "misses": 0, "bypass": 0, "evictions": 0})
+    monkeypatch.setattr(llm_cache, "_unflushed", {})
+    return root
+
+def test_key_covers_model_prompt_and_config():
+    keys = {llm_cache.make_key("m", "p"), llm_cache.make_key("m2", "p"), llm_cache.make_key("m", "p2"),
+            llm_cache.make_key("m", "p", {"schema": 1})}
+    assert len(keys) == 4
+    assert llm_cache.make_key("m", "p", {"a": 1, "b": 2}) == llm_cache.make_key("m", "p", {"b": 2, "a": 1})
+
+def test_put_get_and_file_round_trips(tmp_path):
+    key = llm_cache.make_key("m", "p")
+    assert llm_cache.get(key) is None
+    llm_cache.put(key, "応答")
+    assert llm_cache.get(key) == "応答"
+    src, dest = tmp_path / "stream.txt", tmp_path / "out.txt"
+    src.write_text("チャンク" * 100, encoding="utf-8")
+    llm_cache.put_file("f" * 64, str(src))
+    assert llm_cache.copy_to("f" * 64, str(dest)) and dest.read_text(encoding="utf-8") == "チャンク" * 100
+    assert not llm_cache.copy_to("e" * 64, str(tmp_path / "none.txt"))
+    assert llm_cache.STATS["hits"] == 2 and llm_cache.STATS["misses"] == 2
+
+def test_eviction_drops_the_least_recently_used_entry(monkeypatch):
+    monkeypatch.setattr(llm_cache, "MAX_BYTES", 250)
+    keys = [c * 64 for c in "abc"]
+    for n, key in enumerate(keys[:2]):
+        llm_cache.put(key, "x" * 100)
+        os.utime(llm_cache._entry_path(key), (1000 + n, 1000 + n))
+    # 古い方でも参照されれば最終利用時刻が進み、退避されるのはもう一方になる
+    assert llm_cache.get(keys[0]) is not None
+    llm_cache.put(keys[2], "y" * 100)
+    assert llm_cache.get(keys[1]) is None
+    assert llm_cache.get(keys[0]) and llm_cache.get(keys[2])
+    stats = llm_cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["process"]["evictions"]) == (2, 200, 1)
+
+def test_counters_are_exact_under_threads():
+    def worker():
+        for _ in range(500):
+            llm_cache.note_bypass()
+            llm_cache.get("0" * 64)
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert llm_cache.STATS["bypass"] == 4000 and llm_cache.STATS["misses"] == 4000
+    assert llm_cache.stats()["total"]["misses"] == 4000
+
+def test_disabled_cache_neither_reads_nor_writes(monkeypatch, cache_dir):
+    monkeypatch.setattr(llm_cache, "ENABLED", False)
+    llm_cache.put("a" * 64, "x")
+    assert llm_cache.get("a" * 64) is None and not cache_dir.exists()
@@ -0,0 +1,89 @@
+import sys
+import types
+
+import pytest
+
+pytest.importorskip("dotenv")
+import llm_client  # noqa: E402
+
+class _Typed:
+    """pydantic のモデルと同じく model_copy(update=...) で複製できる設定"""
+    def __init__(self, **fields): self.__dict__.update(fields)
+    def model_copy(self, update=None): return _Typed(**{**self.__dict__, **(update or {})})
+
+@pytest.fixture
+def fake_types(monkeypatch):
+    module = types.ModuleType("google.genai.types")
+    module.HttpOptions = _Typed
+    genai = types.ModuleType("google.genai")
+    genai.types = module
+    monkeypatch.setitem(sys.modules, "google.genai", genai)
+    monkeypatch.setitem(sys.modules, "google.genai.types", module)
+    return module
+
+def test_dict_config_keeps_its_fields_and_gets_the_http_timeout():
+    config, bounded = llm_client._with_timeout({"temperature": 0, "http_options": {"headers": {"a": "b"}}}, 10, 0)
+    assert bounded
+    assert config == {"temperature": 0, "http_options": {"headers": {"a": "b"}, "timeout": 10000}}
+    assert llm_client._with_timeout(None, None) == (None, True)
+
+def test_typed_config_gets_the_http_timeout(fake_types):
+    config, bounded = llm_client._with_timeout(_Typed(temperature=0, http_options=None), 10, 5)
+    assert bounded and config.temperature == 0 and config.http_options.timeout == 15000
+    config, _ = llm_client._with_timeout(_Typed(http_options=_Typed(headers={"a": "b"})), 10, 0)
+    assert (config.http_options.headers, config.http_options.timeout) == ({"a": "b"}, 10000)
+
+def test_config_without_a_timeout_slot_falls_back_to_the_watched_path(monkeypatch):
+    config = object()
+    assert llm_client._with_timeout(config, 10) == (config, False)
+    paths = []
+    monkeypatch.setattr(llm_client, "_direct", lambda *a: paths.append("direct"))
+    monkeypatch.setattr(llm_client, "_race", lambda *a: paths.append("race"))
+    monkeypatch.setattr(llm_client.deadline, "watched", lambda: False)
+    llm_client.generate("m", "p", config=config, timeout=10)
+    llm_client.generate("m", "p", config={}, timeout=10)
+    assert paths == ["race", "direct"]
+
+class _Meter:
+    def __init__(self): self.model, self.attempts, self.sleep_s, self.failed = "m", 0, 0.0, None
+    def fail(self, error): self.failed = str(error)
+
+def _sequence(*outcomes):
+    outcomes = list(outcomes)
+    def send(model, timeout, hedge):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception): raise outcome
+        return outcome
+    return send
+
+def test_timeouts_pause_locally_and_429_backs_off_through_the_shared_state(monkeypatch):
+    pauses, backoffs = [], []
+    monkeypatch.setattr(llm_client.deadline, "retry_pause", lambda attempt: pauses.append(attempt) or 0.5)
+    monkeypatch.setattr(llm_client.rate_limiter, "backoff", lambda model, e, attempt: backoffs.append(attempt) or 2.0)
+    meter = _Meter()
+    send = _sequence(llm_client.deadline.DeadlineExceeded("slow"), RuntimeError("429 RESOURCE_EXHAUSTED"), "ok")
+    assert llm_client.with_retries("r", meter, send) == "ok"
+    assert (pauses, backoffs, meter.attempts, meter.sleep_s) == ([0], [1], 3, 2.5)
+
+def test_exhausted_timeouts_raise_a_deadline_error_and_other_errors_are_not_retried(monkeypatch):
+    monkeypatch.setattr(llm_client.deadline, "retry_pause", lambda attempt: 0.0)
+    meter = _Meter()
+    with pytest.raises(llm_client.deadline.DeadlineExceeded):
+        llm_client.with_retries("r", meter, _sequence(*[llm_client.deadline.DeadlineExceeded("slow")] * 3))
+    assert meter.attempts == 3 and meter.failed
+    meter = _Meter()
+    with pytest.raises(KeyError):
+        llm_client.with_retries("r", meter, _sequence(KeyError("x"), "unused"))
+    assert meter.attempts == 1
+
+def test_on_error_retries_immediately_and_sees_the_escalated_model():
+    meter, seen = _Meter(), []
+    def send(model, timeout, hedge):
+        seen.append(model)
+        if len(seen) == 1: raise ValueError("bad json")
+        return model
+    def on_error(e, attempt):
+        meter.model = "stronger"
+        return True
+    assert llm_client.with_retries("r", meter, send, on_error) == "stronger"
+    assert seen == ["m", "stronger"]
@@ -0,0 +1,40 @@
+import pytest
+
+import model_router
+
+@pytest.fixture(autouse=True)
+def tiers(monkeypatch):
+    monkeypatch.setattr(model_router, "TIER_MODELS", {"fast": "m-fast", "standard": "m-std", "strong": "m-strong"})
+    monkeypatch.setattr(model_router, "DOUBLE_CHECK", {"Reviewer": {"ABORT"}})
+
+def test_routes_pick_the_first_matching_rule(monkeypatch):
+    monkeypatch.setattr(model_router, "ROUTES", model_router._parse_rules("step*_02_*=strong,Reviewer=fast,*=standard"))
+    assert model_router.model_for("step3_02_refine.txt") == "m-strong"
+    assert model_router.model_for("Reviewer") == "m-fast"
+    assert model_router.model_for("anything") == "m-std"
+
+def test_escalate_walks_up_the_tiers_and_stops_at_the_top():
+    assert model_router.escalate("r", "m-fast", "x") == "m-std"
+    assert model_router.escalate("r", "m-std", "x") == "m-strong"
+    assert model_router.escalate("r", "m-strong", "x") is None
+
+def test_status_lines_are_always_checked_but_verdicts_only_once():
+    assert model_router.check("Reviewer", "判定: DONE\n本文").startswith("判定行が不正")
+    assert model_router.check("Reviewer", "[STATUS: DONE]\n本文") is None
+    assert model_router.check("Reviewer", "[STATUS: ABORT]\n本文") == "ABORT 判定の二重確認"
+    assert model_router.check("Reviewer", "[STATUS: ABORT]\n本文", double_check=False) is None
+    assert model_router.check("Reviewer", "壊れた", double_check=False).startswith("判定行が不正")
+    assert model_router.check("Architect", "anything") is None
+
+@pytest.mark.parametrize("factory_name", ["debate_factory", "philosophy_factory"])
+def test_an_escalated_abort_is_final(factory_name, monkeypatch):
+    factory = pytest.importorskip(factory_name)
+    monkeypatch.setattr(model_router, "ROUTES", [("Reviewer", "fast")])
+    models = []
+    def fake_generate(prompt, role, model, use_cache=True):
+        models.append(model)
+        return "[STATUS: ABORT]\n打ち切り"
+    monkeypatch.setattr(factory, "_generate", fake_generate)
+    assert factory.call_ai("p", "Reviewer") == "[STATUS: ABORT]\n打ち切り"
+    # 開始段の ABORT を1段上で確かめ、その答えで確定する（最上段まで登り続けない）
+    assert models == ["m-fast", "m-std"]
@@ -0,0 +1,74 @@
+import multiprocessing
+
+import pytest
+
+import rate_limiter
+
+class _Clock:
+    """time.time / time.sleep の代わり。sleep は時刻を進めるだけ"""
+    def __init__(self): self.now, self.slept = 1000.0, []
+    def time(self): return self.now
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    monkeypatch.setattr(rate_limiter, "MODEL_LIMITS", {"m": (2, 1000)})
+    monkeypatch.setattr(rate_limiter, "KEY_COUNT", 1)
+    return clock
+
+def test_acquire_spends_the_bucket_then_waits_for_refill(clock):
+    assert rate_limiter.acquire("m", 10) == 0.0
+    assert rate_limiter.acquire("m", 10) == 0.0
+    # 2 RPM: 3本目は 1リクエスト分（30秒）補充されるまで待つ
+    waited = rate_limiter.acquire("m", 10)
+    assert 30.0 <= waited <= 30.25
+
+def test_tokens_per_minute_limit_the_rate_and_settle_corrects_the_estimate(clock):
+    assert rate_limiter.acquire("m", 900) == 0.0
+    assert not rate_limiter.try_acquire("m", 200)
+    # 実際は 100 トークンだったので、800 トークン分が戻る
+    rate_limiter.settle("m", 900, 100)
+    assert rate_limiter.try_acquire("m", 800)
+
+def test_backoff_honours_retry_after_and_blocks_every_caller(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda a, b: a)
+    error = RuntimeError("429 RESOURCE_EXHAUSTED {'retryDelay': '12s'}")
+    assert rate_limiter.is_rate_limited(error) and rate_limiter.retry_after(error) == 12.0
+    assert rate_limiter.backoff("m", error, 0) == 12.0 and clock.slept == [12.0]
+    # 同じ瞬間に送ろうとした別の呼び出し元も、待機期間が明けて枠が戻るまで待たされる
+    clock.now -= 12
+    assert not rate_limiter.try_acquire("m", 1)
+    assert rate_limiter.acquire("m", 1) >= 30.0
+
+def test_backoff_without_a_hint_grows_exponentially_up_to_the_cap(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter.random, "uniform", lambda a, b: b)
+    error = RuntimeError("429 Too Many Requests")
+    assert [rate_limiter.backoff("m", error, n) for n in range(6)] == [4.0, 8.0, 16.0, 32.0, 60.0, 60.0]
+
+def test_retry_after_header_wins_over_the_message():
+    class Response:
+        headers = {"retry-after": "3"}
+    error = RuntimeError("429 retryDelay: 40")
+    error.response = Response()
+    assert rate_limiter.retry_after(error) == 3.0
+    assert rate_limiter.retry_after(RuntimeError("500 internal")) is None
+
+def _acquire_from_child(n):
+    for _ in range(n): rate_limiter.try_acquire("shared", 1)
+
+@pytest.mark.skipif(rate_limiter.fcntl is None, reason="プロセス間ロックには fcntl が必要")
+def test_buckets_are_shared_across_processes(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "MODEL_LIMITS", {"shared": (200, 10 ** 6)})
+    monkeypatch.setattr(rate_limiter, "KEY_COUNT", 1)
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_acquire_from_child, args=(50,)) for _ in range(3)]
+    for p in procs: p.start()
+    for p in procs: p.join()
+    assert all(p.exitcode == 0 for p in procs)
+    with rate_limiter._locked_state() as state:
+        # 取りこぼし（上書き）があれば 150回分より少なく差し引かれる。補充は1秒で 3.3回分
+        assert 50 <= state["shared"]["req"] < 55
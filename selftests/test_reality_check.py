@@ -0,0 +1,53 @@
+import pytest
+
+import reality_check
+
+@pytest.fixture(autouse=True)
+def fresh_results(monkeypatch):
+    monkeypatch.setattr(reality_check, "_results", {})
+
+def _write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+def test_syntax_and_data_formats(tmp_path):
+    assert reality_check.run(_write(tmp_path, "ok.py", "x = 1\n")) == "PASS (Syntax OK)"
+    result = reality_check.run(_write(tmp_path, "bad.py", "def f(:\n"))
+    assert result.startswith("FAIL (Syntax Error):") and "SyntaxError" in result
+    assert reality_check.run(_write(tmp_path, "ok.json", '{"a": 1}')) == "PASS (JSON OK)"
+    assert reality_check.run(_write(tmp_path, "bad.json", '{"a": }')).startswith("FAIL (JSON Error)")
+    assert reality_check.run(_write(tmp_path, "notes.md", "# x")) == "UNKNOWN_EXT (.md)"
+
+def test_results_are_cached_by_content(tmp_path, monkeypatch):
+    calls = []
+    def counting(source, context):
+        calls.append(context["path"])
+        return True, "Counted", ""
+    monkeypatch.setitem(reality_check.CHECKS, ".txt", [counting])
+    (tmp_path / "v2").mkdir()
+    first = _write(tmp_path, "a.txt", "same")
+    # 同じモジュールの同じ内容なら、別の世代のパスでも検証し直さない
+    assert reality_check.run(first) == reality_check.run(_write(tmp_path / "v2", "a.txt", "same")) == "PASS (Counted)"
+    reality_check.run(_write(tmp_path, "a.txt", "changed"))
+    assert len(calls) == 2
+
+def test_heavy_checks_are_skipped_after_a_failure(tmp_path, monkeypatch):
+    ran = []
+    monkeypatch.setitem(reality_check.CHECKS, ".txt", [lambda s, c: (False, "First", "bad"),
+                                                       lambda s, c: ran.append(1) or (True, "Second", "")])
+    assert reality_check.run(_write(tmp_path, "x.txt", "x")) == "FAIL (First):\nbad"
+    assert ran == []
+
+def test_target_tests_run_against_the_generated_module(tmp_path, monkeypatch):
+    monkeypatch.setattr(reality_check, "RUN_PYTEST", True)
+    tests = tmp_path / "tests"
+    tests.mkdir()
+    (tests / "test_calc.py").write_text("import calc\n\ndef test_add():\n    assert calc.add(1, 2) == 3\n", encoding="utf-8")
+    try:
+        passed = reality_check.run(_write(tmp_path, "calc_v2.py", "def add(a, b):\n    return a + b\n"), "calc", [str(tests)])
+        failed = reality_check.run(_write(tmp_path, "calc_v3.py", "def add(a, b):\n    return a - b\n"), "calc", [str(tests)])
+    finally:
+        reality_check._reset_pool()
+    assert passed.startswith("PASS (Syntax OK, pytest 1 passed")
+    assert failed.startswith("FAIL (pytest 1 failed")
@@ -0,0 +1,30 @@
+import review_diff
+from rate_limiter import estimate_tokens
+
+def _module(n):
+    return "".join(f"def f{i}(x):\n    y = x + {i}\n    return y\n\n" for i in range(n))
+
+def test_identical_generations_have_no_diff():
+    assert review_diff.build("a\nb\n", "a\nb\n", ".md") == "（差分なし: 前世代と同一）"
+
+def test_hunks_are_labelled_with_the_enclosing_function():
+    prev = "class A:\n" + "".join(f"    def m{i}(self):\n        return {i}\n\n" for i in range(20))
+    new = prev.replace("return 15", "return -15")
+    text = review_diff.build(prev, new, ".py")
+    assert text.startswith("--- 前世代\n+++ 今回生成")
+    hunk_headers = [l for l in text.splitlines() if l.startswith("@@")]
+    assert len(hunk_headers) == 1 and hunk_headers[0].endswith("class A.def m15")
+    assert "-        return 15" in text and "+        return -15" in text
+    assert "return 3" not in text
+
+def test_rewrites_fall_back_to_the_full_text():
+    text = review_diff.build("old\n", "completely\nnew\ncontent\n", ".md")
+    assert text.startswith("（差分がファイル本体より大きいため") and text.endswith("completely\nnew\ncontent\n")
+
+def test_hunks_past_the_token_budget_are_dropped():
+    prev = _module(200)
+    new = prev
+    for i in range(0, 200, 10): new = new.replace(f"x + {i}\n", f"x - {i}\n")
+    text = review_diff.build(prev, new, ".py", budget=300)
+    assert estimate_tokens(text) <= 360
+    assert "トークン予算 300 超過のため残り" in text
@@ -0,0 +1,67 @@
+import json
+
+import archive
+import telemetry
+
+class _Usage:
+    prompt_token_count, candidates_token_count = 120, 30
+
+class _Response:
+    usage_metadata = _Usage()
+
+def _events(run_dir):
+    return [json.loads(l) for l in (run_dir / "calls.jsonl").read_text(encoding="utf-8").splitlines()]
+
+def test_calls_are_recorded_per_role_and_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ENABLED", False)
+    run_dir = tmp_path / "runs" / "r1"
+    telemetry.start_run("engine", run_id="r1")
+    meter = telemetry.CallMeter("architect", "m-small", 100)
+    meter.attempts, meter.sleep_s = 3, 4.5
+    meter.done(_Response(), "応答")
+    telemetry.CallMeter("architect", "m-small", 50).done(response_text="cached", cached=True)
+    failing = telemetry.CallMeter("reviewer", "m-large", 10)
+    failing.attempts = 1
+    failing.fail(RuntimeError("boom"))
+    telemetry.escalation("architect", "m-small", "m-large", "壊れたJSON")
+    totals = telemetry.finish_run()
+    assert (totals["calls"], totals["cached"], totals["errors"], totals["escalations"]) == (3, 1, 1, 1)
+    assert (totals["prompt_tokens"], totals["response_tokens"], totals["attempts"], totals["sleep_s"]) == (180, 32, 4, 4.5)
+    events = _events(run_dir)
+    assert [e.get("event") or e["role"] for e in events] == ["architect", "architect", "reviewer", "escalation"]
+    assert events[2]["error"] == "boom"
+    summary = json.loads((run_dir / "summary.json").read_text(encoding="utf-8"))
+    assert {(s["role"], s["model"]) for s in summary["roles"]} == {("architect", "m-small"), ("reviewer", "m-large")}
+
+def test_retries_count_resends_not_calls(monkeypatch):
+    monkeypatch.setattr(telemetry, "_retries", 0)
+    for attempts in (1, 3, 2): telemetry.record("r", "m", 1, 1, 0.1, attempts, 0.0)
+    assert telemetry.retries() == 3
+
+def test_prometheus_textfile_is_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ENABLED", False)
+    prom = tmp_path / "llm.prom"
+    monkeypatch.setattr(telemetry, "PROM_FILE", str(prom))
+    telemetry.start_run('eng"ine', run_id="r2")
+    telemetry.record("stage", "m", 10, 5, 0.5, 1, 0.0)
+    telemetry.finish_run()
+    text = prom.read_text(encoding="utf-8")
+    assert 'mechwolf_llm_calls_total{engine="eng\\"ine",role="stage",model="m"} 1' in text
+
+def test_finished_runs_move_into_the_archive(tmp_path, monkeypatch):
+    monkeypatch.setattr(archive, "ENABLED", True)
+    telemetry.start_run("engine", run_id="r3")
+    telemetry.record("stage", "m", 10, 5, 0.5, 1, 0.0)
+    telemetry.finish_run()
+    assert not (tmp_path / "runs" / "r3").exists()
+    assert sorted(r["name"] for r in archive.query(run="r3")) == ["calls.jsonl", "summary.json"]
+    # 閉じた run には追記しない: 次の呼び出しは新しい run に記録される
+    telemetry.record("stage", "m", 10, 5, 0.5, 1, 0.0)
+    assert telemetry._run["id"] != "r3"
+
+def test_disabled_telemetry_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry, "ENABLED", False)
+    telemetry.start_run("engine", run_id="r4")
+    telemetry.record("stage", "m", 10, 5, 0.5, 2, 0.0)
+    assert telemetry.finish_run()["calls"] == 0
+    assert not (tmp_path / "runs").exists()
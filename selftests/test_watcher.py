@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("watchdog")
+from watchdog.events import DirModifiedEvent, FileCreatedEvent, FileModifiedEvent, FileMovedEvent  # noqa: E402
+
+import watcher  # noqa: E402
+
+@pytest.fixture
+def make_watcher(tmp_path):
+    started = []
+    def make(callback, **kwargs):
+        w = watcher.OrderWatcher(str(tmp_path), callback, ignore_dirs=[str(tmp_path / "workspace"), str(tmp_path / "reviews")],
+                                 debounce=0.05, **kwargs).start()
+        started.append(w)
+        return w
+    yield make
+    for w in started: w.stop()
+
+def _wait_until(predicate, timeout=3.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if predicate(): return True
+        time.sleep(0.01)
+    return predicate()
+
+def test_a_burst_of_events_runs_once(tmp_path, make_watcher):
+    runs = []
+    w = make_watcher(lambda: runs.append(threading.current_thread().name))
+    order = str(tmp_path / "order" / "a" / "order.txt")
+    for _ in range(5):
+        w.on_any_event(FileModifiedEvent(order))
+        time.sleep(0.01)
+    w.on_any_event(FileMovedEvent(str(tmp_path / "order" / "a" / ".order.txt.swp"), order))
+    assert _wait_until(lambda: runs)
+    time.sleep(0.2)
+    # 実行は Observer ではなく作業用スレッドで
+    assert runs == ["order-worker"]
+
+def test_own_writes_and_other_files_are_ignored(tmp_path, make_watcher):
+    runs = []
+    w = make_watcher(lambda: runs.append(1))
+    for path in (tmp_path / "workspace" / "order.txt", tmp_path / "reviews" / "order.txt",
+                 tmp_path / ".llm_cache" / "order.txt", tmp_path / "order" / "notes.txt"):
+        w.on_any_event(FileModifiedEvent(str(path)))
+    w.on_any_event(DirModifiedEvent(str(tmp_path / "order")))
+    time.sleep(0.2)
+    assert runs == []
+    w.on_any_event(FileCreatedEvent(str(tmp_path / "order.txt")))
+    assert _wait_until(lambda: runs == [1])
+
+def test_events_during_a_run_coalesce_into_one_more_run(tmp_path, make_watcher):
+    release, runs = threading.Event(), []
+    def callback():
+        runs.append(1)
+        release.wait(3)
+    w = make_watcher(callback)
+    w.trigger()
+    assert _wait_until(lambda: runs == [1])
+    # 実行中の変更は何回来ても「次の1回」にまとめられ、呼び出し側は塞がれない
+    started = time.monotonic()
+    for _ in range(5): w.trigger()
+    assert time.monotonic() - started < 0.5
+    release.set()
+    assert _wait_until(lambda: runs == [1, 1])
+    time.sleep(0.2)
+    assert runs == [1, 1]
+
+def test_callback_errors_do_not_stop_the_worker(make_watcher):
+    runs = []
+    def callback():
+        runs.append(1)
+        if len(runs) == 1: raise RuntimeError("boom")
+    w = make_watcher(callback)
+    w.trigger()
+    assert _wait_until(lambda: runs == [1])
+    w.trigger()
+    assert _wait_until(lambda: runs == [1, 1])
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import atexit
+import threading
+from datetime import datetime
+import archive
+
+# ---------------------------------------------------------
+# 1. 計測の基盤（全LLMラッパー共通の呼び出しイベントと実行サマリ）
+#    runs/<id>/calls.jsonl   : 1呼び出し = 1行のイベント
+#    runs/<id>/summary.json  : ロール別の集計（呼び出し数・トークン・遅延・リトライ・待機）
+#    TELEMETRY_PROM_FILE     : 指定すれば Prometheus textfile 形式でも書き出す
+#    アーカイブが有効なら、run の終了時に runs/<id>/ ごとアーカイブへ移す（実行中だけ追記先のファイルを持つ）
+# ---------------------------------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNS_DIR = os.getenv("TELEMETRY_DIR") or os.path.join(BASE_DIR, "runs")
+PROM_FILE = os.getenv("TELEMETRY_PROM_FILE")
+ENABLED = os.getenv("TELEMETRY", "1") != "0"
+
+_lock = threading.RLock()
+_run = None
+_retries = 0  # このプロセスで送り直した回数（全 run の合計。期限切れ・429・壊れたJSON・昇格の再送）
+
+def start_run(engine, run_id=None, run_dir=None):
+    """実行単位（run）を開始する。以後の record() はこの run に記録される"""
+    global _run
+    # 同じ秒に複数プロセスが走っても run が混ざらないよう PID を付ける
+    run_id = run_id or f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    run_dir = run_dir or os.path.join(RUNS_DIR, run_id)
+    if ENABLED: os.makedirs(run_dir, exist_ok=True)
+    with _lock:
+        if _run: _write_summary(_run)
+        _run = {"engine": engine, "id": run_id, "dir": run_dir, "started": time.time(), "roles": {}}
+    return run_dir
+
+def _ensure_run():
+    if _run is None: start_run("adhoc")
+    return _run
+
+def _role_stats(run, role, model):
+    key = f"{role}|{model}"
+    return run["roles"].setdefault(key, {"role": role, "model": model, "calls": 0, "errors": 0, "cached": 0,
+                                         "prompt_tokens": 0, "response_tokens": 0, "latency_s": 0.0,
+                                         "latency_max_s": 0.0, "attempts": 0, "sleep_s": 0.0, "escalations": 0})
+
+def record(role, model, prompt_tokens, response_tokens, latency, attempts, sleep_s, cached=False, error=None, **extra):
+    """1回のLLM呼び出しをイベントとして追記し、ロール別の集計を更新する"""
+    global _retries
+    with _lock: _retries += max(0, attempts - 1)
+    if not ENABLED: return
+    event = {"ts": round(time.time(), 3), "role": role, "model": model, "prompt_tokens": prompt_tokens,
+             "response_tokens": response_tokens, "latency_s": round(latency, 3), "attempts": attempts,
+             "sleep_s": round(sleep_s, 3), "cached": cached, "error": error, **extra}
+    with _lock:
+        run = _ensure_run()
+        with open(os.path.join(run["dir"], "calls.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        s = _role_stats(run, role, model)
+        s["calls"] += 1
+        s["errors"] += 1 if error else 0
+        s["cached"] += 1 if cached else 0
+        s["prompt_tokens"] += prompt_tokens or 0
+        s["response_tokens"] += response_tokens or 0
+        s["latency_s"] += latency
+        s["latency_max_s"] = max(s["latency_max_s"], latency)
+        s["attempts"] += attempts
+        s["sleep_s"] += sleep_s
+
+def escalation(role, model, to_model, reason):
+    """安いモデルの出力を強いモデルでやり直した記録（昇格元のロール・モデルに数える）"""
+    if not ENABLED: return
+    event = {"ts": round(time.time(), 3), "event": "escalation", "role": role, "model": model,
+             "to_model": to_model, "reason": reason}
+    with _lock:
+        run = _ensure_run()
+        with open(os.path.join(run["dir"], "calls.jsonl"), "a", encoding="utf-8") as f:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        _role_stats(run, role, model)["escalations"] += 1
+
+class CallMeter:
+    """ラッパー内で1呼び出し分の試行回数・待機秒数・経過時間を数え、最後に record() する"""
+    def __init__(self, role, model, prompt_tokens):
+        self.role, self.model, self.prompt_tokens = role, model, prompt_tokens
+        self.start = time.perf_counter()
+        self.attempts = 0
+        self.sleep_s = 0.0
+
+    def done(self, res=None, response_text="", cached=False, response_tokens=None, **extra):
+        usage = getattr(res, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None) or self.prompt_tokens
+        response_tokens = getattr(usage, "candidates_token_count", None) or response_tokens
+        if response_tokens is None and response_text:
+            from rate_limiter import estimate_tokens
+            response_tokens = estimate_tokens(response_text)
+        record(self.role, self.model, prompt_tokens, response_tokens or 0, time.perf_counter() - self.start,
+               self.attempts, self.sleep_s, cached=cached, **extra)
+
+    def fail(self, error):
+        record(self.role, self.model, self.prompt_tokens, 0, time.perf_counter() - self.start,
+               self.attempts, self.sleep_s, error=str(error)[:200])
+
+# ---------------------------------------------------------
+# 2. 実行サマリ（JSON / Prometheus textfile）
+# ---------------------------------------------------------
+def _totals(run):
+    totals = {k: 0 for k in ("calls", "errors", "cached", "prompt_tokens", "response_tokens", "attempts", "escalations")}
+    totals.update(latency_s=0.0, sleep_s=0.0)
+    for s in run["roles"].values():
+        for k in totals: totals[k] += s[k]
+    return totals
+
+def _write_atomic(path, text):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f: f.write(text)
+    os.replace(tmp_path, path)
+
+def _prom_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def _write_summary(run):
+    if not ENABLED or not run["roles"]: return
+    summary = {"engine": run["engine"], "run_id": run["id"], "started": run["started"],
+               "wall_s": round(time.time() - run["started"], 3), "totals": _totals(run),
+               "roles": sorted(run["roles"].values(), key=lambda s: -s["latency_s"])}
+    _write_atomic(os.path.join(run["dir"], "summary.json"), json.dumps(summary, ensure_ascii=False, indent=2))
+    if not PROM_FILE: return
+    lines = []
+    metrics = [("calls_total", "calls"), ("errors_total", "errors"), ("cache_hits_total", "cached"),
+               ("prompt_tokens_total", "prompt_tokens"), ("response_tokens_total", "response_tokens"),
+               ("attempts_total", "attempts"), ("latency_seconds_sum", "latency_s"), ("sleep_seconds_total", "sleep_s"),
+               ("escalations_total", "escalations")]
+    for metric, key in metrics:
+        lines.append(f"# TYPE mechwolf_llm_{metric} counter")
+        for s in run["roles"].values():
+            labels = f'engine="{_prom_label(run["engine"])}",role="{_prom_label(s["role"])}",model="{_prom_label(s["model"])}"'
+            lines.append(f"mechwolf_llm_{metric}{{{labels}}} {s[key]}")
+    _write_atomic(PROM_FILE, "\n".join(lines) + "\n")
+
+def finish_run():
+    """サマリを書き出し、合計値を返す。アーカイブへ移した run は閉じ、以後の record() は新しい run に記録する"""
+    global _run
+    with _lock:
+        run = _run
+        if run is None: return None
+        _write_summary(run)
+        if ENABLED and archive.ENABLED and os.path.isdir(run["dir"]):
+            archive.pack_run(run["dir"])
+            _run = None
+        return _totals(run)
+
+def retries():
+    return _retries
+
+def describe(totals):
+    if not totals: return "📊 LLM呼び出しなし"
+    return (f"📊 呼び出し {totals['calls']}回 (キャッシュ {totals['cached']}) / トークン {totals['prompt_tokens']}→{totals['response_tokens']}"
+            f" / 試行 {totals['attempts']} / 待機 {totals['sleep_s']:.1f}s / 昇格 {totals['escalations']} / エラー {totals['errors']}")
+
+atexit.register(finish_run)
@@ -0,0 +1,82 @@
+import os
+import queue
+import threading
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+# ---------------------------------------------------------
+# 指令ファイルの監視（デバウンス + 自己書き込み除外 + 作業キュー）
+# ---------------------------------------------------------
+DEBOUNCE_SEC = float(os.getenv("WATCH_DEBOUNCE_SEC", "2.0"))
+
+class OrderWatcher(FileSystemEventHandler):
+    """
+    order.txt の変更を一定時間まとめてから1回だけ作業キューへ積む。
+    ファクトリ自身が書き込むディレクトリ（workspace/, reviews/ など）のイベントは無視し、
+    LLM呼び出しを含む重い処理は専用のワーカースレッドで実行する（Observerスレッドは塞がない）。
+    """
+    def __init__(self, base_dir, callback, ignore_dirs=(), target_name="order.txt", debounce=DEBOUNCE_SEC, message=""):
+        self.base_dir = base_dir
+        self.callback = callback
+        self.message = message
+        self.ignore_dirs = [os.path.abspath(d) + os.sep for d in ignore_dirs]
+        self.target_name = target_name
+        self.debounce = debounce
+        self._timer = None
+        self._timer_lock = threading.Lock()
+        # 実行待ちは最大1件: 実行中に来たイベントは「次の1回」にまとめられる
+        self._pending = queue.Queue(maxsize=1)
+        self._observer = Observer()
+        self._worker = threading.Thread(target=self._work_loop, name="order-worker", daemon=True)
+
+    def _is_relevant(self, path):
+        if not path: return False
+        path = os.path.abspath(path)
+        if any(path.startswith(d) for d in self.ignore_dirs): return False
+        # 隠しディレクトリ（.llm_cache など）配下も自己書き込みとみなす
+        rel_parts = os.path.relpath(path, self.base_dir).split(os.sep)
+        if any(p.startswith(".") for p in rel_parts[:-1]): return False
+        return os.path.basename(path) == self.target_name
+
+    def on_any_event(self, event):
+        if event.is_directory or event.event_type not in ("created", "modified", "moved"): return
+        if not (self._is_relevant(event.src_path) or self._is_relevant(getattr(event, "dest_path", ""))): return
+        # デバウンス: 最後のイベントから debounce 秒静かになったら1回だけ発火
+        with self._timer_lock:
+            if self._timer: self._timer.cancel()
+            self._timer = threading.Timer(self.debounce, self._fire)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _fire(self):
+        if self.message: print(self.message)
+        self.trigger()
+
+    def trigger(self):
+        """作業キューへ1回分の実行を積む（既に待ちがあれば何もしない）"""
+        try:
+            self._pending.put_nowait(True)
+        except queue.Full:
+            pass
+
+    def _work_loop(self):
+        while True:
+            self._pending.get()
+            try:
+                self.callback()
+            except Exception as e:
+                print(f"❌ 監視ワーカーでエラー: {e}")
+
+    def start(self):
+        self._worker.start()
+        self._observer.schedule(self, self.base_dir, recursive=True)
+        self._observer.start()
+        return self
+
+    def stop(self):
+        with self._timer_lock:
+            if self._timer: self._timer.cancel()
+        self._observer.stop()
+
+    def join(self):
+        self._observer.join()